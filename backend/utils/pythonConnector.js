@@ -5,6 +5,7 @@
  */
 
 const axios = require('axios');
+const crypto = require('crypto');
 const FormData = require('form-data');
 const fs = require('fs');
 const path = require('path');
@@ -44,11 +45,13 @@ const analyzeImage = async (imagePath, options = {}) => {
       formData.append('confidence_threshold', options.confidenceThreshold);
     }
 
-    // Make request to FastAPI ML service
+    // Make request to FastAPI ML service. The same Idempotency-Key is sent on
+    // every retry so a timed-out request that completed is not analyzed twice
     const response = await makeMLRequest('/predict', formData, {
       headers: {
         ...formData.getHeaders(),
-        'Content-Type': 'multipart/form-data'
+        'Content-Type': 'multipart/form-data',
+        'Idempotency-Key': options.idempotencyKey || crypto.randomUUID()
       }
     });
 
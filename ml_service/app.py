@@ -1,27 +1,74 @@
-from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Depends, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 import shutil
 import os
-import numpy as np
-from pymongo import MongoClient
+import re
+import hmac
+import hashlib
+import json
+import tempfile
+import time
+import asyncio
+import anyio
+from PIL import Image
 from dotenv import load_dotenv, find_dotenv
 from datetime import datetime
+from typing import Optional
 from bson import ObjectId, Binary
 import jwt
-from utils.test import build_skin_profile, get_ingredients, recommend_products, knowledge_base, products, predict_skin_attributes
+from utils.test import get_ingredients, recommend_product_records, knowledge_base, product_records, predict_from_input
+from utils.test import active_model_files, preprocess_image, pixels_to_input, submit_predictions, InferenceTimeout
+from utils.test import model_registry, model_snapshot, model_versions, reload_model, start_manifest_poller
+from utils.model_registry import ReloadUnsupported
+from utils.test import shadow_predictions, tflite_runtime, warm_models
+from utils.storage import create_store
+from utils.uploads import receive_upload, UploadRejected, ReceivedUpload, decode_tensor_payload
+from utils.uploads import BodySizeLimitMiddleware
+from utils.serialization import FastJSONResponse, dumps
+from utils.log_config import configure_logging, start_request, payload_logging_enabled
+from utils.metrics import stage_timer, render_metrics, start_server_timing, server_timing_header, STAGE_SECONDS, ERRORS, REJECTIONS, IN_FLIGHT, POOL_THREADS
+from utils.metrics import mean_stage_seconds, QUALITY_CHECKS, QUALITY_FAILURES, QUALITY_SAVED_SECONDS
+from utils.profiling import start_profile, profiled_thread, save_profile
+from utils.jobs import JobQueue, JobFailed, QueueFull
+from utils.idempotency import IdempotencyStore, IdempotencyConflict
+from utils.quality import create_quality_gate
+from utils.routine_conflicts import ConflictGraph, parse_products
+from contextlib import asynccontextmanager
 import logging
 from fastapi import Security
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 
 
-logger = logging.getLogger("auth")
-logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger("ml_service")
 bearer_scheme = HTTPBearer()
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Started per worker process (after any prefork), never at import time
+    global job_queue
+    job_queue = JobQueue(JOB_DB_PATH, JOB_DIR, process_job, workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED)
+    job_queue.start()
+    # Load and warm the models now rather than on the first request (serve.py
+    # workers already did; this covers a plain `uvicorn app:app`)
+    try:
+        await run_in_threadpool(warm_models)
+    except Exception as e:
+        logger.error("Model warm-up failed, models will load on first use: %s", e)
+    # Admin reloads only reach the worker that served them; polling keeps every worker current
+    poller = start_manifest_poller(MODEL_MANIFEST_POLL_SECONDS) if MODEL_MANIFEST_POLL_SECONDS > 0 else None
+    try:
+        yield
+    finally:
+        if poller is not None:
+            poller.stop()
+        job_queue.stop()
+
+
+app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
 
 origins = [
     "https://lumiskin-skincare.netlify.app",
@@ -47,29 +94,98 @@ MONGO_URL = os.getenv("MONGO_URL")
 MONGO_DB = os.getenv("MONGO_DB", "test")
 MONGO_COLLECTION = os.getenv("MONGO_COLLECTION", "analysis")
 JWT_SECRET = os.getenv("JWT_SECRET", "mySuperSecretKey123!")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "analysis.db")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", 1024 * 1024))
+UPLOAD_DIR = os.getenv("UPLOAD_DIR") or None
+# Room for the quiz form fields and multipart boundaries around the image
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.05"))
+# Admin-only features (request profiling) are disabled unless a token is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "lumiskin_profiles"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9._-]{1,64}")
+# Asynchronous analysis jobs (POST /analyze/jobs)
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.db")
+JOB_DIR = os.getenv("JOB_DIR", os.path.join(tempfile.gettempdir(), "lumiskin_jobs"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "200"))
+JOB_MAX_WAIT_SECONDS = 30
+job_queue = None
+# Results remembered for Idempotency-Key retries (per worker process)
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", 24 * 3600))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+# Pre-inference image quality gate: "flag" (annotate the result), "reject" (422, opt-in) or "off"
+QUALITY_GATE_MODE = os.getenv("QUALITY_GATE_MODE", "flag").lower()
+# Time budget for a request's analysis, from the moment it is accepted
+ANALYSIS_DEADLINE_SECONDS = float(os.getenv("ANALYSIS_DEADLINE_SECONDS", "20"))
+# Check MODEL_MANIFEST / the hub for new model versions this often (0 = only on admin reload)
+MODEL_MANIFEST_POLL_SECONDS = float(os.getenv("MODEL_MANIFEST_POLL_SECONDS", "0"))
+# Products accepted by one POST /routine/conflicts (pairs grow quadratically)
+ROUTINE_MAX_PRODUCTS = int(os.getenv("ROUTINE_MAX_PRODUCTS", "500"))
+
+configure_logging(LOG_LEVEL, debug_sample_rate=LOG_DEBUG_SAMPLE_RATE)
+
+# Analysis storage (MongoDB by default, embedded SQLite for edge boxes / load tests)
+store = create_store(
+    STORAGE_BACKEND,
+    mongo_url=MONGO_URL,
+    mongo_db=MONGO_DB,
+    mongo_collection=MONGO_COLLECTION,
+    sqlite_path=SQLITE_PATH,
+)
+idempotency_store = IdempotencyStore(IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_KEYS)
+conflict_graph = ConflictGraph.from_knowledge_base()
+quality_gate = create_quality_gate(
+    QUALITY_GATE_MODE,
+    min_sharpness=float(os.getenv("QUALITY_MIN_SHARPNESS", "15")),
+    min_brightness=float(os.getenv("QUALITY_MIN_BRIGHTNESS", "40")),
+    max_brightness=float(os.getenv("QUALITY_MAX_BRIGHTNESS", "220")),
+    max_clipped_fraction=float(os.getenv("QUALITY_MAX_CLIPPED_FRACTION", "0.5")),
+    require_face=os.getenv("QUALITY_REQUIRE_FACE", "false").lower() in ("true", "1", "yes"),
+)
+
 
-# Connect Mongo
-client = MongoClient(MONGO_URL)
-db = client[MONGO_DB]
-collection = db[MONGO_COLLECTION]
 
+def is_admin(token: str) -> bool:
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token or "", ADMIN_TOKEN)
 
 
-def to_python(obj):
-    if isinstance(obj, (np.int64, np.int32)):
-        return int(obj)
-    elif isinstance(obj, (np.float32, np.float64)):
-        return float(obj)
-    elif isinstance(obj, (np.bool_)):
-        return bool(obj)
-    elif isinstance(obj, np.ndarray):
-        return obj.tolist()
-    elif isinstance(obj, ObjectId):
-        return str(obj)
-    elif isinstance(obj, datetime): 
-        return obj.isoformat()
-    return obj
+# Per-request context: correlation id (echoed as X-Request-ID), Server-Timing
+# breakdown and, for admins sending X-Profile, a sampling profile of the request
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    supplied_id = request.headers.get("x-request-id", "")
+    request_id = start_request(supplied_id if REQUEST_ID_PATTERN.fullmatch(supplied_id) else None)
+    timings = start_server_timing()
 
+    session = None
+    if ADMIN_TOKEN and "x-profile" in request.headers and is_admin(request.headers.get("x-admin-token")):
+        session = start_profile(PROFILE_INTERVAL_MS / 1000)
+
+    try:
+        response = await call_next(request)
+    finally:
+        if session is not None:
+            session.stop()
+
+    response.headers["X-Request-ID"] = request_id
+    if timings:
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    if session is not None:
+        name = await run_in_threadpool(save_profile, session, PROFILE_DIR, request_id)
+        response.headers["X-Profile-Id"] = name
+    return response
+
+
+# Refuse oversized uploads before the multipart body is parsed: from Content-Length
+# when it is sent, otherwise by counting the (chunked) body as it streams in
+app.add_middleware(BodySizeLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES,
+                   detail=f"File exceeds the {MAX_UPLOAD_BYTES} byte limit")
 
 
 # JWT dependency
@@ -88,7 +204,158 @@ def get_current_user_id(credentials: HTTPAuthorizationCredentials = Security(bea
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-# POST /analyze/
+def str_to_bool(value: str) -> bool:
+    return str(value).lower() in ("true", "1", "yes")
+
+
+def build_user_quiz(skin_type, sensitivity, budget, preferences, dryness, redness) -> dict:
+    prefs_list = [p.strip() for p in preferences.split(",")] if preferences else []
+    return {
+        "dryness": str_to_bool(dryness),
+        "redness": str_to_bool(redness),
+        "skin_type": skin_type,
+        "sensitivity": sensitivity,
+        "budget": int(budget),
+        "preferences": prefs_list,
+    }
+
+
+def load_model_input(upload):
+    """Decode and preprocess the upload for the models (400 if it is not a readable image)"""
+    try:
+        return preprocess_image(upload.source())
+    except (OSError, ValueError, Image.DecompressionBombError):
+        REJECTIONS.labels("invalid_image").inc()
+        raise HTTPException(status_code=400, detail="Invalid image file")
+
+
+def check_quality(img):
+    """
+    Run the quality gate on a preprocessed input before any model sees it
+
+    Returns:
+        dict: The quality report to attach to the result, or None when the gate is off
+
+    Raises:
+        HTTPException: 422 with the failure reasons when the gate rejects the image
+    """
+    if quality_gate is None:
+        return None
+    with stage_timer("quality"):
+        report = quality_gate.check(img)
+    if report.passed:
+        QUALITY_CHECKS.labels("pass").inc()
+        return report.as_dict()
+
+    for reason in report.reasons:
+        QUALITY_FAILURES.labels(reason).inc()
+    if QUALITY_GATE_MODE == "flag":
+        QUALITY_CHECKS.labels("flag").inc()
+        return report.as_dict()
+    QUALITY_CHECKS.labels("reject").inc()
+    QUALITY_SAVED_SECONDS.inc(sum(mean_stage_seconds("inference", name) for name in active_model_files()))
+    raise HTTPException(status_code=422, detail={"error": "Image quality too low for analysis", **report.as_dict()})
+
+
+def snapshot_before(deadline: float) -> dict:
+    """
+    model_snapshot(), failing with 504 if (re)loading the models used up the deadline
+
+    A cold or evicted model is loaded, checksummed and warmed inside the
+    snapshot, which cannot be interrupted; the request fails as soon as it returns.
+    """
+    models = model_snapshot()
+    if time.monotonic() >= deadline:
+        logger.warning("Analysis deadline exceeded while loading models")
+        ERRORS.labels("timeout").inc()
+        raise HTTPException(status_code=504, detail="Analysis timed out")
+    return models
+
+
+def predict_before(img, deadline: float, models: dict) -> dict:
+    """Concurrent four-model inference; 504 when it does not finish by `deadline`"""
+    try:
+        return predict_from_input(img, deadline, models)
+    except InferenceTimeout as e:
+        logger.warning("Inference deadline exceeded: %s", e)
+        ERRORS.labels("timeout").inc()
+        raise HTTPException(status_code=504, detail="Analysis timed out")
+
+
+def recommend_for(full_profile: dict):
+    """Recommended ingredients and top products for a merged quiz + model profile"""
+    with stage_timer("ingredients"):
+        ingredients_to_use = get_ingredients(full_profile, knowledge_base)
+    with stage_timer("recommend"):
+        top_products = recommend_product_records(full_profile, ingredients_to_use, product_records)
+    return ingredients_to_use, top_products
+
+
+def save_analysis(user_id, full_profile: dict, ingredients_to_use, top_products, versions: dict,
+                  image_quality=None) -> dict:
+    """Store the analysis document, with the model versions that produced it, and return it with its `_id`"""
+    response = {
+        "user_id": str(user_id),
+        "skin_profile": full_profile,
+        "recommended_ingredients": ingredients_to_use,
+        "recommended_products": top_products,
+        "model_versions": versions,
+        "created_at": datetime.utcnow(),
+        # "image": Binary(image_bytes),
+        # "image_content_type": file.content_type,
+    }
+    if image_quality is not None:
+        response["image_quality"] = image_quality
+    if payload_logging_enabled(logger):
+        logger.debug("Response to be stored", extra={"payload": response})
+    try:
+        with stage_timer("db_insert"):
+            inserted_id = store.insert_one(response)
+        logger.info("Inserted document id: %s", inserted_id)
+    except Exception as e:
+        logger.error("Storage insert error: %s", e)
+        ERRORS.labels("storage").inc()
+        raise HTTPException(status_code=500, detail="Database insertion error")
+    # Safe response without image
+    safe_response = {"_id": inserted_id, **response}
+    safe_response.pop("image", None)
+    return safe_response
+
+
+@profiled_thread
+def run_analysis(upload, user_quiz: dict, user_id, deadline: Optional[float] = None) -> dict:
+    """
+    Blocking part of /analyze/: decode, inference, recommendation and storage.
+    Runs in the worker thread pool so the event loop stays free.
+    """
+    if deadline is None:
+        deadline = time.monotonic() + ANALYSIS_DEADLINE_SECONDS
+    # Pin the serving model versions: a hot swap mid-request does not mix versions
+    models = snapshot_before(deadline)
+    # Decode (at reduced resolution) and preprocess; unreadable images are a 400
+    img = load_model_input(upload)
+    image_quality = check_quality(img)
+
+    # Predict skin attributes from image and combine with the quiz answers
+    skin_attributes = predict_before(img, deadline, models)
+    if payload_logging_enabled(logger):
+        logger.debug("Predicted skin attributes", extra={"payload": skin_attributes})
+    full_profile = {**user_quiz, **skin_attributes}
+
+    # Get recommended ingredients and products
+    ingredients_to_use, top_products = recommend_for(full_profile)
+    return save_analysis(user_id, full_profile, ingredients_to_use, top_products, model_versions(models),
+                         image_quality)
+
+
+def request_fingerprint(user_quiz: dict, upload) -> str:
+    """Digest of an analyze request, to spot an Idempotency-Key reused for another payload"""
+    digest = hashlib.sha256(json.dumps(user_quiz, sort_keys=True).encode())
+    digest.update(upload.sha256.encode())
+    return digest.hexdigest()
+
+
+# POST /analyze/ (honours an optional Idempotency-Key header)
 @app.post("/analyze/")
 async def analyze(
     file: UploadFile = File(...),
@@ -98,89 +365,384 @@ async def analyze(
     preferences: str = Form("fragrance-free"),
     dryness: str = Form("false"),
     redness: str = Form("false"),
-    user_id: str = Depends(get_current_user_id)
+    user_id: str = Depends(get_current_user_id),
+    idempotency_key: str = Header("", alias="Idempotency-Key"),
 ):
-    def str_to_bool(value: str) -> bool:
-        return str(value).lower() in ("true", "1", "yes")
-
     if not file.content_type.startswith("image/"):
+        REJECTIONS.labels("not_image").inc()
         return JSONResponse(status_code=400, content={"error": "File must be an image"})
 
-    temp_file_path = f"temp_{file.filename}"
-    try:
-        # Save temporary file
-        
-        image_bytes = await file.read()
-        if not image_bytes:
-            raise HTTPException(status_code=400, detail="Empty file")
-
-        # Save temp file
-        with open(temp_file_path, "wb") as f:
-            f.write(image_bytes)
-
-        # Validate that the image can be read
-        import cv2
-        img = cv2.imread(temp_file_path)
-        if img is None:
-            raise HTTPException(status_code=400, detail="Invalid image file")
-
-
-
-        # User quiz preferences
-        prefs_list = [p.strip() for p in preferences.split(",")] if preferences else []
-        user_quiz = {
-            "dryness": str_to_bool(dryness),
-            "redness": str_to_bool(redness),
-            "skin_type": skin_type,
-            "sensitivity": sensitivity,
-            "budget": int(budget),
-            "preferences": prefs_list,
-        }
-
-        # Build skin profile from quiz + image
-        profile = build_skin_profile(temp_file_path, user_quiz)
-        logger.debug(f"Built skin profile: {profile}")
-        # Predict skin attributes from image
-        skin_attributes = predict_skin_attributes(temp_file_path)
-        logger.debug(f"Predicted skin attributes: {skin_attributes}")
-        # Combine profile with predicted attributes
-        full_profile = {**profile, **skin_attributes}
-
-        # Get recommended ingredients and products
-        ingredients_to_use = get_ingredients(full_profile, knowledge_base)
-        top_products = recommend_products(full_profile, ingredients_to_use, products)
-        top_products_dicts = top_products.to_dict(orient="records")
-
-        # Build response
-        response = {
-            "user_id": str(user_id),
-            "skin_profile": {k: to_python(v) for k, v in full_profile.items()},
-            "recommended_ingredients": [to_python(i) for i in ingredients_to_use],
-            "recommended_products": [{k: to_python(v) for k, v in product.items()} for product in top_products_dicts],
-            "created_at": datetime.utcnow(),
-            # "image": Binary(image_bytes),
-            # "image_content_type": file.content_type,
-        }
-        logger.debug(f"Response to be stored: {response}")
+    deadline = time.monotonic() + ANALYSIS_DEADLINE_SECONDS
+    IN_FLIGHT.inc()
+    try:
+        try:
+            with stage_timer("upload_read"):
+                upload = await receive_upload(file, MAX_UPLOAD_BYTES, UPLOAD_SPOOL_BYTES, spool_dir=UPLOAD_DIR)
+        except UploadRejected as e:
+            REJECTIONS.labels(e.reason).inc()
+            return JSONResponse(status_code=e.status_code, content={"error": e.detail})
+        if not upload.in_memory:
+            STAGE_SECONDS.labels("temp_write", "").observe(upload.write_seconds)
+
+        # Set once an idempotent run takes the upload over; that run, not this
+        # handler (which a disconnect may cancel first), then cleans it up
+        handed_over = False
+        try:
+            user_quiz = build_user_quiz(skin_type, sensitivity, budget, preferences, dryness, redness)
+            if not idempotency_key:
+                safe_response = await run_in_threadpool(run_analysis, upload, user_quiz, user_id, deadline)
+                with stage_timer("serialize"):
+                    return FastJSONResponse(safe_response)
+
+            if len(idempotency_key) > 255:
+                return JSONResponse(status_code=400, content={"error": "Idempotency-Key is too long"})
+            fingerprint = request_fingerprint(user_quiz, upload)
+
+            async def owned_run():
+                try:
+                    return await run_in_threadpool(run_analysis, upload, user_quiz, user_id, deadline)
+                finally:
+                    upload.cleanup()
+
+            def start_run():
+                nonlocal handed_over
+                handed_over = True
+                return owned_run()
+
+            try:
+                safe_response, replayed = await idempotency_store.run(
+                    str(user_id), idempotency_key, fingerprint, start_run)
+            except IdempotencyConflict as e:
+                return JSONResponse(status_code=422, content={"error": str(e)})
+            with stage_timer("serialize"):
+                return FastJSONResponse(safe_response, headers={"Idempotent-Replayed": str(replayed).lower()})
+
+        except HTTPException:
+            raise
+
+        except Exception as e:
+            logger.error("Analyze error: %s", e)
+            ERRORS.labels("internal").inc()
+            return JSONResponse(status_code=500, content={"error": str(e)})
+
+        finally:
+            if not handed_over:
+                upload.cleanup()
+    finally:
+        IN_FLIGHT.dec()
+
+
+@profiled_thread
+def run_tensor_analysis(pixels, user_quiz: dict, user_id, deadline: float) -> dict:
+    """run_analysis() for pre-resized pixels: no decode, no resize"""
+    models = snapshot_before(deadline)
+    with stage_timer("preprocess"):
+        img = pixels_to_input(pixels)
+    image_quality = check_quality(img)
+    skin_attributes = predict_before(img, deadline, models)
+    full_profile = {**user_quiz, **skin_attributes}
+    ingredients_to_use, top_products = recommend_for(full_profile)
+    return save_analysis(user_id, full_profile, ingredients_to_use, top_products, model_versions(models),
+                         image_quality)
+
+
+# POST /internal/analyze/tensor (pre-resized 224x224x3 uint8 RGB pixels)
+@app.post("/internal/analyze/tensor", include_in_schema=False)
+async def analyze_tensor(request: Request, user_id: str = Depends(get_current_user_id)):
+    """
+    Internal variant of /analyze/ for callers that already decoded and resized
+    the selfie. The body is a 4-byte big-endian header length, a JSON header
+    with the quiz fields plus shape/dtype, then exactly 224*224*3 pixel bytes
+    (see utils.uploads.encode_tensor_payload).
+    """
+    if request.headers.get("content-type", "").split(";")[0] != "application/octet-stream":
+        REJECTIONS.labels("not_tensor").inc()
+        return JSONResponse(status_code=415, content={"error": "Body must be application/octet-stream"})
+
+    deadline = time.monotonic() + ANALYSIS_DEADLINE_SECONDS
+    IN_FLIGHT.inc()
+    try:
+        with stage_timer("upload_read"):
+            body = await request.body()
         try:
-            result = collection.insert_one(response)
-            logger.info(f"Inserted document id: {result.inserted_id}")
+            fields, pixels = decode_tensor_payload(body)
+            user_quiz = build_user_quiz(
+                fields.get("skin_type", "oily"),
+                fields.get("sensitivity", "mild"),
+                fields.get("budget", 1500),
+                fields.get("preferences", "fragrance-free"),
+                fields.get("dryness", "false"),
+                fields.get("redness", "false"),
+            )
+        except UploadRejected as e:
+            REJECTIONS.labels(e.reason).inc()
+            return JSONResponse(status_code=e.status_code, content={"error": e.detail})
+        except (TypeError, ValueError, AttributeError):
+            REJECTIONS.labels("bad_tensor").inc()
+            return JSONResponse(status_code=422, content={"error": "Invalid quiz fields in tensor header"})
+
+        try:
+            safe_response = await run_in_threadpool(run_tensor_analysis, pixels, user_quiz, user_id, deadline)
+            with stage_timer("serialize"):
+                return FastJSONResponse(safe_response)
+        except HTTPException:
+            raise
         except Exception as e:
-            logger.error(f"MongoDB insert error: {e}")
-            raise HTTPException(status_code=500, detail="Database insertion error")
-        # Safe response without image
-        safe_response = {k: to_python(v) for k, v in {"_id": str(result.inserted_id), **response}.items()}
-        safe_response.pop("image", None)
+            logger.error("Tensor analyze error: %s", e)
+            ERRORS.labels("internal").inc()
+            return JSONResponse(status_code=500, content={"error": str(e)})
+    finally:
+        IN_FLIGHT.dec()
 
-        return safe_response
 
+# POST /analyze/stream (Server-Sent Events)
+@app.post("/analyze/stream")
+async def analyze_stream(
+    file: UploadFile = File(...),
+    skin_type: str = Form("oily"),
+    sensitivity: str = Form("mild"),
+    budget: int = Form(1500),
+    preferences: str = Form("fragrance-free"),
+    dryness: str = Form("false"),
+    redness: str = Form("false"),
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Same analysis as /analyze/, streamed as it progresses. Events, in order:
+    accepted, one `model` event per model as soon as it finishes (the four
+    models run concurrently), ingredients, products, then done with the
+    stored document id. Failures after the upload is accepted are sent as an
+    `error` event, since the 200 status has already gone out.
+    """
+    if not file.content_type.startswith("image/"):
+        REJECTIONS.labels("not_image").inc()
+        return JSONResponse(status_code=400, content={"error": "File must be an image"})
+
+    try:
+        with stage_timer("upload_read"):
+            upload = await receive_upload(file, MAX_UPLOAD_BYTES, UPLOAD_SPOOL_BYTES, spool_dir=UPLOAD_DIR)
+    except UploadRejected as e:
+        REJECTIONS.labels(e.reason).inc()
+        return JSONResponse(status_code=e.status_code, content={"error": e.detail})
+    user_quiz = build_user_quiz(skin_type, sensitivity, budget, preferences, dryness, redness)
+    deadline = time.monotonic() + ANALYSIS_DEADLINE_SECONDS
+
+    return StreamingResponse(
+        stream_analysis(upload, user_quiz, user_id, deadline),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def sse_event(event: str, data) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+
+
+async def stream_analysis(upload, user_quiz: dict, user_id, deadline: float):
+    IN_FLIGHT.inc()
+    try:
+        yield sse_event("accepted", {"size": upload.size, "format": upload.image_format})
+        models = await run_in_threadpool(snapshot_before, deadline)
+
+        img = await run_in_threadpool(load_model_input, upload)
+        image_quality = await run_in_threadpool(check_quality, img)
+        if image_quality is not None:
+            yield sse_event("quality", image_quality)
+
+        # Same shared inference pool and deadline as /analyze/
+        futures = list(submit_predictions(img, models))
+        skin_attributes = {}
+        try:
+            remaining = max(0.0, deadline - time.monotonic())
+            for next_done in asyncio.as_completed([asyncio.wrap_future(f) for f in futures], timeout=remaining):
+                for attribute, value in (await next_done).items():
+                    skin_attributes[attribute] = value
+                    yield sse_event("model", {"attribute": attribute, "value": value})
+        except asyncio.TimeoutError:
+            ERRORS.labels("timeout").inc()
+            raise HTTPException(status_code=504, detail="Analysis timed out")
+        finally:
+            for future in futures:
+                future.cancel()
+        shadow_predictions(img, skin_attributes)
+        full_profile = {**user_quiz, **skin_attributes}
+
+        ingredients_to_use, top_products = await run_in_threadpool(recommend_for, full_profile)
+        yield sse_event("ingredients", ingredients_to_use)
+        yield sse_event("products", top_products)
+
+        saved = await run_in_threadpool(save_analysis, user_id, full_profile, ingredients_to_use, top_products,
+                                        model_versions(models), image_quality)
+        yield sse_event("done", {"_id": saved["_id"], "skin_profile": full_profile})
+
+    except HTTPException as e:
+        yield sse_event("error", {"status": e.status_code, "error": e.detail})
     except Exception as e:
-        logger.error(f"Analyze error: {e}")
-        return JSONResponse(status_code=500, content={"error": str(e)})
+        logger.error("Analyze stream error: %s", e)
+        ERRORS.labels("internal").inc()
+        yield sse_event("error", {"status": 500, "error": str(e)})
+    finally:
+        upload.cleanup()
+        IN_FLIGHT.dec()
+
+
+def process_job(job: dict) -> dict:
+    """JobQueue handler: run the regular analysis on a queued job's stored image"""
+    params = job["params"]
+    upload = ReceivedUpload(os.path.getsize(job["image_path"]), params["image_format"], path=job["image_path"])
+    try:
+        return run_analysis(upload, params["user_quiz"], params["user_id"])
+    except HTTPException as e:
+        if e.status_code < 500:
+            raise JobFailed(e.detail)
+        raise
+
 
+# POST /analyze/jobs
+@app.post("/analyze/jobs", status_code=202)
+async def submit_analysis_job(
+    file: UploadFile = File(...),
+    skin_type: str = Form("oily"),
+    sensitivity: str = Form("mild"),
+    budget: int = Form(1500),
+    preferences: str = Form("fragrance-free"),
+    dryness: str = Form("false"),
+    redness: str = Form("false"),
+    user_id: str = Depends(get_current_user_id)
+):
+    if not file.content_type.startswith("image/"):
+        REJECTIONS.labels("not_image").inc()
+        return JSONResponse(status_code=400, content={"error": "File must be an image"})
+
+    try:
+        upload = await receive_upload(file, MAX_UPLOAD_BYTES, UPLOAD_SPOOL_BYTES, spool_dir=UPLOAD_DIR)
+    except UploadRejected as e:
+        REJECTIONS.labels(e.reason).inc()
+        return JSONResponse(status_code=e.status_code, content={"error": e.detail})
+
+    params = {
+        "user_id": str(user_id),
+        "image_format": upload.image_format,
+        "user_quiz": build_user_quiz(skin_type, sensitivity, budget, preferences, dryness, redness),
+    }
+    try:
+        job_id = await run_in_threadpool(
+            job_queue.submit, str(user_id), params,
+            upload.data if upload.in_memory else upload.path, upload.image_format)
+    except QueueFull:
+        REJECTIONS.labels("queue_full").inc()
+        return JSONResponse(status_code=503, content={"error": "Analysis queue is full, retry later"},
+                            headers={"Retry-After": "5"})
     finally:
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        upload.cleanup()
+
+    return FastJSONResponse({"job_id": job_id, "status": "queued", "status_url": f"/analyze/jobs/{job_id}"},
+                            status_code=202)
+
+
+# GET /analyze/jobs/{job_id}?wait=<seconds> (long-poll until the job finishes)
+@app.get("/analyze/jobs/{job_id}")
+async def get_analysis_job(job_id: str, wait: float = 0, user_id: str = Depends(get_current_user_id)):
+    deadline = time.monotonic() + max(0.0, min(wait, JOB_MAX_WAIT_SECONDS))
+    delay = 0.05
+    while True:
+        job = await run_in_threadpool(job_queue.get, job_id)
+        if job is None or job["user_id"] != str(user_id):
+            raise HTTPException(status_code=404, detail="Job not found")
+        if job["status"] in ("done", "failed") or time.monotonic() >= deadline:
+            return FastJSONResponse(job)
+        # Jobs may finish in another worker process, so poll with backoff
+        await asyncio.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+        delay = min(delay * 2, 1.0)
+
+
+# GET /analyze/history
+@app.get("/analyze/history")
+def analysis_history(limit: int = 20, user_id: str = Depends(get_current_user_id)):
+    limit = max(1, min(limit, 100))
+    docs = store.find_by_user(str(user_id), limit=limit)
+    return FastJSONResponse(docs)
+
+
+def check_routine(products):
+    """Runs in the thread pool: a large shelf takes long enough to stall the event loop"""
+    with stage_timer("conflict_check"):
+        return conflict_graph.check(products)
+
+
+# POST /routine/conflicts (incompatible products in a routine, or a whole shelf)
+@app.post("/routine/conflicts")
+async def routine_conflicts(request: Request, user_id: str = Depends(get_current_user_id)):
+    """
+    Body: {"products": [{"name": ..., "ingredients": [...], "when": "am" | "pm" | "both"}]}.
+    Leave out "when" to check a shelf, where every product may meet every other.
+    """
+    try:
+        products = parse_products(await request.json(), ROUTINE_MAX_PRODUCTS)
+    except ValueError as e:  # includes malformed JSON
+        REJECTIONS.labels("bad_routine").inc()
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    report = await run_in_threadpool(check_routine, products)
+    return FastJSONResponse(report)
+
+
+# GET /admin/profiles/{profile_id} (folded stacks of a profiled request)
+@app.get("/admin/profiles/{profile_id}")
+def get_profile(profile_id: str, x_admin_token: str = Header("")):
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+    path = os.path.join(PROFILE_DIR, os.path.basename(profile_id))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    with open(path) as f:
+        return PlainTextResponse(f.read())
+
+
+# GET /admin/models (serving version of each model)
+@app.get("/admin/models")
+def list_models(x_admin_token: str = Header("")):
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+    return {"pid": os.getpid(), "runtime": tflite_runtime(), "models": model_registry.describe(),
+            "resident_bytes": model_registry.resident_bytes(), "budget_bytes": model_registry.budget_bytes}
+
+
+# POST /admin/models/{name}/reload (load and warm the newest version, then swap it in)
+@app.post("/admin/models/{name}/reload")
+def reload_model_version(name: str, force: bool = False, x_admin_token: str = Header("")):
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+    previous = model_registry.version(name)
+    try:
+        model = reload_model(name, force=force)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown model: {name}")
+    except ReloadUnsupported as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error("Model %s reload failed: %s", name, e)
+        raise HTTPException(status_code=502, detail=f"Reload failed, still serving {previous}: {e}")
+    # Only this worker process swapped; others follow via MODEL_MANIFEST_POLL_SECONDS
+    version = model_registry.version(name)
+    return {"pid": os.getpid(), "previous_version": previous, "swapped": version != previous,
+            **model_registry.describe()[name]}
+
+
+# GET /health
+@app.get("/health")
+async def health():
+    return {"status": "ok", "pid": os.getpid()}
+
+
+# GET /metrics (Prometheus text format)
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 
+def _thread_limiter():
+    return anyio.to_thread.current_default_thread_limiter()
 
 
+POOL_THREADS.set_function(lambda: _thread_limiter().borrowed_tokens, "request", "busy")
+POOL_THREADS.set_function(lambda: _thread_limiter().total_tokens, "request", "size")
@@ -0,0 +1,4 @@
+"""
+Benchmarks
+Standalone measurement scripts for the ML service (run with `python -m benchmarks.<name>`)
+"""
@@ -0,0 +1,137 @@
+"""
+Reduced-resolution decode benchmark
+
+Compares the previous input path (full OpenCV decode to validate the upload,
+then a full keras load_img decode and resize) with preprocess_image(), which
+decodes JPEGs at a reduced scale via PIL draft(). Each variant runs in a fresh
+process so its peak RSS is measured on its own.
+
+Uses the JPEG/WebP/PNG files in --corpus, or synthetic phone-sized selfies:
+
+    python -m benchmarks.decode_bench --megapixels 3 12 48
+    python -m benchmarks.decode_bench --corpus ~/selfies
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import resource
+import time
+
+import numpy as np
+
+from benchmarks.tensor_bench import make_selfie
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def legacy_preprocess(data):
+    import cv2
+    from tensorflow.keras.utils import load_img, img_to_array
+
+    if cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) is None:
+        raise ValueError("invalid image")
+    img = load_img(io.BytesIO(data), target_size=(224, 224))
+    img = img_to_array(img) / 255.0
+    return np.expand_dims(img, axis=0).astype(np.float32)
+
+
+def reduced_preprocess(data):
+    from utils.test import preprocess_image
+
+    return preprocess_image(io.BytesIO(data))
+
+
+VARIANTS = {"legacy": legacy_preprocess, "reduced": reduced_preprocess}
+
+
+def peak_rss_kb():
+    """Peak RSS of this process (VmHWM; ru_maxrss where /proc is unavailable)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def reset_peak_rss():
+    # ru_maxrss survives exec, so a spawned child would report the parent's
+    # peak; on Linux, writing 5 to clear_refs resets VmHWM to the current RSS
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _measure(variant, images, repeat, queue):
+    fn = VARIANTS[variant]
+    fn(make_selfie(0.05))  # imports and warm-up on a tiny image, before the baseline
+    reset_peak_rss()
+    baseline_kb = peak_rss_kb()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for data in images:
+            fn(data)
+    elapsed = time.perf_counter() - start
+    peak_kb = peak_rss_kb()
+    queue.put({"ms_per_image": elapsed * 1000 / (repeat * len(images)),
+               "peak_rss_growth_mb": max(0, peak_kb - baseline_kb) / 1024})
+
+
+def measure(variant, images, repeat):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_measure, args=(variant, images, repeat, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def load_corpus(directory):
+    images = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(directory, name), "rb") as f:
+                images.append(f.read())
+    if not images:
+        raise SystemExit(f"No images in {directory}")
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--corpus", help="directory of real selfies (JPEG/WebP/PNG)")
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[3, 12, 48])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpora = {os.path.basename(os.path.normpath(args.corpus)): load_corpus(args.corpus)}
+    else:
+        corpora = {f"{mp:g}MP": [make_selfie(mp)] for mp in args.megapixels}
+
+    results = []
+    for label, images in corpora.items():
+        legacy = measure("legacy", images, args.repeat)
+        reduced = measure("reduced", images, args.repeat)
+        results.append({
+            "corpus": label,
+            "images": len(images),
+            "legacy_ms": round(legacy["ms_per_image"], 2),
+            "reduced_ms": round(reduced["ms_per_image"], 2),
+            "speedup": round(legacy["ms_per_image"] / reduced["ms_per_image"], 1),
+            "legacy_peak_rss_growth_mb": round(legacy["peak_rss_growth_mb"], 1),
+            "reduced_peak_rss_growth_mb": round(reduced["peak_rss_growth_mb"], 1),
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Knowledge-base lookup benchmark
+
+Checks that the compiled indexes in utils.ingredient_knowledge_base answer
+exactly like the original dict-walking implementations (kept here as the
+reference) for every concern, skin type and sensitivity, then times both:
+
+    python -m benchmarks.knowledge_base_bench --iterations 20000
+
+Lists whose order came from a set in the reference are compared as sets.
+The compatibility and usage-time references walk the tables too, but match
+names canonically (as the indexes now do) rather than by exact key.
+"""
+
+import argparse
+import itertools
+import json
+import random
+import time
+
+from utils import ingredient_knowledge_base as kb
+
+SENSITIVITIES = ("low", "medium", "high", "unknown")
+
+
+# --------------------------------------------------------
+# Reference: the pre-index implementations
+# --------------------------------------------------------
+def reference_ingredients_for_concern(concern, skin_type="normal", sensitivity="low"):
+    if concern not in kb.CONCERN_TO_INGREDIENTS:
+        return {"recommended": [], "avoid": [], "strength_levels": {}}
+    concern_data = kb.CONCERN_TO_INGREDIENTS[concern]
+    recommended = concern_data["recommended"].copy()
+    avoid = concern_data["avoid_if_sensitive"].copy()
+    skin_type_data = kb.SKIN_TYPE_RECOMMENDATIONS.get(skin_type, {})
+    avoid.extend(skin_type_data.get("avoid_ingredients", []))
+    if sensitivity in ["medium", "high"]:
+        strong_ingredients = ["retinol", "high percentage acids", "benzoyl peroxide"]
+        recommended = [ing for ing in recommended if ing not in strong_ingredients]
+    return {"recommended": recommended, "avoid": list(set(avoid)),
+            "strength_levels": concern_data.get("strength_levels", {})}
+
+
+def reference_product_recommendations(concerns, skin_type="normal", budget="medium", sensitivity="low",
+                                      product_type=None):
+    all_ingredients, avoid_ingredients = [], []
+    for concern in concerns:
+        concern_data = reference_ingredients_for_concern(concern, skin_type, sensitivity)
+        all_ingredients.extend(concern_data["recommended"])
+        avoid_ingredients.extend(concern_data["avoid"])
+    all_ingredients = list(set(all_ingredients))
+    avoid_ingredients = list(set(avoid_ingredients))
+    final_ingredients = [ing for ing in all_ingredients if ing not in avoid_ingredients]
+    categories = [product_type] if product_type else list(kb.PRODUCT_CATEGORIES.keys())
+    return {"ingredients": final_ingredients, "avoid_ingredients": avoid_ingredients,
+            "product_categories": categories, "budget": kb.BUDGET_TIERS.get(budget, kb.BUDGET_TIERS["medium"]),
+            "skin_type": skin_type, "sensitivity": sensitivity, "concerns": concerns}
+
+
+def reference_ids(name):
+    ingredient = kb.canonical_ingredient(name)
+    groups = [kb.canonical_ingredient(group) for group, members in kb.INGREDIENT_GROUPS.items()
+              if ingredient in [kb.canonical_ingredient(m) for m in members]]
+    return [ingredient] + groups
+
+
+def reference_compatibility(ingredient1, ingredient2):
+    for first in reference_ids(ingredient1):
+        for second in reference_ids(ingredient2):
+            for key, data in kb.INGREDIENT_COMPATIBILITY.items():
+                incompatible = [kb.canonical_ingredient(i) for i in data["incompatible"]]
+                key = kb.canonical_ingredient(key)
+                if (key == first and second in incompatible) or (key == second and first in incompatible):
+                    return False
+    return True
+
+
+def reference_usage_time(ingredient):
+    for key, data in kb.INGREDIENT_COMPATIBILITY.items():
+        if kb.canonical_ingredient(key) == kb.canonical_ingredient(ingredient):
+            return data["best_time"]
+    return "any"
+
+
+def reference_strength(ingredient, skin_type, sensitivity):
+    for concern, data in kb.CONCERN_TO_INGREDIENTS.items():
+        if ingredient in data["recommended"]:
+            strength_levels = data.get("strength_levels", {})
+            if ingredient in strength_levels:
+                if sensitivity == "high":
+                    return "mild"
+                elif sensitivity == "medium":
+                    return "mild"
+                else:
+                    return "moderate"
+    return "moderate"
+
+
+# --------------------------------------------------------
+# Conformance and timing
+# --------------------------------------------------------
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def same_recommendations(a, b):
+    unordered = ("ingredients", "avoid_ingredients")
+    return all(set(a[k]) == set(b[k]) and len(a[k]) == len(b[k]) for k in unordered) and \
+        all(a[k] == b[k] for k in a if k not in unordered)
+
+
+def vocabulary():
+    ingredients = set(kb.INGREDIENT_COMPATIBILITY)
+    for members in kb.INGREDIENT_GROUPS.values():
+        ingredients.update(members)
+    for data in kb.CONCERN_TO_INGREDIENTS.values():
+        ingredients.update(data["recommended"], data["avoid_if_sensitive"])
+    for data in kb.INGREDIENT_COMPATIBILITY.values():
+        ingredients.update(data["compatible"], data["incompatible"])
+    return sorted(ingredients) + ["not an ingredient"]
+
+
+def run_conformance():
+    concerns = list(kb.CONCERN_TO_INGREDIENTS) + ["not a concern"]
+    skin_types = list(kb.SKIN_TYPE_RECOMMENDATIONS) + ["unknown", None]
+    ingredients = vocabulary()
+    checked = 0
+    for concern, skin_type, sensitivity in itertools.product(concerns, skin_types, SENSITIVITIES):
+        a = kb.get_ingredients_for_concern(concern, skin_type, sensitivity)
+        b = reference_ingredients_for_concern(concern, skin_type, sensitivity)
+        check(a["recommended"] == b["recommended"] and set(a["avoid"]) == set(b["avoid"])
+              and a["strength_levels"] == b["strength_levels"], f"get_ingredients_for_concern{concern, skin_type}")
+        checked += 1
+    for size in (0, 1, 2, 3):
+        for combo in itertools.combinations(concerns, size):
+            for skin_type, sensitivity in itertools.product(skin_types, SENSITIVITIES):
+                a = kb.get_product_recommendations(list(combo), skin_type, "high", sensitivity)
+                b = reference_product_recommendations(list(combo), skin_type, "high", sensitivity)
+                check(same_recommendations(a, b), f"get_product_recommendations{combo, skin_type, sensitivity}")
+                checked += 1
+    for first, second in itertools.product(ingredients, ingredients):
+        check(kb.check_ingredient_compatibility(first, second) == reference_compatibility(first, second),
+              f"check_ingredient_compatibility{first, second}")
+        checked += 1
+    for ingredient in ingredients:
+        check(kb.get_optimal_usage_time(ingredient) == reference_usage_time(ingredient), ingredient)
+        for sensitivity in SENSITIVITIES:
+            check(kb.get_strength_recommendation(ingredient, "oily", sensitivity)
+                  == reference_strength(ingredient, "oily", sensitivity), ingredient)
+            checked += 1
+    return checked
+
+
+def time_calls(fn, calls, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(*calls[i % len(calls)])
+    return (time.perf_counter() - start) / iterations
+
+
+def run_timings(iterations, seed=0):
+    rng = random.Random(seed)
+    concerns = list(kb.CONCERN_TO_INGREDIENTS)
+    skin_types = list(kb.SKIN_TYPE_RECOMMENDATIONS)
+    ingredients = vocabulary()
+    # Profiles repeat in real traffic: a few hundred distinct queries
+    profiles = [(rng.sample(concerns, rng.randint(1, 3)), rng.choice(skin_types), "medium",
+                 rng.choice(SENSITIVITIES[:3])) for _ in range(300)]
+    cases = {
+        "get_ingredients_for_concern": (
+            kb.get_ingredients_for_concern, reference_ingredients_for_concern,
+            [(rng.choice(concerns), rng.choice(skin_types), rng.choice(SENSITIVITIES)) for _ in range(300)]),
+        "get_product_recommendations": (
+            kb.get_product_recommendations, reference_product_recommendations, profiles),
+        "check_ingredient_compatibility": (
+            kb.check_ingredient_compatibility, reference_compatibility,
+            [(rng.choice(ingredients), rng.choice(ingredients)) for _ in range(300)]),
+        "get_optimal_usage_time": (
+            kb.get_optimal_usage_time, reference_usage_time, [(rng.choice(ingredients),) for _ in range(300)]),
+        "get_strength_recommendation": (
+            kb.get_strength_recommendation, reference_strength,
+            [(rng.choice(ingredients), "oily", rng.choice(SENSITIVITIES)) for _ in range(300)]),
+    }
+    results = {}
+    for name, (compiled, reference, calls) in cases.items():
+        before = time_calls(reference, calls, iterations)
+        after = time_calls(compiled, calls, iterations)
+        results[name] = {"reference_us": round(before * 1e6, 3), "compiled_us": round(after * 1e6, 3),
+                         "speedup": round(before / after, 1)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=20000, help="calls timed per function")
+    args = parser.parse_args()
+
+    report = {"conformance_checks": run_conformance(), "timings": run_timings(args.iterations)}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
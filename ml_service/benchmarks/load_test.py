@@ -0,0 +1,192 @@
+"""
+End-to-end /analyze/ load test
+
+Drives the real FastAPI app in-process through its ASGI interface (no
+network, no server) with synthetic selfies, an in-memory analysis store in
+place of MongoDB and tiny generated TFLite models with the production input
+and output signatures, then reports for each concurrency level: throughput,
+p50/p95/p99 latency, the mean Server-Timing breakdown per stage and RSS.
+
+    python -m benchmarks.load_test --concurrency 1 4 16 --requests 200
+    python -m benchmarks.load_test --megapixels 1 12 --formats JPEG WEBP --output run.json
+
+The tiny models need TensorFlow once to generate (in a separate process, so
+it does not count towards the RSS); pass --models-dir to keep and reuse them.
+Compare two runs by diffing their --output files.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import tempfile
+import time
+
+JWT_SECRET = "load-test-secret"
+USER_ID = "64b7f0c2a1b2c3d4e5f60718"
+QUIZ = {"skin_type": "oily", "sensitivity": "mild", "budget": "1500", "dryness": "false", "redness": "false"}
+CONTENT_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+def _generate_models(models_dir):
+    import tensorflow as tf
+    from utils.fix_models import convert_to_tflite, MANIFEST_NAME, MANIFEST_FORMAT
+    from utils.model_registry import file_sha256
+    from utils.test import MODEL_FILES
+
+    tf.keras.utils.set_random_seed(0)
+    entries = {}
+    for name, filename in MODEL_FILES.items():
+        # Same input and output shapes as the real models, a few hundred weights
+        inputs = tf.keras.Input((224, 224, 3), name="image")
+        x = tf.keras.layers.AveragePooling2D(pool_size=32)(inputs)
+        x = tf.keras.layers.Flatten()(x)
+        if name == "skintone":
+            outputs = tf.keras.layers.Dense(3, activation="softmax")(x)
+        else:
+            outputs = tf.keras.layers.Dense(1, activation="sigmoid")(x)
+        path = convert_to_tflite(tf.keras.Model(inputs, outputs, name=name), os.path.join(models_dir, filename))
+        entries[os.path.splitext(filename)[0]] = {"tflite": filename, "tflite_sha256": file_sha256(path)}
+    with open(os.path.join(models_dir, MANIFEST_NAME), "w") as f:
+        json.dump({"format": MANIFEST_FORMAT, "version": 1, "models": entries}, f, indent=2)
+
+
+def tiny_models(models_dir):
+    """Path of a manifest for tiny stand-in models, generating them if needed"""
+    manifest = os.path.join(models_dir, "manifest.json")
+    if not os.path.exists(manifest):
+        os.makedirs(models_dir, exist_ok=True)
+        proc = multiprocessing.get_context("spawn").Process(target=_generate_models, args=(models_dir,))
+        proc.start()
+        proc.join()
+        if proc.exitcode != 0:
+            raise SystemExit("Could not generate the tiny models (TensorFlow is needed once)")
+    return manifest
+
+
+def rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def parse_server_timing(header):
+    timings = {}
+    for entry in filter(None, (part.strip() for part in (header or "").split(","))):
+        name, _, params = entry.partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                timings[name] = timings.get(name, 0.0) + float(value)
+    return timings
+
+
+async def run_level(client, payloads, concurrency, requests, headers):
+    from benchmarks.decode_bench import peak_rss_kb
+
+    latencies, statuses, stages = [], {}, {}
+    remaining = [requests]
+
+    async def worker(offset):
+        index = offset
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            filename, data, content_type = payloads[index % len(payloads)]
+            index += concurrency
+            start = time.perf_counter()
+            response = await client.post("/analyze/", files={"file": (filename, data, content_type)},
+                                         data=QUIZ, headers=headers)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code == 200:
+                for name, ms in parse_server_timing(response.headers.get("server-timing")).items():
+                    stages.setdefault(name, []).append(ms)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    wall = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "throughput_per_s": round(requests / wall, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1),
+        "stages_mean_ms": {name: round(statistics.mean(values), 2) for name, values in sorted(stages.items())},
+        "rss_mb": round(rss_kb() / 1024, 1),
+        "peak_rss_mb": round(peak_rss_kb() / 1024, 1),
+    }
+
+
+async def run(application, payloads, levels, requests, warmup):
+    import httpx
+    import jwt
+
+    headers = {"Authorization": "Bearer " + jwt.encode({"_id": USER_ID}, JWT_SECRET, algorithm="HS256")}
+    transport = httpx.ASGITransport(app=application)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=120) as client:
+        # Loads the interpreters and fills caches before anything is measured
+        await run_level(client, payloads, 1, warmup, headers)
+        return [await run_level(client, payloads, level, requests, headers) for level in levels]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[1, 3])
+    parser.add_argument("--formats", nargs="+", default=["JPEG"], choices=sorted(CONTENT_TYPES))
+    parser.add_argument("--quality-gate", default="off", choices=["off", "flag", "reject"])
+    parser.add_argument("--models-dir", help="where the tiny models are (or will be) generated")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    manifest = tiny_models(args.models_dir or tempfile.mkdtemp(prefix="lumiskin_models_"))
+    # The app and utils.test read their configuration at import, so nothing from
+    # utils (or a benchmark module importing it) may be imported before this
+    os.environ.update({
+        "STORAGE_BACKEND": "memory",
+        "MODEL_MANIFEST": manifest,
+        "JWT_SECRET": JWT_SECRET,
+        "QUALITY_GATE_MODE": args.quality_gate,
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    })
+    import app
+    from benchmarks.tensor_bench import make_selfie
+
+    payloads = [(f"selfie.{fmt.lower()}", make_selfie(mp, fmt=fmt), CONTENT_TYPES[fmt])
+                for mp in args.megapixels for fmt in args.formats]
+    results = asyncio.run(run(app.app, payloads, args.concurrency, args.requests, args.warmup))
+    report = {
+        "config": {
+            "megapixels": args.megapixels,
+            "formats": args.formats,
+            "quality_gate": args.quality_gate,
+            "inference_backend": os.getenv("INFERENCE_BACKEND", "thread"),
+            "payload_kb": [round(len(data) / 1024, 1) for _, data, _ in payloads],
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Prefork memory and startup benchmark
+
+Starts serve.py with 1, 4 and 8 workers and reports startup time plus RSS and
+PSS (proportional set size: shared pages divided among the processes sharing
+them) per worker, read from /proc/<pid>/smaps_rollup (Linux only):
+
+    python -m benchmarks.prefork_bench --workers 1 4 8
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def memory_kb(pid):
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:", "Shared_Clean:", "Private_Dirty:"):
+                fields[parts[0][:-1].lower()] = int(parts[1])
+    return fields
+
+
+def run(workers, port, timeout):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ready_file = os.path.join(tmpdir, "ready.json")
+        start = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(port),
+             "--workers", str(workers), "--ready-file", ready_file],
+            cwd=SERVICE_DIR,
+        )
+        try:
+            while not os.path.exists(ready_file):
+                if proc.poll() is not None or time.perf_counter() - start > timeout:
+                    raise RuntimeError(f"serve.py did not become ready with {workers} workers")
+                time.sleep(0.05)
+            time.sleep(0.2)  # let the ready file finish writing
+            with open(ready_file) as f:
+                ready = json.load(f)
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=10) as resp:
+                resp.read()
+            wall = time.perf_counter() - start
+
+            per_worker = [memory_kb(pid) for pid in ready["workers"]]
+            parent = memory_kb(ready["parent"])
+            return {
+                "workers": workers,
+                "startup_seconds": round(wall, 2),
+                "parent_rss_mb": round(parent["rss"] / 1024, 1),
+                "worker_rss_mb": round(sum(m["rss"] for m in per_worker) / len(per_worker) / 1024, 1),
+                "worker_pss_mb": round(sum(m["pss"] for m in per_worker) / len(per_worker) / 1024, 1),
+                "worker_private_dirty_mb": round(
+                    sum(m["private_dirty"] for m in per_worker) / len(per_worker) / 1024, 1),
+                "total_pss_mb": round((parent["pss"] + sum(m["pss"] for m in per_worker)) / 1024, 1),
+            }
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    print(json.dumps([run(n, args.port, args.timeout) for n in args.workers], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Inference backend benchmark
+
+Runs the blocking part of an analysis (decode and preprocess a selfie, the
+four models, ingredient and product recommendation) from many client threads
+against the thread-pool backend and the process-pool backend
+(INFERENCE_BACKEND=process), each restricted to 4 and then 16 cores with
+sched_setaffinity, and reports throughput and latency percentiles:
+
+    python -m benchmarks.process_bench --cores 4 16 --requests 400
+
+Each configuration runs in a fresh process, so the backend and its worker
+processes (which inherit the CPU affinity) start cold and are warmed first.
+On a machine with fewer cores than asked for, the run uses all of them and
+reports the count it actually had.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import threading
+import time
+
+from benchmarks.tensor_bench import make_selfie
+
+QUIZ = {"skin_type": "oily", "sensitivity": "mild", "budget": 1500, "dryness": "false", "redness": "false"}
+
+
+def restrict_cores(cores):
+    """Pin this process (and its future children) to `cores` CPUs; returns the count applied"""
+    if not hasattr(os, "sched_setaffinity"):
+        return os.cpu_count()
+    available = sorted(os.sched_getaffinity(0))
+    chosen = available[:cores]
+    os.sched_setaffinity(0, chosen)
+    return len(chosen)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _measure(backend, cores, clients, requests, megapixels, queue):
+    applied = restrict_cores(cores)
+    os.environ["INFERENCE_BACKEND"] = backend
+    os.environ["INFERENCE_THREADS"] = str(applied)
+    os.environ["INFERENCE_PROCESSES"] = str(applied)
+    import io
+    from utils.test import (preprocess_image, predict_from_input, get_ingredients, knowledge_base,
+                            recommend_product_records, product_records, warm_models)
+
+    warm_models()
+    jpeg = make_selfie(megapixels)
+
+    def analyze():
+        img = preprocess_image(io.BytesIO(jpeg))
+        profile = {**QUIZ, **predict_from_input(img)}
+        ingredients = get_ingredients(profile, knowledge_base)
+        return recommend_product_records(profile, ingredients, product_records)
+
+    for _ in range(clients):
+        analyze()
+
+    latencies = []
+    remaining = [requests]
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            start = time.perf_counter()
+            analyze()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    queue.put({
+        "backend": backend,
+        "cores": applied,
+        "clients": clients,
+        "requests": requests,
+        "throughput_per_s": round(requests / wall, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1),
+    })
+
+
+def measure(backend, cores, clients, requests, megapixels):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_measure, args=(backend, cores, clients, requests, megapixels, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--cores", type=int, nargs="+", default=[4, 16])
+    parser.add_argument("--backends", nargs="+", default=["thread", "process"], choices=["thread", "process"])
+    parser.add_argument("--clients-per-core", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--megapixels", type=float, default=3)
+    args = parser.parse_args()
+
+    results = []
+    for cores in args.cores:
+        for backend in args.backends:
+            results.append(measure(backend, cores, cores * args.clients_per_core, args.requests, args.megapixels))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+Product recommendation scaling benchmark
+
+Generates synthetic catalogs (Zipf-distributed actives from the knowledge
+bases, log-normal prices across the four budget tiers, preference flags,
+categories and skin types) and a mix of user profiles, then runs the same
+queries through every recommendation path:
+
+    pandas       recommend_products() over a DataFrame of the catalog
+    records      recommend_product_records() over the list of dicts
+    recommender  ProductRecommender.get_recommendations() (weighted scoring)
+
+    python -m benchmarks.recommender_bench --sizes 10 1000 100000 1000000
+    python -m benchmarks.recommender_bench --sizes 100000 --queries 100 --output baseline.json
+
+For each size it reports the time and RSS needed to build each
+implementation's view of the catalog, per-query latency percentiles, the
+peak memory allocated by one query, and how far the top results agree.
+pandas and records implement the same filter, so they must agree (up to the
+order of equally rated products); the recommender ranks by a weighted score
+instead, so only its overlap with the others is reported. Each size runs in
+a fresh process, and an implementation stops taking queries once it has
+used --time-budget seconds at that size.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.load_test import rss_kb, percentile
+
+IMPLEMENTATIONS = ("pandas", "records", "recommender")
+TOP_K = 5
+
+# Price tiers in INR: (tier, median price); the ProductRecommender tier of a
+# price is the first whose ceiling it does not exceed
+PRICE_TIERS = (("low", 350), ("medium", 900), ("high", 2200), ("luxury", 6000))
+TIER_CEILINGS = (("low", 500), ("medium", 1500), ("high", 4000), ("luxury", float("inf")))
+TIER_WEIGHTS = (0.35, 0.4, 0.2, 0.05)
+
+# Share of products carrying each preference flag
+PREFERENCE_RATES = {"fragrance-free": 0.45, "vegan": 0.25, "cruelty-free": 0.3, "sensitive skin": 0.1}
+
+SKIN_TYPES = ("oily", "dry", "combination", "sensitive", "normal")
+SENSITIVITIES = ("low", "medium", "high")
+PROFILE_BUDGETS = (300, 800, 1500, 5000)
+PROFILE_PREFERENCES = ([], [], ["fragrance-free"], ["vegan"], ["fragrance-free", "vegan"])
+
+
+def ingredient_vocabulary():
+    """Every active either knowledge base mentions, most commonly recommended first"""
+    from utils.ingredient_knowledge_base import CONCERN_TO_INGREDIENTS
+    from utils.test import knowledge_base, product_records
+
+    counts = {}
+    for data in CONCERN_TO_INGREDIENTS.values():
+        for ingredient in data["recommended"]:
+            counts[ingredient] = counts.get(ingredient, 0) + 1
+    for info in knowledge_base.values():
+        for ingredient in info["ingredients"]:
+            counts[ingredient] = counts.get(ingredient, 0) + 1
+    for product in product_records:
+        for ingredient in product["ingredients"]:
+            counts[ingredient] = counts.get(ingredient, 0) + 1
+    return sorted(counts, key=lambda i: (-counts[i], i))
+
+
+def ingredient_concerns():
+    from utils.ingredient_knowledge_base import CONCERN_TO_INGREDIENTS
+
+    concerns = {}
+    for concern, data in CONCERN_TO_INGREDIENTS.items():
+        for ingredient in data["recommended"]:
+            concerns.setdefault(ingredient.lower(), []).append(concern)
+    return concerns
+
+
+def make_catalog(size, seed=0):
+    """
+    Synthetic catalog of `size` products in both schemas
+
+    Each dict has the fields recommend_products() reads (name, ingredients,
+    price, rating, preferences) and those ProductRecommender scores on
+    (category, budget_tier, skin_type, concerns, flags, usage).
+    """
+    from utils.ingredient_knowledge_base import PRODUCT_CATEGORIES
+
+    rng = np.random.default_rng(seed)
+    vocabulary = ingredient_vocabulary()
+    concerns_of = ingredient_concerns()
+    categories = list(PRODUCT_CATEGORIES)
+
+    # A few actives make most of the catalog, as in real product data
+    weights = 1.0 / np.arange(1, len(vocabulary) + 1) ** 1.1
+    weights /= weights.sum()
+    counts = np.clip(rng.poisson(1.2, size) + 1, 1, 6)
+    picks = rng.choice(len(vocabulary), size=int(counts.sum()), p=weights)
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    tiers = rng.choice(len(PRICE_TIERS), size=size, p=TIER_WEIGHTS)
+    medians = np.array([median for _, median in PRICE_TIERS])[tiers]
+    prices = np.maximum(99, np.round(medians * rng.lognormal(0, 0.35, size), -1) - 1)
+    ratings = np.round(np.clip(rng.normal(4.2, 0.35, size), 1.0, 5.0), 1)
+    reviews = rng.zipf(1.8, size).clip(max=50000)
+    flags = {name: rng.random(size) < rate for name, rate in PREFERENCE_RATES.items()}
+    category_ids = rng.integers(len(categories), size=size)
+    skin_masks = rng.integers(1, 2 ** len(SKIN_TYPES), size=size)
+
+    catalog = []
+    for i in range(size):
+        ingredients = list(dict.fromkeys(vocabulary[j] for j in picks[offsets[i]:offsets[i + 1]]))
+        price = float(prices[i])
+        category = categories[category_ids[i]]
+        concerns = sorted({c for ing in ingredients for c in concerns_of.get(ing.lower(), ())})
+        catalog.append({
+            "id": f"prod_{i:07d}",
+            "name": f"{ingredients[0].title()} {category.title()} #{i}",
+            "brand": f"Brand {i % 997}",
+            "category": category,
+            "ingredients": ingredients,
+            "price": price,
+            "rating": float(ratings[i]),
+            "reviews": int(reviews[i]),
+            "budget_tier": next(tier for tier, ceiling in TIER_CEILINGS if price <= ceiling),
+            "skin_type": [t for bit, t in enumerate(SKIN_TYPES) if skin_masks[i] >> bit & 1],
+            "concerns": concerns,
+            "preferences": [name for name in PREFERENCE_RATES if flags[name][i]],
+            "fragrance_free": bool(flags["fragrance-free"][i]),
+            "cruelty_free": bool(flags["cruelty-free"][i]),
+            "vegan": bool(flags["vegan"][i]),
+            "usage": PRODUCT_CATEGORIES[category]["usage"],
+        })
+    return catalog
+
+
+def make_profiles(count, seed=1):
+    """A mix of profiles: detected concerns, quiz answers, budgets and preferences"""
+    from utils.test import knowledge_base
+
+    rng = np.random.default_rng(seed)
+    profiles = []
+    for _ in range(count):
+        profile = {concern: bool(rng.random() < 0.35) for concern in knowledge_base}
+        profile.update({
+            "skin_type": SKIN_TYPES[rng.integers(len(SKIN_TYPES))],
+            "sensitivity": SENSITIVITIES[rng.integers(len(SENSITIVITIES))],
+            "budget": PROFILE_BUDGETS[rng.integers(len(PROFILE_BUDGETS))],
+            "preferences": PROFILE_PREFERENCES[rng.integers(len(PROFILE_PREFERENCES))],
+        })
+        profiles.append(profile)
+    return profiles
+
+
+def recommender_profile(recommender, profile):
+    """Register `profile` with a ProductRecommender; returns its profile id"""
+    analysis = {
+        "acne": {"probability": 0.9 if profile.get("acne") else 0.1},
+        "pores": {"probability": 0.9 if profile.get("oiliness") else 0.1},
+        "pigmentation": {"probability": 0.9 if profile.get("hyperpigmentation") else 0.1},
+    }
+    prefs = profile["preferences"]
+    return recommender.create_user_profile(analysis, {
+        "skin_type": profile["skin_type"],
+        "sensitivity": profile["sensitivity"],
+        "budget": next(tier for tier, ceiling in TIER_CEILINGS if profile["budget"] <= ceiling),
+        "fragrance_free": "fragrance-free" in prefs,
+        "vegan": "vegan" in prefs,
+        "cruelty_free": "cruelty-free" in prefs,
+    })
+
+
+def build(catalog):
+    """Each implementation's view of the catalog, with its build time and RSS growth"""
+    import pandas as pd
+    from utils.product_recommender import ProductRecommender
+
+    views, stats = {}, {}
+
+    def timed(name, fn):
+        before = rss_kb()
+        start = time.perf_counter()
+        views[name] = fn()
+        stats[name] = {"build_s": round(time.perf_counter() - start, 4),
+                       "build_rss_mb": round((rss_kb() - before) / 1024, 1)}
+
+    # Same columns as utils.test.products
+    timed("pandas", lambda: pd.DataFrame(
+        [{k: p[k] for k in ("name", "ingredients", "price", "rating", "preferences")} for p in catalog]))
+    # The generated list is already what recommend_product_records() takes
+    timed("records", lambda: catalog)
+
+    def make_recommender():
+        recommender = ProductRecommender()
+        recommender.product_database = {"products": catalog}
+        return recommender
+
+    timed("recommender", make_recommender)
+    return views, stats
+
+
+def make_queries(views):
+    from utils.test import get_ingredients, knowledge_base, recommend_products, recommend_product_records
+
+    recommender = views["recommender"]
+
+    def query_pandas(profile):
+        ingredients = get_ingredients(profile, knowledge_base)
+        return recommend_products(profile, ingredients, views["pandas"]).to_dict("records")
+
+    def query_records(profile):
+        ingredients = get_ingredients(profile, knowledge_base)
+        return recommend_product_records(profile, ingredients, views["records"], limit=TOP_K)
+
+    def query_recommender(profile):
+        profile_id = recommender_profile(recommender, profile)
+        try:
+            return recommender.get_recommendations(profile_id, max_products=TOP_K)["products"]
+        finally:
+            recommender.user_profiles.pop(profile_id, None)
+
+    return {"pandas": query_pandas, "records": query_records, "recommender": query_recommender}
+
+
+def overlap(a, b):
+    names_a, names_b = {p["name"] for p in a}, {p["name"] for p in b}
+    if not names_a and not names_b:
+        return 1.0
+    return len(names_a & names_b) / len(names_a | names_b)
+
+
+def agreement(results, first, second):
+    """How closely two implementations' top results agree, over the profiles both ran"""
+    pairs = [(a, b) for a, b in zip(results[first], results[second])]
+    if not pairs:
+        return None
+    return {
+        "queries": len(pairs),
+        # Same products in the same order
+        "exact": round(sum([p["name"] for p in a] == [p["name"] for p in b] for a, b in pairs) / len(pairs), 3),
+        # Same rating sequence: equal up to how ties between equally rated products were broken
+        "same_ratings": round(sum([p["rating"] for p in a] == [p["rating"] for p in b]
+                                  for a, b in pairs) / len(pairs), 3),
+        "mean_jaccard": round(statistics.mean(overlap(a, b) for a, b in pairs), 3),
+    }
+
+
+def _measure(size, profile_count, time_budget, implementations, queue):
+    start = time.perf_counter()
+    catalog = make_catalog(size)
+    generate_s = time.perf_counter() - start
+    profiles = make_profiles(profile_count)
+    rss_before = rss_kb()
+    views, stats = build(catalog)
+    queries = make_queries(views)
+
+    results = {}
+    for name in implementations:
+        query = queries[name]
+        # Warm imports and caches, and take the allocation peak of one query
+        tracemalloc.start()
+        query(profiles[0])
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        latencies, outputs = [], []
+        spent = 0.0
+        for profile in profiles:
+            if spent >= time_budget:
+                break
+            t = time.perf_counter()
+            outputs.append(query(profile))
+            elapsed = time.perf_counter() - t
+            latencies.append(elapsed)
+            spent += elapsed
+        results[name] = outputs
+        stats[name].update({
+            "queries": len(latencies),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+            "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+            "query_peak_alloc_mb": round(peak / 1024 / 1024, 2),
+            "mean_results": round(statistics.mean(len(r) for r in outputs), 2),
+        })
+
+    pairs = [(a, b) for i, a in enumerate(implementations) for b in implementations[i + 1:]]
+    queue.put({
+        "size": size,
+        "generate_s": round(generate_s, 2),
+        "catalog_rss_mb": round(rss_before / 1024, 1),
+        "implementations": stats,
+        "agreement": {f"{a}~{b}": agreement(results, a, b) for a, b in pairs},
+    })
+
+
+def measure(size, profile_count, time_budget, implementations):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_measure, args=(size, profile_count, time_budget, implementations, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000, 1000000])
+    parser.add_argument("--queries", type=int, default=50, help="profiles queried per size")
+    parser.add_argument("--time-budget", type=float, default=60,
+                        help="seconds of queries per implementation and size")
+    parser.add_argument("--implementations", nargs="+", default=list(IMPLEMENTATIONS), choices=IMPLEMENTATIONS)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = {
+        "config": {
+            "queries": args.queries,
+            "time_budget_s": args.time_budget,
+            "top_k": TOP_K,
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "results": [measure(size, args.queries, args.time_budget, tuple(args.implementations))
+                    for size in args.sizes],
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
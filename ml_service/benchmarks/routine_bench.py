@@ -0,0 +1,83 @@
+"""
+Routine conflict benchmark
+
+Times the bitset conflict check (utils.routine_conflicts) against the
+pairwise loop it replaces, which calls check_ingredient_compatibility() for
+every ingredient of every product pair, on random shelves of growing size,
+and checks both flag the same product pairs:
+
+    python -m benchmarks.routine_bench --sizes 10 100 500
+"""
+
+import argparse
+import itertools
+import json
+import random
+import statistics
+import time
+
+from utils import ingredient_knowledge_base as kb
+from utils.routine_conflicts import ConflictGraph, RoutineProduct
+
+
+def make_shelf(size, rng):
+    """Products of 2-8 ingredients, about one in twenty from the conflict graph"""
+    fillers = sorted({ing for data in kb.CONCERN_TO_INGREDIENTS.values() for ing in data["recommended"]})
+    actives = ["Vitamin C", "vitamin_c", "niacinamide", "Retinol", "benzoyl peroxide", "salicylic acid",
+               "glycolic acid", "lactic acid"]
+    shelf = []
+    for i in range(size):
+        count = rng.randint(2, 8)
+        ingredients = [rng.choice(actives) if rng.random() < 0.05 else rng.choice(fillers) for _ in range(count)]
+        shelf.append(RoutineProduct(f"product {i}", ingredients))
+    return shelf
+
+
+def pairwise_conflicts(shelf):
+    """The quadratic loop: every product pair, every ingredient pair"""
+    flagged = set()
+    for first, second in itertools.combinations(shelf, 2):
+        if any(not kb.check_ingredient_compatibility(a, b)
+               for a in first.ingredients for b in second.ingredients):
+            flagged.add((first.name, second.name))
+    return flagged
+
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    graph = ConflictGraph.from_knowledge_base()
+    results = []
+    for size in args.sizes:
+        shelf = make_shelf(size, rng)
+        loop_best, loop_median, expected = best_of(lambda: pairwise_conflicts(shelf), args.repeat)
+        bits_best, bits_median, report = best_of(lambda: graph.check(shelf), args.repeat)
+        flagged = {tuple(c["products"]) for c in report["conflicts"]}
+        if flagged != expected:
+            raise AssertionError(f"{size} products: the bitset check flagged {len(flagged)} pairs, "
+                                 f"the pairwise loop {len(expected)}")
+        results.append({
+            "products": size,
+            "conflicting_pairs": len(flagged),
+            "pairwise_ms": round(loop_median * 1000, 3),
+            "bitset_ms": round(bits_median * 1000, 3),
+            "speedup": round(loop_best / bits_best, 1),
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
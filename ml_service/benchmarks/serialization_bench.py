@@ -0,0 +1,104 @@
+"""
+Response serialization benchmark
+
+Compares the old per-field to_python() passes + DataFrame.to_dict() +
+jsonable_encoder + json.dumps against prebuilt records encoded once with orjson:
+
+    python -m benchmarks.serialization_bench --iterations 5000
+"""
+
+import argparse
+import json
+import timeit
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from utils.serialization import dumps
+
+CATALOG = [
+    {"name": f"Product {i}", "ingredients": ["niacinamide", "zinc"][: 1 + i % 2],
+     "price": 299 + 50 * i, "rating": round(4.0 + (i % 7) / 10, 1), "preferences": ["vegan"] if i % 3 else []}
+    for i in range(18)
+]
+
+
+def legacy_to_python(obj):
+    if isinstance(obj, (np.int64, np.int32)):
+        return int(obj)
+    elif isinstance(obj, (np.float32, np.float64)):
+        return float(obj)
+    elif isinstance(obj, (np.bool_)):
+        return bool(obj)
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, ObjectId):
+        return str(obj)
+    elif isinstance(obj, datetime):
+        return obj.isoformat()
+    return obj
+
+
+def sample_profile():
+    return {
+        "dryness": False, "redness": True, "skin_type": "oily", "sensitivity": "mild",
+        "budget": 1500, "preferences": ["fragrance-free"],
+        "wrinkles": np.bool_(False), "acne": np.bool_(True),
+        "hyperpigmentation": np.bool_(False), "skin_tone": "medium",
+    }
+
+
+def legacy(df, profile, ingredients, doc_id):
+    top = df.sort_values("rating", ascending=False).head(5).to_dict(orient="records")
+    response = {
+        "user_id": "64b7f0c2a1b2c3d4e5f60718",
+        "skin_profile": {k: legacy_to_python(v) for k, v in profile.items()},
+        "recommended_ingredients": [legacy_to_python(i) for i in ingredients],
+        "recommended_products": [{k: legacy_to_python(v) for k, v in p.items()} for p in top],
+        "created_at": datetime.utcnow(),
+    }
+    safe = {k: legacy_to_python(v) for k, v in {"_id": str(doc_id), **response}.items()}
+    return json.dumps(jsonable_encoder(safe)).encode()
+
+
+def fast(records, profile, ingredients, doc_id):
+    top = sorted(records, key=lambda p: p["rating"], reverse=True)[:5]
+    response = {
+        "_id": doc_id,
+        "user_id": "64b7f0c2a1b2c3d4e5f60718",
+        "skin_profile": profile,
+        "recommended_ingredients": ingredients,
+        "recommended_products": top,
+        "created_at": datetime.utcnow(),
+    }
+    return dumps(response)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    df = pd.DataFrame(CATALOG)
+    profile = sample_profile()
+    ingredients = ["niacinamide", "salicylic acid", "zinc", "centella asiatica"]
+    doc_id = ObjectId()
+
+    assert json.loads(legacy(df, profile, ingredients, doc_id))["skin_profile"] == \
+        json.loads(fast(CATALOG, profile, ingredients, doc_id))["skin_profile"]
+
+    legacy_s = timeit.timeit(lambda: legacy(df, profile, ingredients, doc_id), number=args.iterations)
+    fast_s = timeit.timeit(lambda: fast(CATALOG, profile, ingredients, doc_id), number=args.iterations)
+    print(json.dumps({
+        "iterations": args.iterations,
+        "legacy_us_per_response": round(legacy_s / args.iterations * 1e6, 1),
+        "orjson_us_per_response": round(fast_s / args.iterations * 1e6, 1),
+        "speedup": round(legacy_s / fast_s, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Cold-start benchmark
+
+Reports what importing the app costs (a `python -X importtime` breakdown by
+package, and whether any heavy module was imported eagerly) and the
+time-to-first-response of a freshly started uvicorn server: process start
+to the first 200 from /health, then the first /analyze/, which also loads
+the models.
+
+    python -m benchmarks.startup_bench --runs 3 --target-ms 1500
+    TFLITE_RUNTIME=tensorflow python -m benchmarks.startup_bench --models-dir /tmp/tiny --output full.json
+
+Exits with status 1 when the median time to the first /health response is
+over --target-ms, so it can gate a deploy. /analyze/ uses the tiny models of
+benchmarks.load_test (TensorFlow is needed once to generate them; pass
+--models-dir to keep and reuse them, or --no-analyze to skip it).
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.load_test import CONTENT_TYPES, JWT_SECRET, QUIZ, USER_ID, tiny_models
+from benchmarks.tensor_bench import make_selfie
+
+# Modules the service should only import when a request needs them
+HEAVY_MODULES = ("tensorflow", "keras", "pandas", "huggingface_hub", "sklearn", "cv2", "tflite_runtime",
+                 "ai_edge_litert")
+ADMIN_TOKEN = "startup-bench"
+
+_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def service_env(manifest=None):
+    env = dict(os.environ)
+    env.update({
+        "STORAGE_BACKEND": "memory",
+        "JWT_SECRET": JWT_SECRET,
+        "ADMIN_TOKEN": ADMIN_TOKEN,
+        "JOB_DB_PATH": os.path.join(tempfile.mkdtemp(prefix="lumiskin_jobs_"), "jobs.db"),
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    })
+    if manifest:
+        env["MODEL_MANIFEST"] = manifest
+    return env
+
+
+def import_report(env, top):
+    """-X importtime of `import app` in a fresh interpreter"""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], env=env,
+                          capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - start
+    rows = []
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, (len(indent) - 1) // 2, int(self_us), int(cumulative_us)))
+
+    # Packages imported at the top level or directly by app, by cumulative time
+    packages = {}
+    for name, depth, _, cumulative in rows:
+        if depth <= 1:
+            package = name.split(".")[0]
+            packages[package] = max(packages.get(package, 0), cumulative)
+    imported = {name.split(".")[0] for name, *_ in rows}
+    app_us = next((cumulative for name, depth, _, cumulative in rows if name == "app"), 0)
+    return {
+        "process_wall_ms": round(wall * 1000, 1),
+        "import_app_ms": round(app_us / 1000, 1),
+        "modules_imported": len(rows),
+        "heavy_modules_imported": sorted(m for m in HEAVY_MODULES if m in imported),
+        "top_packages_ms": {name: round(us / 1000, 1)
+                            for name, us in sorted(packages.items(), key=lambda item: -item[1])[:top]},
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def first_responses(env, selfie):
+    """Start a server and time its first /health and (with `selfie`) /analyze/ responses"""
+    import httpx
+    import jwt
+
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1",
+                               "--port", str(port), "--log-level", "warning"], env=env)
+    result = {}
+    try:
+        with httpx.Client(base_url=base, timeout=120) as client:
+            while True:
+                if server.poll() is not None:
+                    raise SystemExit(f"The server exited with status {server.returncode}")
+                try:
+                    if client.get("/health").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.005)
+            result["health_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            if selfie is not None:
+                token = jwt.encode({"_id": USER_ID}, JWT_SECRET, algorithm="HS256")
+                t = time.perf_counter()
+                response = client.post("/analyze/", files={"file": ("selfie.jpg", selfie, CONTENT_TYPES["JPEG"])},
+                                       data=QUIZ, headers={"Authorization": f"Bearer {token}"})
+                result["analyze_status"] = response.status_code
+                result["first_analyze_ms"] = round((time.perf_counter() - t) * 1000, 1)
+                result["analyze_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                models = client.get("/admin/models", headers={"X-Admin-Token": ADMIN_TOKEN})
+                if models.status_code == 200:
+                    result["runtime"] = models.json().get("runtime")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=3, help="cold starts to measure")
+    parser.add_argument("--target-ms", type=float, default=1500,
+                        help="median time to the first /health response must stay under this")
+    parser.add_argument("--top", type=int, default=15, help="packages listed in the import breakdown")
+    parser.add_argument("--models-dir", help="where the tiny models are (or will be) generated")
+    parser.add_argument("--no-analyze", action="store_true", help="only time /health")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    manifest = None if args.no_analyze else tiny_models(args.models_dir or tempfile.mkdtemp(prefix="lumiskin_models_"))
+    env = service_env(manifest)
+    selfie = None if args.no_analyze else make_selfie(1)
+
+    runs = [first_responses(env, selfie) for _ in range(args.runs)]
+    health = statistics.median(run["health_ms"] for run in runs)
+    report = {
+        "config": {
+            "runs": args.runs,
+            "tflite_runtime": os.getenv("TFLITE_RUNTIME", "auto"),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "imports": import_report(env, args.top),
+        "median_health_ms": health,
+        "target_ms": args.target_ms,
+        "target_met": health <= args.target_ms,
+        "runs": runs,
+    }
+    if selfie is not None:
+        report["median_analyze_ms"] = round(statistics.median(run["analyze_ms"] for run in runs), 1)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if not report["target_met"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
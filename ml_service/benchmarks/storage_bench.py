@@ -0,0 +1,131 @@
+"""
+Storage backend conformance and throughput check
+
+Runs the same checks and timings against every configured backend:
+
+    python -m benchmarks.storage_bench                  # SQLite and in-memory
+    MONGO_URL=mongodb://... python -m benchmarks.storage_bench --backends sqlite mongo
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from utils.storage import create_store
+
+
+def sample_doc(user_id, created_at):
+    return {
+        "user_id": user_id,
+        "skin_profile": {"skin_type": "oily", "acne": True, "wrinkles": False, "skin_tone": "medium"},
+        "recommended_ingredients": ["niacinamide", "salicylic acid"],
+        "recommended_products": [{"name": "Salicylic Acid Cleanser", "price": 299, "rating": 4.3}],
+        "created_at": created_at,
+    }
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def run_conformance(store):
+    """Behaviour every backend must share"""
+    user = f"user-{uuid.uuid4().hex}"
+    other = f"user-{uuid.uuid4().hex}"
+    base = datetime.utcnow().replace(microsecond=0)
+
+    first = sample_doc(user, base)
+    doc_id = store.insert_one(first)
+    check(isinstance(doc_id, str) and doc_id, "insert_one must return a non-empty string id")
+    check("_id" not in first, "insert_one must not mutate the caller's document")
+
+    fetched = store.get(doc_id)
+    check(fetched is not None and fetched["_id"] == doc_id, "get must return the stored document")
+    check(fetched["created_at"] == base, "created_at must round-trip as a datetime")
+    check(fetched["skin_profile"] == first["skin_profile"], "nested fields must round-trip")
+    check(store.get("does-not-exist") is None, "get must return None for unknown ids")
+
+    batch = [sample_doc(user, base + timedelta(seconds=i + 1)) for i in range(5)]
+    batch.append(sample_doc(other, base))
+    ids = store.insert_many(batch)
+    check(len(ids) == len(batch) and len(set(ids)) == len(ids), "insert_many must return one id per doc")
+    check(store.insert_many([]) == [], "insert_many([]) must be a no-op")
+
+    history = store.find_by_user(user, limit=3)
+    check([d["created_at"] for d in history] == [base + timedelta(seconds=s) for s in (5, 4, 3)],
+          "history must be newest first and honour the limit")
+    check(all(d["user_id"] == user for d in store.find_by_user(user, limit=100)),
+          "history must only contain the requested user's documents")
+    check(len(store.find_by_user(user, limit=100)) == 6, "history must include single and batched inserts")
+
+
+def run_throughput(store, docs, batch_size):
+    user = f"bench-{uuid.uuid4().hex}"
+    base = datetime.utcnow()
+    payload = [sample_doc(user, base + timedelta(microseconds=i)) for i in range(docs)]
+
+    start = time.perf_counter()
+    for doc in payload[:docs // 2]:
+        store.insert_one(doc)
+    single = time.perf_counter() - start
+
+    rest = payload[docs // 2:]
+    start = time.perf_counter()
+    for i in range(0, len(rest), batch_size):
+        store.insert_many(rest[i:i + batch_size])
+    batched = time.perf_counter() - start
+
+    reads = 200
+    start = time.perf_counter()
+    for _ in range(reads):
+        store.find_by_user(user, limit=20)
+    history = time.perf_counter() - start
+
+    return {
+        "insert_one_per_s": round((docs // 2) / single, 1),
+        f"insert_many_{batch_size}_per_s": round(len(rest) / batched, 1),
+        "history_reads_per_s": round(reads / history, 1),
+    }
+
+
+def open_store(backend, tmpdir):
+    if backend == "memory":
+        return create_store("memory")
+    if backend == "sqlite":
+        return create_store("sqlite", sqlite_path=os.path.join(tmpdir, "bench.db"))
+    return create_store(
+        "mongo",
+        mongo_url=os.getenv("MONGO_URL"),
+        mongo_db=os.getenv("MONGO_DB", "test"),
+        mongo_collection=os.getenv("MONGO_BENCH_COLLECTION", "analysis_bench"),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backends", nargs="+", default=["sqlite", "memory"],
+                        choices=["sqlite", "memory", "mongo"])
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for backend in args.backends:
+            store = open_store(backend, tmpdir)
+            try:
+                run_conformance(store)
+                results[backend] = run_throughput(store, args.docs, args.batch_size)
+            finally:
+                store.close()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Tensor ingest benchmark
+
+Compares the per-request input work of the multipart path (decode and resize
+in preprocess_image(), as run_analysis() does) with the internal
+tensor path (decode_tensor_payload() plus pixels_to_input()) on synthetic
+selfies of several resolutions:
+
+    python -m benchmarks.tensor_bench --megapixels 1 3 12 --repeat 20
+"""
+
+import argparse
+import io
+import json
+import time
+
+import numpy as np
+from PIL import Image
+
+from utils.test import preprocess_image, pixels_to_input
+from utils.uploads import decode_tensor_payload, encode_tensor_payload, sniff_image_format
+
+QUIZ = {"skin_type": "oily", "sensitivity": "mild", "budget": 1500, "dryness": "false", "redness": "false"}
+
+
+def make_selfie(megapixels, quality=90, fmt="JPEG"):
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    # Smooth gradients plus noise compress roughly like a photo
+    x = (np.arange(width) * 231 // width).astype(np.uint8)[np.newaxis, :]
+    y = (np.arange(height) * 231 // height).astype(np.uint8)[:, np.newaxis]
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    pixels[..., 0] = x
+    pixels[..., 1] = y
+    pixels[..., 2] = x // 2 + y // 2
+    pixels += np.random.default_rng(0).integers(0, 24, size=pixels.shape, dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, fmt, quality=quality)
+    return buf.getvalue()
+
+
+def multipart_path(data):
+    sniff_image_format(data[:12])
+    return preprocess_image(io.BytesIO(data))
+
+
+def tensor_path(body):
+    _, pixels = decode_tensor_payload(body)
+    return pixels_to_input(pixels)
+
+
+def throughput(fn, payload, repeat):
+    fn(payload)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(payload)
+    elapsed = time.perf_counter() - start
+    return elapsed / repeat
+
+
+def run(megapixels, repeat):
+    results = []
+    for mp in megapixels:
+        jpeg = make_selfie(mp)
+        # What the Node backend sends after resizing the decoded selfie itself
+        pixels = np.asarray(Image.open(io.BytesIO(jpeg)).convert("RGB").resize((224, 224), Image.BILINEAR))
+        body = encode_tensor_payload(QUIZ, pixels)
+
+        multipart = throughput(multipart_path, jpeg, repeat)
+        tensor = throughput(tensor_path, body, repeat)
+        results.append({
+            "megapixels": mp,
+            "jpeg_kb": round(len(jpeg) / 1024, 1),
+            "tensor_kb": round(len(body) / 1024, 1),
+            "multipart_ms": round(multipart * 1000, 2),
+            "tensor_ms": round(tensor * 1000, 3),
+            "multipart_per_s": round(1 / multipart, 1),
+            "tensor_per_s": round(1 / tensor, 1),
+            "speedup": round(multipart / tensor, 1),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[1, 3, 12])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.megapixels, args.repeat), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Upload handling peak-memory benchmark
+
+Compares the old `await file.read()` + temp file write against the streamed
+`receive_upload()` path for a mix of upload sizes:
+
+    python -m benchmarks.upload_bench --sizes-kb 100 1024 5120 20480
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from starlette.datastructures import UploadFile
+
+from utils.uploads import receive_upload
+
+JPEG_HEADER = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00"
+
+
+def make_source(size, directory):
+    path = os.path.join(directory, f"upload_{size}.jpg")
+    with open(path, "wb") as f:
+        f.write(JPEG_HEADER)
+        f.write(os.urandom(size - len(JPEG_HEADER)))
+    return path
+
+
+async def legacy_read(upload_file, spool_dir):
+    image_bytes = await upload_file.read()
+    path = os.path.join(spool_dir, "temp_legacy.jpg")
+    with open(path, "wb") as f:
+        f.write(image_bytes)
+    os.remove(path)
+
+
+async def streamed_read(upload_file, spool_dir, max_bytes, spool_bytes):
+    upload = await receive_upload(upload_file, max_bytes, spool_bytes, spool_dir=spool_dir)
+    upload.cleanup()
+
+
+async def measure(path, reader):
+    with open(path, "rb") as f:
+        upload_file = UploadFile(file=f, filename=os.path.basename(path))
+        tracemalloc.start()
+        start = time.perf_counter()
+        await reader(upload_file)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return peak, elapsed
+
+
+async def run(sizes_kb, max_bytes, spool_bytes):
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size_kb in sizes_kb:
+            path = make_source(size_kb * 1024, tmpdir)
+            legacy_peak, legacy_time = await measure(path, lambda f: legacy_read(f, tmpdir))
+            streamed_peak, streamed_time = await measure(
+                path, lambda f: streamed_read(f, tmpdir, max_bytes, spool_bytes))
+            results.append({
+                "size_kb": size_kb,
+                "legacy_peak_kb": round(legacy_peak / 1024, 1),
+                "streamed_peak_kb": round(streamed_peak / 1024, 1),
+                "legacy_ms": round(legacy_time * 1000, 2),
+                "streamed_ms": round(streamed_time * 1000, 2),
+            })
+            os.remove(path)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes-kb", type=int, nargs="+", default=[100, 512, 1024, 5120, 20480])
+    parser.add_argument("--max-bytes", type=int, default=25 * 1024 * 1024)
+    parser.add_argument("--spool-bytes", type=int, default=1024 * 1024)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.sizes_kb, args.max_bytes, args.spool_bytes))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
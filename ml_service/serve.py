@@ -0,0 +1,211 @@
+"""
+Prefork server for the ML service
+
+The parent process imports the app once (numpy, the product catalog and
+knowledge base) and the TFLite runtime, downloads the model files and
+freezes the GC, then forks uvicorn workers that all accept on one shared
+socket. Everything loaded before the fork is shared copy-on-write.
+
+Interpreters are created in each worker right after the fork. Their weights
+are mmapped from the same model files, so they sit in the shared page cache;
+only the per-worker activation arenas are private. Creating them after the
+fork also keeps TFLite's thread pools out of the parent.
+
+Workers that die are replaced. A worker that exits before reporting ready,
+or soon after, counts as a failed start: replacements back off
+exponentially, and after --max-restarts consecutive failed starts the
+server shuts down instead of crash-looping.
+
+    WEB_CONCURRENCY=4 python serve.py --host 0.0.0.0 --port 8000
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+logger = logging.getLogger("serve")
+
+# Longest delay before replacing a worker that keeps failing to start
+MAX_BACKOFF = 60
+
+
+def preload():
+    """Import the app and fetch the models in the parent"""
+    import app
+    from utils.test import prefetch_models, tflite_runtime
+
+    # The service imports the runtime lazily; import it here so workers share it
+    tflite_runtime()
+    prefetch_models()
+    return app.app
+
+
+def run_worker(application, sock, ready_fd, args):
+    """Child process: warm the interpreters, report ready, serve until told to stop"""
+    from utils.test import warm_models
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    warm_models()
+    os.write(ready_fd, f"{os.getpid()}\n".encode())
+    os.close(ready_fd)
+
+    config = uvicorn.Config(application, log_config=None, timeout_keep_alive=args.keep_alive,
+                            access_log=args.access_log)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn(application, sock, args):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        code = 0
+        try:
+            run_worker(application, sock, write_fd, args)
+        except BaseException:
+            logger.exception("Worker %s crashed", os.getpid())
+            code = 1
+        finally:
+            os._exit(code)
+    os.close(write_fd)
+    return pid, read_fd
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prefork uvicorn server sharing preloaded models")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--keep-alive", type=int, default=5)
+    parser.add_argument("--access-log", action="store_true")
+    parser.add_argument("--ready-file", help="write startup time and worker pids here once all workers are ready")
+    parser.add_argument("--ready-timeout", type=float, default=300, help="kill a worker not ready after this many seconds")
+    parser.add_argument("--min-uptime", type=float, default=10,
+                        help="a worker exiting sooner than this after becoming ready counts as a failed start")
+    parser.add_argument("--max-restarts", type=int, default=10,
+                        help="consecutive failed starts before the server gives up")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    application = preload()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(args.backlog)
+    sock.set_inheritable(True)
+
+    # Move everything allocated so far out of the GC's reach so collections in
+    # the workers don't touch (and un-share) those pages
+    gc.collect()
+    gc.freeze()
+
+    workers = {}
+    restarts = []  # monotonic times at which a replacement worker is due
+    failures = 0
+    exit_code = 0
+    reported = False
+    stopping = False
+
+    def start_worker():
+        pid, read_fd = spawn(application, sock, args)
+        workers[pid] = {"ready_fd": read_fd, "started": time.monotonic(), "ready_at": None, "killed": False}
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for _ in range(max(1, args.workers)):
+        start_worker()
+
+    # Supervise: collect readiness reports, reap and replace workers. Nothing
+    # here blocks for long, so shutdown and reaping never wait on a slow start.
+    while workers or (restarts and not stopping):
+        pipes = {w["ready_fd"]: pid for pid, w in workers.items() if w["ready_fd"] is not None}
+        timeout = 0.5 if not restarts else max(0.0, min(0.5, restarts[0] - time.monotonic()))
+        if pipes:
+            readable, _, _ = select.select(list(pipes), [], [], timeout)
+        else:
+            readable = []
+            time.sleep(timeout)
+
+        for fd in readable:
+            worker = workers[pipes[fd]]
+            # The worker writes its pid once warmed up; EOF without it means it
+            # died during startup, which reaping below counts as a failure
+            if os.read(fd, 64):
+                worker["ready_at"] = time.monotonic()
+            os.close(fd)
+            worker["ready_fd"] = None
+
+        now = time.monotonic()
+        for pid, worker in workers.items():
+            if worker["ready_fd"] is not None and not worker["killed"] and now - worker["started"] > args.ready_timeout:
+                logger.error("Worker %s not ready after %ss; killing it", pid, args.ready_timeout)
+                os.kill(pid, signal.SIGKILL)
+                worker["killed"] = True
+
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid == 0:
+                break
+            worker = workers.pop(pid, None)
+            if worker is None:
+                continue
+            if worker["ready_fd"] is not None:
+                os.close(worker["ready_fd"])
+            if stopping:
+                continue
+            healthy = worker["ready_at"] is not None and time.monotonic() - worker["ready_at"] >= args.min_uptime
+            failures = 0 if healthy else failures + 1
+            if failures > args.max_restarts:
+                logger.error("Workers failed to start %d times in a row; shutting down", failures)
+                exit_code = 1
+                shutdown(None, None)
+                continue
+            delay = 0 if healthy else min(MAX_BACKOFF, 0.5 * 2 ** (failures - 1))
+            logger.warning("Worker %s exited (status %s); restarting in %.1fs", pid, status, delay)
+            restarts.append(time.monotonic() + delay)
+            restarts.sort()
+
+        while restarts and not stopping and restarts[0] <= time.monotonic():
+            restarts.pop(0)
+            start_worker()
+
+        if not reported and all(w["ready_fd"] is None for w in workers.values()):
+            reported = True
+            ready = sorted(pid for pid, w in workers.items() if w["ready_at"] is not None)
+            startup = time.perf_counter() - started
+            logger.info("%d/%d workers ready in %.2fs", len(ready), max(1, args.workers), startup)
+            if args.ready_file:
+                with open(args.ready_file, "w") as f:
+                    json.dump({"parent": os.getpid(), "workers": ready, "startup_seconds": round(startup, 3)}, f)
+
+    sock.close()
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
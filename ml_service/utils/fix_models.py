@@ -1,6 +1,12 @@
 # fix_models.py
 import os
+import sys
 import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
 import logging
 import h5py
 import traceback
@@ -10,6 +16,14 @@ from tensorflow.keras.models import load_model, model_from_json, Model
 from tensorflow.keras.models import Sequential, load_model
 from tensorflow.keras.layers import Input, Dense  # add any layer types your model uses
 
+# One checksum for the manifests written here and the service that verifies them
+if __package__:
+    from .model_registry import file_sha256
+else:
+    # Run as a script (python utils/fix_models.py): import through the utils package
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from utils.model_registry import file_sha256
+
 
 
 logging.basicConfig(level=logging.INFO)
@@ -161,17 +175,338 @@ def load_or_fix(path, name):
         logger.error(f"{name}: rebuild attempts failed: {e2}")
         raise
 
-if __name__ == "__main__":
-    # replace these with your actual model files
-    model_files = {
-        "acne": r"D:\my projects\LumiSkin\ml-service\models\acne_model.h5",
-        "pigmentation": r"D:\my projects\LumiSkin\ml-service\models\pigmentation_model.h5",
-        "wrinkles": r"D:\my projects\LumiSkin\ml-service\models\wrinkle_model.h5",
-        "pores": r"D:\my projects\LumiSkin\ml-service\models\pore_model.h5"
+# --------------------------------------------------------
+# Merged multi-head model
+# --------------------------------------------------------
+# Heads of the merged model, named like the service's MODEL_FILES keys
+MERGED_HEADS = {
+    "wrinkle": "wrinkle.h5",
+    "acne": "acne_model.h5",
+    "pigmentation": "pigmentation.h5",
+    "skintone": "skintone.h5",
+}
+INPUT_SHAPE = (224, 224, 3)
+
+
+def build_merged_model(models):
+    """
+    Combine single-input models into one multi-output model over a shared input
+
+    Each head is wrapped in a linear Activation named after it, so the
+    TFLite signature exposes the outputs by name (wrinkle, acne, ...)
+    instead of by converter-chosen tensor order.
+    """
+    inputs = tf.keras.Input(shape=INPUT_SHAPE, name="image")
+    outputs = {}
+    for name, model in models.items():
+        if tuple(model.input_shape[1:]) != INPUT_SHAPE:
+            raise ValueError(f"{name}: input shape {model.input_shape} is not {INPUT_SHAPE}")
+        # Nested models need unique names inside the merged graph
+        head = Model(inputs=model.inputs, outputs=model.outputs, name=f"{name}_model")
+        outputs[name] = tf.keras.layers.Activation("linear", name=name)(head(inputs))
+    return Model(inputs=inputs, outputs=outputs, name="skin_multihead")
+
+
+def convert_to_tflite(model, out_path):
+    """Convert a Keras model to a float32 TFLite flatbuffer (no quantization, for parity)"""
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    tflite_model = converter.convert()
+    with open(out_path, "wb") as f:
+        f.write(tflite_model)
+    logger.info(f"wrote {out_path} ({len(tflite_model) / 1e6:.1f} MB)")
+    return out_path
+
+
+def sample_inputs(count=8, seed=0, shape=INPUT_SHAPE):
+    """Deterministic inputs in the service's preprocessing range (float32, 0-1)"""
+    rng = np.random.default_rng(seed)
+    return rng.random((count, 1) + tuple(shape), dtype=np.float32)
+
+
+def run_merged_tflite(interpreter, img):
+    """Outputs of a merged model as {head name: array}, via its signature"""
+    return interpreter.get_signature_runner()(image=img)
+
+
+def check_merged_parity(models, merged_path, samples, atol=1e-4):
+    """
+    Compare every head of the merged TFLite model with its Keras original
+
+    Returns:
+        dict: {head name: max absolute difference over all samples}
+
+    Raises:
+        AssertionError: If any head differs by more than `atol`
+    """
+    interpreter = tf.lite.Interpreter(model_path=merged_path)
+    interpreter.allocate_tensors()
+    worst = {name: 0.0 for name in models}
+    for img in samples:
+        merged = run_merged_tflite(interpreter, img)
+        for name, model in models.items():
+            expected = model(img, training=False).numpy()
+            worst[name] = max(worst[name], float(np.max(np.abs(merged[name] - expected))))
+    for name, diff in worst.items():
+        logger.info(f"{name}: max |merged - keras| = {diff:.2e}")
+    failed = {name: diff for name, diff in worst.items() if diff > atol}
+    assert not failed, f"merged model outputs differ beyond {atol}: {failed}"
+    return worst
+
+
+def _rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+
+
+def _median_ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times))
+
+
+def compare_latency_and_memory(single_paths, merged_path, repeat=50):
+    """
+    Time one image through the four single-head interpreters vs the merged one
+
+    Memory is the RSS growth from creating, allocating and warming the
+    interpreters (Linux), which includes touched model weights and arenas.
+    """
+    img = sample_inputs(1, seed=1)[0]
+
+    before = _rss_mb()
+    singles = []
+    for path in single_paths.values():
+        interpreter = tf.lite.Interpreter(model_path=path)
+        interpreter.allocate_tensors()
+        singles.append(interpreter)
+
+    def run_singles():
+        for interpreter in singles:
+            interpreter.set_tensor(interpreter.get_input_details()[0]["index"], img)
+            interpreter.invoke()
+            interpreter.get_tensor(interpreter.get_output_details()[0]["index"])
+
+    run_singles()
+    singles_rss = _rss_mb() - before
+
+    before = _rss_mb()
+    merged = tf.lite.Interpreter(model_path=merged_path)
+    merged.allocate_tensors()
+    runner = merged.get_signature_runner()
+    runner(image=img)
+    merged_rss = _rss_mb() - before
+
+    report = {
+        "single_ms": round(_median_ms(run_singles, repeat), 2),
+        "merged_ms": round(_median_ms(lambda: runner(image=img), repeat), 2),
+        "single_rss_mb": round(singles_rss, 1),
+        "merged_rss_mb": round(merged_rss, 1),
+        "single_file_mb": round(sum(os.path.getsize(p) for p in single_paths.values()) / 1e6, 1),
+        "merged_file_mb": round(os.path.getsize(merged_path) / 1e6, 1),
     }
+    logger.info(f"latency/memory: {report}")
+    return report
+
+
+def build_merged(models_dir, out_path, atol=1e-4, samples=8, repeat=50):
+    """
+    Load (repairing if needed) the four .h5 models, merge them, convert the
+    result to one TFLite file and validate it against the originals
+
+    Returns:
+        dict: Parity and latency/memory report
+    """
+    models = {}
+    for name, filename in MERGED_HEADS.items():
+        model, method = load_for_conversion(os.path.join(models_dir, filename), name)
+        logger.info(f"{name}: loaded ({method})")
+        models[name] = model
+
+    merged = build_merged_model(models)
+    convert_to_tflite(merged, out_path)
+    parity = check_merged_parity(models, out_path, sample_inputs(samples), atol=atol)
+
+    # Single-head TFLite files for the comparison, converted the same way
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    single_paths = {}
+    for name, model in models.items():
+        single_paths[name] = convert_to_tflite(model, os.path.join(out_dir, f"{name}.single.tflite"))
+    try:
+        performance = compare_latency_and_memory(single_paths, out_path, repeat=repeat)
+    finally:
+        for path in single_paths.values():
+            os.remove(path)
+    return {"output": out_path, "heads": list(models), "max_abs_diff": parity, **performance}
+
+
+# --------------------------------------------------------
+# Conversion pipeline: .h5 -> .tflite with parity checks
+# --------------------------------------------------------
+MANIFEST_NAME = "manifest.json"
+MANIFEST_FORMAT = 1
+
+
+def find_sources(models_dir):
+    """Every .h5 model in models_dir, except the *_fixed.h5 copies written by save_fixed()"""
+    return sorted(
+        os.path.join(models_dir, name) for name in os.listdir(models_dir)
+        if name.endswith(".h5") and not name.endswith("_fixed.h5")
+    )
 
 
-    for name, path in model_files.items():
+def load_for_conversion(path, name):
+    """load_or_fix(), reusing a repaired copy from an earlier run instead of repairing again"""
+    base, ext = os.path.splitext(path)
+    fixed = base + "_fixed" + ext
+    if os.path.exists(fixed) and os.path.getmtime(fixed) >= os.path.getmtime(path):
+        try:
+            return wrap_multi_input_to_first(load_model(fixed, compile=False), name), "load_model(fixed)"
+        except Exception as e:
+            logger.warning(f"{name}: stale repaired copy {fixed}: {e}")
+    return load_or_fix(path, name)
+
+
+def tensor_signature(details):
+    return [{"name": d["name"], "shape": [int(x) for x in d["shape"]], "dtype": np.dtype(d["dtype"]).name}
+            for d in details]
+
+
+def convert_one(src, out_dir, atol=1e-4, samples=8):
+    """
+    Repair (if needed), convert and validate one model; runs in a pool worker
+
+    Returns:
+        dict: Manifest entry for the converted model
+
+    Raises:
+        AssertionError: If the TFLite outputs differ from Keras by more than `atol`
+    """
+    name = os.path.splitext(os.path.basename(src))[0]
+    source_sha256 = file_sha256(src)
+    model, method = load_for_conversion(src, name)
+
+    out_path = os.path.join(out_dir, name + ".tflite")
+    tmp_path = out_path + ".tmp"
+    convert_to_tflite(model, tmp_path)
+
+    interpreter = tf.lite.Interpreter(model_path=tmp_path)
+    interpreter.allocate_tensors()
+    input_details = interpreter.get_input_details()
+    output_details = interpreter.get_output_details()
+    input_shape = tuple(int(x) for x in input_details[0]["shape"][1:])
+
+    worst = 0.0
+    for img in sample_inputs(samples, shape=input_shape):
+        interpreter.set_tensor(input_details[0]["index"], img)
+        interpreter.invoke()
+        got = interpreter.get_tensor(output_details[0]["index"])
+        expected = model(img, training=False).numpy()
+        worst = max(worst, float(np.max(np.abs(got - expected))))
+    if worst > atol:
+        os.remove(tmp_path)
+        raise AssertionError(f"{name}: TFLite output differs from Keras by {worst:.2e} (> {atol})")
+    os.replace(tmp_path, out_path)
+    logger.info(f"{name}: converted ({method}), max |tflite - keras| = {worst:.2e}")
+
+    return {
+        "source": os.path.basename(src),
+        "source_sha256": source_sha256,
+        "tflite": os.path.basename(out_path),
+        "tflite_sha256": file_sha256(out_path),
+        "size_bytes": os.path.getsize(out_path),
+        "method": method,
+        "max_abs_diff": worst,
+        "inputs": tensor_signature(input_details),
+        "outputs": tensor_signature(output_details),
+    }
+
+
+def load_manifest(out_dir):
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"format": MANIFEST_FORMAT, "version": 0, "models": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def is_cached(entry, src, out_dir):
+    """True if `src` is unchanged since `entry` was built and its output is intact"""
+    out_path = os.path.join(out_dir, entry["tflite"])
+    return (os.path.exists(out_path)
+            and entry["source_sha256"] == file_sha256(src)
+            and entry["tflite_sha256"] == file_sha256(out_path))
+
+
+def convert_all(models_dir, out_dir, workers=None, atol=1e-4, samples=8, force=False):
+    """
+    Convert every .h5 model in models_dir to TFLite in a process pool
+
+    Models whose source hash matches the previous manifest (and whose output
+    is still intact) are skipped. The manifest version is bumped whenever an
+    output changes, so deployments can tell model sets apart. A model that
+    fails to convert keeps its previous entry (its old .tflite is left in
+    place) and is only listed under "failures".
+
+    Returns:
+        dict: The manifest that was written (also saved as out_dir/manifest.json)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    previous = load_manifest(out_dir)
+    sources = find_sources(models_dir)
+
+    entries = {}
+    todo = []
+    for src in sources:
+        name = os.path.splitext(os.path.basename(src))[0]
+        entry = previous["models"].get(name)
+        if not force and entry is not None and is_cached(entry, src, out_dir):
+            logger.info(f"{name}: unchanged, skipping")
+            entries[name] = entry
+        else:
+            todo.append((name, src))
+
+    failures = {}
+    converted = set()
+    if todo:
+        # spawn: TensorFlow's runtime threads do not survive fork()
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers or min(len(todo), os.cpu_count() or 1),
+                                 mp_context=context) as pool:
+            futures = {pool.submit(convert_one, src, out_dir, atol, samples): name for name, src in todo}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    entries[name] = future.result()
+                    converted.add(name)
+                except Exception as e:
+                    logger.error(f"{name}: conversion failed: {e}")
+                    failures[name] = str(e)
+                    if name in previous["models"]:
+                        entries[name] = previous["models"][name]
+
+    changed = bool(converted)
+    manifest = {
+        "format": MANIFEST_FORMAT,
+        "version": previous["version"] + 1 if changed or set(entries) != set(previous["models"]) else previous["version"],
+        "generated_at": datetime.utcnow().isoformat() + "Z",
+        "tensorflow": tf.__version__,
+        "models": dict(sorted(entries.items())),
+        "failures": failures,
+    }
+    tmp_path = os.path.join(out_dir, MANIFEST_NAME + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(out_dir, MANIFEST_NAME))
+    return manifest
+
+
+def repair(paths):
+    """Inspect and repair the given .h5 files, saving *_fixed.h5 copies where needed"""
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
         try:
             if not os.path.exists(path):
                 logger.error(f"{name}: path not found: {path}")
@@ -181,3 +516,49 @@ if __name__ == "__main__":
             logger.info(f"{name}: READY (method={method}). input_shape={model.input_shape}, outputs={model.output_shape}")
         except Exception as e:
             logger.error(f"{name}: could not repair/load: {e}\n{traceback.format_exc()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Repair Keras .h5 models and build TFLite files")
+    commands = parser.add_subparsers(dest="command")
+
+    convert = commands.add_parser("convert", help="convert every .h5 in a directory to .tflite (cached, parallel)")
+    convert.add_argument("--models-dir", default="models")
+    convert.add_argument("--out-dir", default="models")
+    convert.add_argument("--workers", type=int, help="conversion processes (default: one per model, up to the CPU count)")
+    convert.add_argument("--atol", type=float, default=1e-4, help="max allowed |tflite - keras| per output")
+    convert.add_argument("--samples", type=int, default=8)
+    convert.add_argument("--force", action="store_true", help="ignore the cache and convert everything")
+
+    merge = commands.add_parser("merge", help="build one multi-head TFLite model from the four .h5 models")
+    merge.add_argument("--models-dir", default="models")
+    merge.add_argument("--out", default="models/skin_multihead.tflite")
+    merge.add_argument("--atol", type=float, default=1e-4, help="max allowed |merged - keras| per output")
+    merge.add_argument("--samples", type=int, default=8)
+    merge.add_argument("--repeat", type=int, default=50, help="timed invokes per variant")
+    merge.add_argument("--report", help="also write the JSON report here")
+
+    # Also what runs when no subcommand is given, as before subcommands existed
+    fix = commands.add_parser("repair", help="inspect and repair .h5 files (default: every .h5 in models/)")
+    fix.add_argument("paths", nargs="*")
+
+    args = parser.parse_args()
+    if args.command == "convert":
+        manifest = convert_all(args.models_dir, args.out_dir, workers=args.workers, atol=args.atol,
+                               samples=args.samples, force=args.force)
+        print(json.dumps({"version": manifest["version"], "models": sorted(manifest["models"]),
+                          "failures": manifest["failures"]}, indent=2))
+        return 1 if manifest["failures"] else 0
+    if args.command == "merge":
+        report = build_merged(args.models_dir, args.out, atol=args.atol, samples=args.samples, repeat=args.repeat)
+        print(json.dumps(report, indent=2))
+        if args.report:
+            with open(args.report, "w") as f:
+                json.dump(report, f, indent=2)
+        return 0
+    repair(getattr(args, "paths", None) or find_sources("models"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Idempotency Keys
+Bounded in-memory TTL store so a retried request gets the original result
+instead of running the analysis (and storing it) again
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from .metrics import CACHE_REQUESTS
+
+
+class IdempotencyConflict(Exception):
+    """Raised when a key is reused with a different request payload"""
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "future", "expires_at")
+
+    def __init__(self, fingerprint: str, future: asyncio.Future, expires_at: float):
+        self.fingerprint = fingerprint
+        self.future = future
+        self.expires_at = expires_at
+
+
+class IdempotencyStore:
+    """
+    Remembers the result of each (scope, key) for `ttl_seconds`
+
+    Entries are kept in insertion order and the oldest are dropped once
+    `max_entries` is reached, so memory stays bounded whatever the traffic.
+    While the first request for a key is still running, retries await the
+    same future rather than starting a second run. Only successful results
+    are remembered: a failed run is forgotten so the client can retry it.
+
+    Must be used from a single event loop (one store per worker process).
+    """
+
+    def __init__(self, ttl_seconds: float = 24 * 3600, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, now: float):
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            expired = entry.expires_at <= now and entry.future.done()
+            if not expired and len(self._entries) < self.max_entries:
+                break
+            del self._entries[key]
+
+    async def run(self, scope: str, key: str, fingerprint: str,
+                  fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run `fn` once per (scope, key)
+
+        Args:
+            scope (str): Namespace for the key, e.g. the user id
+            key (str): Client-supplied Idempotency-Key
+            fingerprint (str): Digest of the request payload
+            fn (callable): Coroutine function producing the result
+
+        Returns:
+            tuple: (result, replayed) where replayed is True when the result
+            came from an earlier request with the same key
+
+        Raises:
+            IdempotencyConflict: If the key was used for a different payload
+        """
+        now = time.monotonic()
+        entry_key = (scope, key)
+        entry: Optional[_Entry] = self._entries.get(entry_key)
+        if entry is not None and entry.future.done() and entry.expires_at <= now:
+            del self._entries[entry_key]
+            entry = None
+
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                raise IdempotencyConflict("Idempotency-Key was already used for a different request")
+            CACHE_REQUESTS.labels("idempotency", "hit" if entry.future.done() else "wait").inc()
+            # shield: a retry that disconnects must not cancel the original run
+            return await asyncio.shield(entry.future), True
+
+        CACHE_REQUESTS.labels("idempotency", "miss").inc()
+        self._evict(now)
+        # The run is a task of its own so a client that disconnects (the first
+        # one included) never cancels work other retries are waiting for
+        task = asyncio.ensure_future(fn())
+        self._entries[entry_key] = _Entry(fingerprint, task, now + self.ttl_seconds)
+
+        def forget_failure(done: asyncio.Future):
+            if done.cancelled() or done.exception() is not None:
+                current = self._entries.get(entry_key)
+                if current is not None and current.future is done:
+                    del self._entries[entry_key]
+
+        task.add_done_callback(forget_failure)
+        return await asyncio.shield(task), False
@@ -1,8 +1,13 @@
 """
 Ingredient Knowledge Base
-Comprehensive mapping of skin concerns to dermatologist-approved ingredients
+Comprehensive mapping of skin concerns to dermatologist-approved ingredients.
+The tables below are compiled once at import into frozen lookup indexes, so
+the query functions never walk the nested dicts.
 """
 
+from functools import lru_cache
+from types import MappingProxyType
+
 # Skin Concern to Ingredient Mapping
 CONCERN_TO_INGREDIENTS = {
     "acne": {
@@ -323,6 +328,101 @@ INGREDIENT_COMPATIBILITY = {
     }
 }
 
+# Ingredient classes named in INGREDIENT_COMPATIBILITY, and the ingredients
+# that count as members of them
+INGREDIENT_GROUPS = {
+    "strong acids": [
+        "glycolic acid",
+        "lactic acid",
+        "alpha hydroxy acids",
+        "high percentage acids",
+        "high percentage aha/bha"
+    ]
+}
+
+# --------------------------------------------------------
+# Compiled indexes
+# --------------------------------------------------------
+# Removed from the recommended list for medium and high sensitivity
+STRONG_INGREDIENTS = ("retinol", "high percentage acids", "benzoyl peroxide")
+SENSITIVE_LEVELS = ("medium", "high")
+
+
+def canonical_ingredient(name):
+    """Canonical ID of an ingredient name ("Vitamin_C", "vitamin-c" and "vitamin c" are all "vitamin c")"""
+    return " ".join(str(name).lower().replace("_", " ").replace("-", " ").split())
+
+
+def _compile_concerns():
+    """(concern, skin type or None, sensitive) -> (recommended tuple, avoid frozenset)"""
+    index = {}
+    for concern, data in CONCERN_TO_INGREDIENTS.items():
+        for skin_type in (*SKIN_TYPE_RECOMMENDATIONS, None):
+            skin_avoid = SKIN_TYPE_RECOMMENDATIONS.get(skin_type, {}).get("avoid_ingredients", [])
+            avoid = frozenset(data["avoid_if_sensitive"]) | frozenset(skin_avoid)
+            for sensitive in (False, True):
+                recommended = tuple(ing for ing in data["recommended"]
+                                    if not (sensitive and ing in STRONG_INGREDIENTS))
+                index[(concern, skin_type, sensitive)] = (recommended, avoid)
+    return index
+
+
+def _compile_ingredients():
+    """ingredient -> concerns recommending it, and the ingredients with strength levels"""
+    concerns, with_strength = {}, set()
+    for concern, data in CONCERN_TO_INGREDIENTS.items():
+        for ingredient in data["recommended"]:
+            concerns.setdefault(ingredient, []).append(concern)
+            if ingredient in data.get("strength_levels", {}):
+                with_strength.add(ingredient)
+    return (MappingProxyType({ing: tuple(names) for ing, names in concerns.items()}),
+            frozenset(with_strength))
+
+
+def _compile_conflicts():
+    """Symmetric canonical ID -> incompatible IDs, and member ID -> group IDs"""
+    edges = {}
+    for ingredient, data in INGREDIENT_COMPATIBILITY.items():
+        first = canonical_ingredient(ingredient)
+        for other in data["incompatible"]:
+            second = canonical_ingredient(other)
+            edges.setdefault(first, set()).add(second)
+            edges.setdefault(second, set()).add(first)
+    groups = {}
+    for group, members in INGREDIENT_GROUPS.items():
+        for member in members:
+            groups.setdefault(canonical_ingredient(member), set()).add(canonical_ingredient(group))
+    return ({ing: frozenset(others) for ing, others in edges.items()},
+            {ing: frozenset(names) for ing, names in groups.items()})
+
+
+def compile_indexes():
+    """
+    (Re)build the lookup indexes from the tables above
+
+    Runs once at import; call it again after editing the tables at runtime.
+    """
+    global _CONCERN_INDEX, INGREDIENT_CONCERNS, _WITH_STRENGTH, BEST_TIME, CONFLICT_EDGES, _GROUPS_OF
+    _CONCERN_INDEX = _compile_concerns()
+    # Ingredient -> concerns it is recommended for, in table order
+    INGREDIENT_CONCERNS, _WITH_STRENGTH = _compile_ingredients()
+    # Canonical ID -> best time of day, and -> IDs it must not be layered with
+    BEST_TIME = {canonical_ingredient(ing): data["best_time"] for ing, data in INGREDIENT_COMPATIBILITY.items()}
+    CONFLICT_EDGES, _GROUPS_OF = _compile_conflicts()
+    _product_recommendations.cache_clear()
+
+
+def ingredient_ids(name):
+    """Canonical IDs an ingredient name stands for: its own and those of its groups"""
+    ingredient = canonical_ingredient(name)
+    return (ingredient, *_GROUPS_OF.get(ingredient, ()))
+
+
+def _concern_entry(concern, skin_type, sensitivity):
+    key = skin_type if skin_type in SKIN_TYPE_RECOMMENDATIONS else None
+    return _CONCERN_INDEX.get((concern, key, sensitivity in SENSITIVE_LEVELS))
+
+
 def get_ingredients_for_concern(concern, skin_type="normal", sensitivity="low"):
     """
     Get recommended ingredients for a specific skin concern
@@ -335,30 +435,30 @@ def get_ingredients_for_concern(concern, skin_type="normal", sensitivity="low"):
     Returns:
         dict: Recommended ingredients and avoid list
     """
-    if concern not in CONCERN_TO_INGREDIENTS:
+    entry = _concern_entry(concern, skin_type, sensitivity)
+    if entry is None:
         return {"recommended": [], "avoid": [], "strength_levels": {}}
     
-    concern_data = CONCERN_TO_INGREDIENTS[concern]
-    recommended = concern_data["recommended"].copy()
-    avoid = concern_data["avoid_if_sensitive"].copy()
-    
-    # Adjust based on skin type
-    skin_type_data = SKIN_TYPE_RECOMMENDATIONS.get(skin_type, {})
-    skin_type_avoid = skin_type_data.get("avoid_ingredients", [])
-    avoid.extend(skin_type_avoid)
-    
-    # Adjust based on sensitivity
-    if sensitivity in ["medium", "high"]:
-        # Remove strong ingredients for sensitive skin
-        strong_ingredients = ["retinol", "high percentage acids", "benzoyl peroxide"]
-        recommended = [ing for ing in recommended if ing not in strong_ingredients]
-    
+    recommended, avoid = entry
     return {
-        "recommended": recommended,
-        "avoid": list(set(avoid)),  # Remove duplicates
-        "strength_levels": concern_data.get("strength_levels", {})
+        "recommended": list(recommended),
+        "avoid": list(avoid),
+        "strength_levels": CONCERN_TO_INGREDIENTS[concern].get("strength_levels", {})
     }
 
+
+@lru_cache(maxsize=4096)
+def _product_recommendations(concerns, skin_type, sensitivity):
+    """(ingredients, avoid) for a tuple of concerns, both tuples in first-seen order"""
+    ingredients, avoid = {}, {}
+    for concern in concerns:
+        entry = _concern_entry(concern, skin_type, sensitivity)
+        if entry is not None:
+            ingredients.update(dict.fromkeys(entry[0]))
+            avoid.update(dict.fromkeys(sorted(entry[1])))
+    return tuple(ing for ing in ingredients if ing not in avoid), tuple(avoid)
+
+
 def get_product_recommendations(concerns, skin_type="normal", budget="medium", 
                               sensitivity="low", product_type=None):
     """
@@ -374,21 +474,9 @@ def get_product_recommendations(concerns, skin_type="normal", budget="medium",
     Returns:
         dict: Comprehensive recommendations
     """
-    all_ingredients = []
-    avoid_ingredients = []
-    
-    # Collect ingredients for all concerns
-    for concern in concerns:
-        concern_data = get_ingredients_for_concern(concern, skin_type, sensitivity)
-        all_ingredients.extend(concern_data["recommended"])
-        avoid_ingredients.extend(concern_data["avoid"])
-    
-    # Remove duplicates and avoid ingredients
-    all_ingredients = list(set(all_ingredients))
-    avoid_ingredients = list(set(avoid_ingredients))
-    
-    # Filter out ingredients to avoid
-    final_ingredients = [ing for ing in all_ingredients if ing not in avoid_ingredients]
+    # Deduplicated, with ingredients to avoid filtered out; memoized per
+    # (concerns, skin type, sensitivity)
+    final_ingredients, avoid_ingredients = _product_recommendations(tuple(concerns), skin_type, sensitivity)
     
     # Get product categories
     if product_type:
@@ -400,8 +488,8 @@ def get_product_recommendations(concerns, skin_type="normal", budget="medium",
     budget_data = BUDGET_TIERS.get(budget, BUDGET_TIERS["medium"])
     
     return {
-        "ingredients": final_ingredients,
-        "avoid_ingredients": avoid_ingredients,
+        "ingredients": list(final_ingredients),
+        "avoid_ingredients": list(avoid_ingredients),
         "product_categories": categories,
         "budget": budget_data,
         "skin_type": skin_type,
@@ -413,6 +501,10 @@ def check_ingredient_compatibility(ingredient1, ingredient2):
     """
     Check if two ingredients are compatible
     
+    Names are matched by canonical ID ("vitamin C" is "vitamin_c") and
+    through their groups (glycolic acid is one of the "strong acids"), in
+    either order.
+    
     Args:
         ingredient1 (str): First ingredient
         ingredient2 (str): Second ingredient
@@ -420,9 +512,9 @@ def check_ingredient_compatibility(ingredient1, ingredient2):
     Returns:
         bool: True if compatible, False otherwise
     """
-    if ingredient1 in INGREDIENT_COMPATIBILITY:
-        return ingredient2 not in INGREDIENT_COMPATIBILITY[ingredient1]["incompatible"]
-    return True
+    second = ingredient_ids(ingredient2)
+    return not any(other in CONFLICT_EDGES.get(first, ()) for first in ingredient_ids(ingredient1)
+                   for other in second)
 
 def get_optimal_usage_time(ingredient):
     """
@@ -434,9 +526,7 @@ def get_optimal_usage_time(ingredient):
     Returns:
         str: Optimal usage time (morning, evening, any)
     """
-    if ingredient in INGREDIENT_COMPATIBILITY:
-        return INGREDIENT_COMPATIBILITY[ingredient]["best_time"]
-    return "any"
+    return BEST_TIME.get(canonical_ingredient(ingredient), "any")
 
 def get_strength_recommendation(ingredient, skin_type, sensitivity):
     """
@@ -450,16 +540,10 @@ def get_strength_recommendation(ingredient, skin_type, sensitivity):
     Returns:
         str: Recommended strength level
     """
-    # Find which concern this ingredient belongs to
-    for concern, data in CONCERN_TO_INGREDIENTS.items():
-        if ingredient in data["recommended"]:
-            strength_levels = data.get("strength_levels", {})
-            if ingredient in strength_levels:
-                if sensitivity == "high":
-                    return "mild"
-                elif sensitivity == "medium":
-                    return "mild"
-                else:
-                    return "moderate"
-    
-    return "moderate" 
\ No newline at end of file
+    # Only ingredients with strength levels in one of their concerns go milder
+    if ingredient in _WITH_STRENGTH and sensitivity in SENSITIVE_LEVELS:
+        return "mild"
+    return "moderate"
+
+
+compile_indexes()
@@ -0,0 +1,50 @@
+"""
+TFLite Interpreter
+Finds an Interpreter class without importing more than inference needs: the
+standalone LiteRT / tflite_runtime packages (a few MB, no TensorFlow) when
+installed, full TensorFlow otherwise
+"""
+
+import importlib
+from functools import lru_cache
+
+# runtime name -> module providing Interpreter, in the order "auto" tries them
+RUNTIMES = {
+    "litert": "ai_edge_litert.interpreter",
+    "tflite_runtime": "tflite_runtime.interpreter",
+    "tensorflow": "tensorflow.lite",
+}
+
+
+@lru_cache(maxsize=None)
+def resolve_runtime(runtime: str = "auto") -> str:
+    """
+    Name of the runtime `runtime` selects, importing it
+
+    Args:
+        runtime (str): "auto" (first installed of RUNTIMES) or one of RUNTIMES
+
+    Returns:
+        str: The runtime used
+
+    Raises:
+        ImportError: If the requested runtime (or, for "auto", any) is not installed
+        ValueError: If `runtime` is not a known runtime
+    """
+    if runtime != "auto":
+        if runtime not in RUNTIMES:
+            raise ValueError(f"Unknown TFLite runtime {runtime!r}; expected auto or one of {', '.join(RUNTIMES)}")
+        importlib.import_module(RUNTIMES[runtime])
+        return runtime
+    for name, module in RUNTIMES.items():
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            continue
+        return name
+    raise ImportError("No TFLite runtime installed: pip install tflite-runtime (or ai-edge-litert, or tensorflow)")
+
+
+def interpreter_class(runtime: str = "auto"):
+    """The Interpreter class of the runtime `runtime` selects (see resolve_runtime())"""
+    return importlib.import_module(RUNTIMES[resolve_runtime(runtime)]).Interpreter
@@ -0,0 +1,308 @@
+"""
+Analysis Job Queue
+Persistent (SQLite) queue of analysis jobs processed by a pool of worker threads
+"""
+
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from .serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATES = ("done", "failed")
+
+
+class QueueFull(Exception):
+    """Raised when the number of queued jobs reached the configured limit"""
+
+
+class JobFailed(Exception):
+    """Raised by a handler for failures that retrying cannot fix (e.g. invalid image)"""
+
+
+class JobQueue:
+    """
+    Job queue persisted in SQLite so queued work survives restarts
+
+    Jobs are claimed inside a BEGIN IMMEDIATE transaction, which makes the
+    claim atomic across threads and across prefork worker processes sharing
+    the same database file.
+
+    A claim is a lease: the job records this queue's instance token and a
+    lease expiry that a heartbeat thread keeps extending while the job runs.
+    Jobs whose lease ran out (their process died or the container restarted)
+    are put back in the queue, or failed once they used up max_attempts, so
+    a job that crashes its worker is not retried forever. A worker that lost
+    its lease cannot overwrite the new owner's result. PIDs are not used,
+    since they are reused across restarts.
+    """
+
+    def __init__(self, path: str, job_dir: str, handler: Callable[[Dict[str, Any]], Dict[str, Any]],
+                 workers: int = 2, max_queued: int = 200, max_attempts: int = 3,
+                 retention_seconds: float = 24 * 3600, lease_seconds: float = 60):
+        self.path = path
+        self.job_dir = job_dir
+        self.handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self.lease_seconds = lease_seconds
+        # Identifies this queue's claims; a new one per process and per start
+        self.instance = uuid.uuid4().hex
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+
+        os.makedirs(job_dir, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                params TEXT NOT NULL,
+                image_path TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker_pid INTEGER,
+                worker_token TEXT,
+                lease_until REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+        """)
+        # Databases created before claims were leases
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("worker_token", "TEXT"), ("lease_until", "REAL")):
+            if column not in columns:
+                try:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+                except sqlite3.OperationalError as e:
+                    # Another prefork worker added it first
+                    if "duplicate column" not in str(e):
+                        raise
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ------------------------------------------------------------------
+    # Producer side
+    # ------------------------------------------------------------------
+    def submit(self, user_id: str, params: Dict[str, Any], image_source, image_format: str) -> str:
+        """
+        Persist an image and its parameters as a queued job
+
+        Args:
+            user_id (str): Owner of the job
+            params (dict): JSON-serialisable parameters for the handler
+            image_source: Bytes or path of the accepted upload
+            image_format (str): File extension for the stored image
+
+        Returns:
+            str: Job id
+
+        Raises:
+            QueueFull: If max_queued jobs are already waiting
+        """
+        if self.queued_count() >= self.max_queued:
+            raise QueueFull(f"{self.max_queued} jobs already queued")
+
+        job_id = uuid.uuid4().hex
+        image_path = os.path.join(self.job_dir, f"{job_id}.{image_format}")
+        if isinstance(image_source, (bytes, bytearray)):
+            with open(image_path, "wb") as f:
+                f.write(image_source)
+        else:
+            shutil.move(image_source, image_path)
+
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, user_id, status, params, image_path, created_at, updated_at) "
+            "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+            (job_id, str(user_id), json.dumps(params), image_path, now, now),
+        )
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def queued_count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Current state of a job (result decoded), or None if unknown"""
+        row = self._conn().execute(
+            "SELECT id, user_id, status, result, error, attempts, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(("job_id", "user_id", "status", "result", "error", "attempts",
+                        "created_at", "updated_at"), row))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        if job["status"] == "queued":
+            job["position"] = self._conn().execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?",
+                (job["created_at"],),
+            ).fetchone()[0]
+        return job
+
+    # ------------------------------------------------------------------
+    # Worker side
+    # ------------------------------------------------------------------
+    def start(self):
+        self.instance = uuid.uuid4().hex
+        self._recover()
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self, timeout: float = 30):
+        self._stop.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _heartbeat(self):
+        """Extend the lease of every job this queue is running"""
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self._conn().execute(
+                    "UPDATE jobs SET lease_until = ? WHERE status = 'running' AND worker_token = ?",
+                    (time.time() + self.lease_seconds, self.instance),
+                )
+            except sqlite3.OperationalError as e:
+                logger.warning("Job lease renewal failed: %s", e)
+
+    def _recover(self):
+        """Requeue running jobs whose lease expired (their worker died or restarted), or fail them when out of attempts"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = conn.execute(
+                "SELECT id, attempts, image_path FROM jobs "
+                "WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?)",
+                (now,),
+            ).fetchall()
+            failed = [(job_id, image_path) for job_id, attempts, image_path in expired
+                      if attempts >= self.max_attempts]
+            conn.executemany(
+                "UPDATE jobs SET status = 'failed', error = 'lease expired', worker_token = NULL, "
+                "lease_until = NULL, updated_at = ? WHERE id = ?",
+                [(now, job_id) for job_id, _ in failed],
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', worker_pid = NULL, worker_token = NULL, lease_until = NULL, "
+                "updated_at = ? WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?)",
+                (now, now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        for job_id, image_path in failed:
+            logger.error("Job %s failed: its lease expired on the last attempt", job_id)
+            if os.path.exists(image_path):
+                os.remove(image_path)
+        if len(expired) > len(failed):
+            logger.warning("Requeued %d interrupted jobs", len(expired) - len(failed))
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, user_id, params, image_path, attempts FROM jobs "
+                "WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                now = time.time()
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker_pid = ?, "
+                    "worker_token = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                    (os.getpid(), self.instance, now + self.lease_seconds, now, row[0]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        job_id, user_id, params, image_path, attempts = row
+        return {"job_id": job_id, "user_id": user_id, "params": json.loads(params),
+                "image_path": image_path, "attempts": attempts + 1}
+
+    def _finish(self, job: Dict[str, Any], status: str, result=None, error=None):
+        # Only while this queue still holds the lease; otherwise the job was requeued
+        # and possibly claimed again, and the new owner's outcome wins
+        finished = self._conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, worker_token = NULL, lease_until = NULL, "
+            "updated_at = ? WHERE id = ? AND status = 'running' AND worker_token = ?",
+            (status, dumps(result).decode() if result is not None else None, error, time.time(), job["job_id"],
+             self.instance),
+        ).rowcount
+        if not finished:
+            logger.warning("Job %s lost its lease before finishing; discarding this outcome", job["job_id"])
+            return
+        if status in TERMINAL_STATES and os.path.exists(job["image_path"]):
+            os.remove(job["image_path"])
+
+    def _purge_expired(self):
+        self._conn().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+            (time.time() - self.retention_seconds,),
+        )
+
+    def _work(self):
+        last_purge = last_recover = 0.0
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.OperationalError as e:
+                logger.warning("Job claim failed: %s", e)
+                job = None
+
+            if job is None:
+                if time.monotonic() - last_purge > 60:
+                    self._purge_expired()
+                    last_purge = time.monotonic()
+                if time.monotonic() - last_recover > self.lease_seconds / 2:
+                    self._recover()
+                    last_recover = time.monotonic()
+                # Other processes may enqueue too, so also wake up periodically
+                with self._wakeup:
+                    self._wakeup.wait(timeout=1.0)
+                continue
+
+            try:
+                result = self.handler(job)
+                self._finish(job, "done", result=result)
+            except Exception as e:
+                logger.error("Job %s failed (attempt %d): %s", job["job_id"], job["attempts"], e)
+                retry = job["attempts"] < self.max_attempts and not isinstance(e, JobFailed)
+                self._finish(job, "queued" if retry else "failed", error=str(e))
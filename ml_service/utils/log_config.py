@@ -0,0 +1,155 @@
+"""
+Logging Setup
+Structured JSON logs written off the request path via QueueHandler/QueueListener,
+with per-request correlation ids and sampled debug payloads
+"""
+
+import atexit
+import contextvars
+import logging
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+from .serialization import dumps
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+debug_sampled_var = contextvars.ContextVar("debug_sampled", default=False)
+
+_debug_sample_rate = 0.0
+_listener = None
+_output_handler = None
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RESERVED_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "request_id"}
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the current request id while still on the caller's context"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; `extra=` fields are emitted as top-level keys"""
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        try:
+            return dumps(entry).decode()
+        except TypeError:
+            return dumps({k: v if isinstance(v, (str, int, float, bool, type(None))) else repr(v)
+                          for k, v in entry.items()}).decode()
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that enqueues the raw record
+
+    The stock prepare() renders the message on the calling thread; here
+    message formatting and JSON encoding are left to the listener thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def configure_logging(level="INFO", debug_sample_rate=0.0, stream=None):
+    """
+    Route all logging through a background listener writing JSON lines
+
+    Args:
+        level (str): Root log level
+        debug_sample_rate (float): Fraction of requests whose debug payloads are logged
+        stream: Output stream (stdout if None)
+
+    Returns:
+        QueueListener: The running listener (stopped automatically at exit)
+    """
+    global _debug_sample_rate, _listener, _output_handler
+
+    _stop_listener()
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    # uvicorn installs its own synchronous stream handlers; send it through the queue too
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uv_logger = logging.getLogger(name)
+        uv_logger.handlers.clear()
+        uv_logger.propagate = True
+
+    _debug_sample_rate = max(0.0, min(1.0, float(debug_sample_rate)))
+    _output_handler = output
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def _restart_listener_in_child():
+    """The listener thread does not survive fork(); start a fresh one on the same queue"""
+    global _listener
+    if _listener is not None:
+        _listener = QueueListener(_listener.queue, _output_handler, respect_handler_level=True)
+        _listener.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listener_in_child)
+
+
+@atexit.register
+def _stop_listener():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def start_request(request_id=None):
+    """
+    Bind a correlation id (and the debug sampling decision) to the current request
+
+    Args:
+        request_id (str): Caller-supplied id, a new one is generated if None
+
+    Returns:
+        str: The request id in effect
+    """
+    request_id = request_id or uuid.uuid4().hex
+    request_id_var.set(request_id)
+    debug_sampled_var.set(_debug_sample_rate > 0 and random.random() < _debug_sample_rate)
+    return request_id
+
+
+def payload_logging_enabled(logger):
+    """True when `logger` would emit debug records and this request was sampled"""
+    return debug_sampled_var.get() and logger.isEnabledFor(logging.DEBUG)
@@ -0,0 +1,315 @@
+"""
+Service Metrics
+Minimal in-process counters, gauges and histograms rendered in the Prometheus
+text exposition format
+"""
+
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets (seconds) spanning sub-millisecond stages up to slow inference
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values: str):
+        """Return the child for one label combination (cached, cheap to call repeatedly)"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in list(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key, child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {child.get()}"]
+
+
+class _Value:
+    __slots__ = ("_value", "_lock")
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value: float):
+        self._value = float(value)
+
+    def get(self) -> float:
+        return self._value
+
+
+class _FunctionValue:
+    __slots__ = ("_fn",)
+
+    def __init__(self, fn: Callable[[], float]):
+        self._fn = fn
+
+    def get(self) -> float:
+        try:
+            return float(self._fn())
+        except Exception:
+            return float("nan")
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default.dec(amount)
+
+    def set(self, value: float):
+        self._default.set(value)
+
+    def set_function(self, fn: Callable[[], float], *labelvalues: str):
+        """Compute the gauge at scrape time instead of tracking it"""
+        key = tuple(str(v) for v in labelvalues)
+        with self._lock:
+            self._children[key] = _FunctionValue(fn)
+
+
+class _HistogramValue:
+    __slots__ = ("_upper_bounds", "_counts", "_sum", "_lock")
+
+    def __init__(self, upper_bounds):
+        self._upper_bounds = upper_bounds
+        self._counts = [0] * (len(upper_bounds) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self._upper_bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def _render_child(self, key, child) -> List[str]:
+        counts, total = child.snapshot()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            le_label = f'le="{le}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le_label)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "analyze_stage_seconds", "Time spent in each /analyze/ stage", ["stage", "model"]))
+ERRORS = REGISTRY.register(Counter(
+    "analyze_errors_total", "Failed /analyze/ requests by cause", ["reason"]))
+REJECTIONS = REGISTRY.register(Counter(
+    "analyze_rejections_total", "Uploads refused before analysis", ["reason"]))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "cache_requests_total", "Cache lookups by cache and outcome", ["cache", "outcome"]))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "analyze_in_flight_requests", "Requests currently inside /analyze/"))
+POOL_THREADS = REGISTRY.register(Gauge(
+    "worker_pool_threads", "Worker thread pool occupancy", ["pool", "state"]))
+QUALITY_CHECKS = REGISTRY.register(Counter(
+    "quality_gate_checks_total", "Images scored by the quality gate by outcome (pass/flag/reject)", ["outcome"]))
+QUALITY_FAILURES = REGISTRY.register(Counter(
+    "quality_gate_failures_total", "Quality gate failures by reason", ["reason"]))
+QUALITY_SAVED_SECONDS = REGISTRY.register(Counter(
+    "quality_gate_saved_inference_seconds_total",
+    "Estimated inference time skipped for rejected images (mean observed per-model latency)"))
+MODEL_RELOADS = REGISTRY.register(Counter(
+    "model_reloads_total", "Model reloads by outcome (swapped/deferred/unchanged/failed)",
+    ["cache", "model", "outcome"]))
+MODEL_VERSION_INFO = REGISTRY.register(Gauge(
+    "model_version_info", "1 for the model version currently serving, 0 for replaced ones",
+    ["cache", "model", "version"]))
+MODEL_EVICTIONS = REGISTRY.register(Counter(
+    "model_evictions_total", "Interpreters evicted to stay within the memory budget", ["cache", "model"]))
+MODEL_LOAD_SECONDS = REGISTRY.register(Histogram(
+    "model_load_seconds", "Time to load and warm an interpreter", ["cache", "model"]))
+MODEL_RESIDENT_BYTES = REGISTRY.register(Gauge(
+    "model_resident_bytes", "Estimated memory of resident interpreters (tensor arena plus weights)", ["cache"]))
+MODEL_BUDGET_BYTES = REGISTRY.register(Gauge(
+    "model_budget_bytes", "Memory budget for resident interpreters (0 = unlimited)", ["cache"]))
+SHADOW_OUTCOMES = REGISTRY.register(Counter(
+    "shadow_evaluations_total", "Shadowed candidate predictions by outcome (agree/disagree/error/dropped)",
+    ["model", "outcome"]))
+SHADOW_PREDICTIONS = REGISTRY.register(Counter(
+    "shadow_predictions_total", "Shadowed predictions by production and candidate value (confusion matrix)",
+    ["model", "production", "candidate"]))
+SHADOW_SECONDS = REGISTRY.register(Histogram(
+    "shadow_inference_seconds", "Candidate model inference time in the shadow pool", ["model"]))
+INFERENCE_WORKER_RESTARTS = REGISTRY.register(Counter(
+    "inference_worker_restarts_total", "Inference worker processes replaced, by reason (crashed/hung)", ["reason"]))
+
+
+# Per-request list of (stage, model, seconds) used to build the Server-Timing header
+server_timings_var = contextvars.ContextVar("server_timings", default=None)
+
+# Server-Timing metric names for the stages clients care about
+_SERVER_TIMING_NAMES = {
+    "decode": "decode",
+    "preprocess": "preprocess",
+    "quality": "quality",
+    "ingredients": "recommend",
+    "recommend": "recommend",
+    "db_insert": "db",
+}
+
+
+@contextmanager
+def stage_timer(stage: str, model: str = ""):
+    """Observe the duration of the enclosed block in analyze_stage_seconds"""
+    child = STAGE_SECONDS.labels(stage, model)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        child.observe(elapsed)
+        timings = server_timings_var.get()
+        if timings is not None:
+            timings.append((stage, model, elapsed))
+
+
+def observe_stage(stage: str, seconds: float, model: str = "", timings: Optional[list] = None):
+    """
+    Record a stage timed elsewhere (e.g. in an inference worker process)
+
+    Args:
+        timings (list): The request's start_server_timing() list, captured
+            while still in its context; None to skip Server-Timing
+    """
+    STAGE_SECONDS.labels(stage, model).observe(seconds)
+    if timings is not None:
+        timings.append((stage, model, seconds))
+
+
+def mean_stage_seconds(stage: str, model: str = "") -> float:
+    """Mean observed duration of a stage so far (0 before the first observation)"""
+    counts, total = STAGE_SECONDS.labels(stage, model).snapshot()
+    observations = sum(counts)
+    return total / observations if observations else 0.0
+
+
+def start_server_timing() -> list:
+    """Collect stage timings for the current request (shared with its thread-pool work)"""
+    timings = []
+    server_timings_var.set(timings)
+    return timings
+
+
+def server_timing_header(timings) -> str:
+    """
+    Format collected timings as a Server-Timing header value
+
+    Stages are summed per metric name, e.g. "decode;dur=3.1, infer-acne;dur=41.7, db;dur=5.0"
+    """
+    totals = {}
+    for stage, model, elapsed in timings:
+        name = f"infer-{model}" if stage == "inference" else _SERVER_TIMING_NAMES.get(stage)
+        if name:
+            totals[name] = totals.get(name, 0.0) + elapsed
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+
+def render_metrics() -> str:
+    """Prometheus text exposition of every registered metric"""
+    return REGISTRY.render()
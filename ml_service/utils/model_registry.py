@@ -0,0 +1,356 @@
+"""
+Model Registry
+Versioned model interpreters that can be reloaded one at a time while the
+service keeps serving: a new version is loaded and warmed off the request
+path, then swapped in atomically. An optional memory budget keeps only the
+most recently used models resident.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from .metrics import (CACHE_REQUESTS, MODEL_RELOADS, MODEL_VERSION_INFO, MODEL_EVICTIONS, MODEL_LOAD_SECONDS,
+                      MODEL_RESIDENT_BYTES, MODEL_BUDGET_BYTES)
+
+logger = logging.getLogger("ml_service")
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def interpreter_footprint(interpreter) -> int:
+    """
+    Bytes an interpreter needs resident: every tensor it declares
+
+    TFLite does not expose its arena size, so this sums the activation
+    tensors (the arena) and the constant weights (mmapped from the model
+    file, but paged in on the first invoke). An upper bound, since the
+    arena planner reuses activation memory between ops.
+    """
+    total = 0
+    for detail in interpreter.get_tensor_details():
+        shape = detail.get("shape")
+        if shape is None or len(shape) == 0:
+            continue
+        total += int(np.prod(shape)) * np.dtype(detail["dtype"]).itemsize
+    return total
+
+
+class ReloadUnsupported(RuntimeError):
+    """Raised when the serving configuration cannot swap models in place"""
+
+
+class ModelSource:
+    """Where a model version comes from: its file name, local path and expected checksum"""
+
+    def __init__(self, filename: str, path: str, sha256: Optional[str] = None):
+        self.filename = filename
+        self.path = path
+        self.sha256 = sha256
+
+
+class ModelVersion:
+    """
+    One loaded version of a model
+
+    Never mutated once published: a request that took it from the registry
+    keeps using its interpreter (and lock) even if a reload swaps in a newer
+    version, or the registry evicts it, meanwhile. The interpreter is freed
+    when the last such request drops its reference.
+    """
+
+    def __init__(self, name: str, source: ModelSource, sha256: str, interpreter, size_bytes: int):
+        self.name = name
+        self.filename = source.filename
+        self.path = source.path
+        self.sha256 = sha256
+        self.version = sha256[:12]
+        self.interpreter = interpreter
+        self.size_bytes = size_bytes
+        # An interpreter is not thread-safe
+        self.lock = threading.Lock()
+        # Objects derived from this interpreter (e.g. signature runners)
+        self.cache = {}
+        self.loaded_at = time.time()
+
+    def describe(self) -> dict:
+        return {"model": self.name, "version": self.version, "file": self.filename,
+                "sha256": self.sha256, "size_bytes": self.size_bytes, "loaded_at": self.loaded_at}
+
+
+class ModelRegistry:
+    """
+    Current version of each model, by name, loaded on demand
+
+    With a memory budget, loading a model that does not fit evicts the least
+    recently used unpinned models first. An evicted model is reloaded (same
+    version, its file checksum verified again) on its next use, and a model
+    bigger than the whole budget is still loaded, with a warning.
+
+    Args:
+        resolve (callable): resolve(name, refresh) -> ModelSource. With
+            refresh=True it must look for a newer version (re-read the
+            manifest, re-check the hub) instead of using cached answers
+        load (callable): load(path) -> interpreter with tensors allocated
+        warm (callable): warm(ModelVersion), run once before a version is
+            published so its first request is not cold
+        budget_bytes (int): Memory budget for resident interpreters (0 = unlimited)
+        pinned (iterable): Model names that are never evicted
+        measure (callable): measure(interpreter) -> bytes it keeps resident
+        cache_name (str): `cache` label of this registry's metrics
+    """
+
+    def __init__(self, resolve: Callable[[str, bool], ModelSource], load: Callable[[str], object],
+                 warm: Optional[Callable[[ModelVersion], None]] = None, budget_bytes: int = 0,
+                 pinned: Iterable[str] = (), measure: Callable[[object], int] = interpreter_footprint,
+                 cache_name: str = "model"):
+        self._resolve = resolve
+        self._load = load
+        self._warm = warm
+        self.budget_bytes = budget_bytes
+        self.pinned = frozenset(pinned)
+        self._measure = measure
+        self.cache_name = cache_name
+        # Resident versions, least recently used first
+        self._models: "OrderedDict[str, ModelVersion]" = OrderedDict()
+        # Serving (source, sha256) of every model seen, resident or evicted
+        self._known: Dict[str, Tuple[ModelSource, str]] = {}
+        # One loader at a time per model; readers never take these
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+        self._reloading = set()
+        MODEL_BUDGET_BYTES.labels(cache_name).set(budget_bytes)
+        MODEL_RESIDENT_BYTES.set_function(self.resident_bytes, cache_name)
+
+    def _load_lock(self, name: str) -> threading.Lock:
+        with self._guard:
+            return self._load_locks.setdefault(name, threading.Lock())
+
+    @staticmethod
+    def _checksum(name: str, source: ModelSource) -> str:
+        sha256 = file_sha256(source.path)
+        if source.sha256 and sha256 != source.sha256:
+            raise ValueError(f"{name}: {source.filename} has sha256 {sha256[:12]}, "
+                             f"manifest expects {source.sha256[:12]}")
+        return sha256
+
+    def _build(self, name: str, source: ModelSource, sha256: str) -> ModelVersion:
+        start = time.perf_counter()
+        interpreter = self._load(source.path)
+        model = ModelVersion(name, source, sha256, interpreter, self._measure(interpreter))
+        if self._warm is not None:
+            self._warm(model)
+        MODEL_LOAD_SECONDS.labels(self.cache_name, name).observe(time.perf_counter() - start)
+        return model
+
+    def _publish(self, model: ModelVersion, source: ModelSource):
+        with self._guard:
+            previous = self._known.get(model.name)
+            # One dict assignment: readers see either the old or the new version
+            self._models[model.name] = model
+            self._models.move_to_end(model.name)
+            self._known[model.name] = (source, model.sha256)
+            evicted = self._evict_for(model.name)
+        if previous is not None and previous[1] != model.sha256:
+            MODEL_VERSION_INFO.labels(self.cache_name, model.name, previous[1][:12]).set(0)
+        MODEL_VERSION_INFO.labels(self.cache_name, model.name, model.version).set(1)
+        for victim in evicted:
+            MODEL_EVICTIONS.labels(self.cache_name, victim.name).inc()
+            logger.info("Evicted model %s (%d bytes) to stay within the %d byte budget",
+                        victim.name, victim.size_bytes, self.budget_bytes)
+
+    def _evict_for(self, keep: str) -> list:
+        # Caller holds self._guard
+        if not self.budget_bytes:
+            return []
+        evicted = []
+        resident = sum(m.size_bytes for m in self._models.values())
+        for name in list(self._models):
+            if resident <= self.budget_bytes:
+                break
+            if name == keep or name in self.pinned:
+                continue
+            victim = self._models.pop(name)
+            resident -= victim.size_bytes
+            evicted.append(victim)
+        if resident > self.budget_bytes:
+            logger.warning("Resident models need %d bytes, over the %d byte budget "
+                           "(pinned or larger than the budget)", resident, self.budget_bytes)
+        return evicted
+
+    def get(self, name: str) -> ModelVersion:
+        """
+        Serving version of `name`, loading it on first use or after an eviction
+
+        Raises:
+            ValueError: If the model file does not match its expected checksum
+        """
+        model = self._models.get(name)
+        if model is not None:
+            CACHE_REQUESTS.labels(self.cache_name, "hit").inc()
+            if self.budget_bytes:
+                with self._guard:
+                    if name in self._models:
+                        self._models.move_to_end(name)
+            return model
+        with self._load_lock(name):
+            model = self._models.get(name)
+            if model is not None:
+                CACHE_REQUESTS.labels(self.cache_name, "hit").inc()
+                return model
+            CACHE_REQUESTS.labels(self.cache_name, "miss").inc()
+            known = self._known.get(name)
+            if known is not None:
+                # Evicted: reload the version that was serving, not whatever resolves now,
+                # and only if the file on disk still is that version
+                source, sha256 = known
+                on_disk = file_sha256(source.path)
+                if on_disk != sha256:
+                    raise ValueError(f"{name}: {source.filename} changed on disk since it was evicted "
+                                     f"(sha256 {on_disk[:12]}, serving version {sha256[:12]})")
+            else:
+                source = self._resolve(name, False)
+                sha256 = self._checksum(name, source)
+            model = self._build(name, source, sha256)
+            self._publish(model, source)
+            logger.info("Loaded model %s version %s", name, model.version)
+        return model
+
+    def loaded(self, name: str) -> bool:
+        """True if `name` is resident"""
+        return name in self._models
+
+    def resident_bytes(self) -> int:
+        return sum(m.size_bytes for m in list(self._models.values()))
+
+    def snapshot(self, names: Iterable[str]) -> Dict[str, ModelVersion]:
+        """Pin the current version of each model for the duration of one request"""
+        return {name: self.get(name) for name in names}
+
+    def reload(self, name: str, force: bool = False) -> Optional[ModelVersion]:
+        """
+        Load and warm the newest version of `name`, then swap it in
+
+        Runs in the caller's thread; requests keep being served by the current
+        version until the swap, and those already running finish on it. If
+        loading or warming fails the current version stays in place. A model
+        that is not resident only has its source updated, to be loaded on
+        its next use.
+
+        Args:
+            name (str): Model name
+            force (bool): Reload even if the resolved file is the version
+                already serving
+
+        Returns:
+            ModelVersion: The version serving after the reload (None if the
+            model is not resident)
+
+        Raises:
+            Exception: Whatever resolving, verifying or loading raised
+        """
+        with self._load_lock(name):
+            with self._guard:
+                self._reloading.add(name)
+            try:
+                source = self._resolve(name, True)
+                known = self._known.get(name)
+                current = self._models.get(name)
+                sha256 = self._checksum(name, source)
+                if not force and known is not None and sha256 == known[1]:
+                    MODEL_RELOADS.labels(self.cache_name, name, "unchanged").inc()
+                    return current
+                if current is None and known is not None:
+                    with self._guard:
+                        self._known[name] = (source, sha256)
+                    MODEL_RELOADS.labels(self.cache_name, name, "deferred").inc()
+                    MODEL_VERSION_INFO.labels(self.cache_name, name, known[1][:12]).set(0)
+                    MODEL_VERSION_INFO.labels(self.cache_name, name, sha256[:12]).set(1)
+                    return None
+                start = time.perf_counter()
+                model = self._build(name, source, sha256)
+                self._publish(model, source)
+            except Exception:
+                MODEL_RELOADS.labels(self.cache_name, name, "failed").inc()
+                raise
+            finally:
+                with self._guard:
+                    self._reloading.discard(name)
+        MODEL_RELOADS.labels(self.cache_name, name, "swapped").inc()
+        logger.info("Swapped model %s: %s -> %s (loaded and warmed in %.2fs)", name,
+                    current.version if current else None, model.version, time.perf_counter() - start)
+        return model
+
+    def refresh(self, names: Iterable[str]):
+        """reload() every model in `names` seen so far, logging rather than raising failures"""
+        for name in names:
+            if name not in self._known:
+                continue
+            try:
+                self.reload(name)
+            except Exception as e:
+                logger.error("Model %s reload failed, keeping the current version: %s", name, e)
+
+    def version(self, name: str) -> Optional[str]:
+        """Serving version of `name`, resident or not (None if never loaded)"""
+        known = self._known.get(name)
+        return known[1][:12] if known else None
+
+    def describe(self) -> Dict[str, dict]:
+        with self._guard:
+            known = dict(self._known)
+            models = dict(self._models)
+            reloading = set(self._reloading)
+        described = {}
+        for name, (source, sha256) in known.items():
+            model = models.get(name)
+            info = model.describe() if model else {"model": name, "version": sha256[:12],
+                                                   "file": source.filename, "sha256": sha256}
+            described[name] = {**info, "resident": model is not None, "pinned": name in self.pinned,
+                               "reloading": name in reloading}
+        return described
+
+
+class ManifestPoller:
+    """Background thread calling registry.refresh() every `interval` seconds"""
+
+    def __init__(self, registry: ModelRegistry, names: Callable[[], Iterable[str]], interval: float):
+        self.registry = registry
+        self.names = names
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="model-manifest-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.registry.refresh(self.names())
+
+
+def read_manifest(path: str) -> dict:
+    """A manifest.json as written by `python -m utils.fix_models convert`"""
+    with open(path) as f:
+        manifest = json.load(f)
+    if "models" not in manifest:
+        raise ValueError(f"{path} is not a model manifest")
+    return manifest
@@ -0,0 +1,376 @@
+"""
+Process-Pool Inference
+Runs the TFLite models in worker processes, each holding its own interpreters.
+Input tensors and model outputs pass through a ring of shared-memory slots
+instead of being pickled; only slot numbers and small layouts cross the pipes.
+"""
+
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import connection, shared_memory
+from typing import Callable, Dict, Iterable, Optional
+
+import numpy as np
+
+from .interpreter import interpreter_class
+from .metrics import POOL_THREADS, INFERENCE_WORKER_RESTARTS, observe_stage, server_timings_var
+
+logger = logging.getLogger("ml_service")
+
+INPUT_SHAPE = (1, 224, 224, 3)
+INPUT_BYTES = int(np.prod(INPUT_SHAPE)) * np.dtype(np.float32).itemsize
+# Room in each slot for every model's (small) outputs
+OUTPUT_BYTES = 16 * 1024
+SLOT_BYTES = INPUT_BYTES + OUTPUT_BYTES
+
+
+class WorkerModel:
+    """A model as loaded by every worker process; stands in for a registry ModelVersion"""
+
+    def __init__(self, name: str, path: str, sha256: str):
+        self.name = name
+        self.path = path
+        self.sha256 = sha256
+        self.version = sha256[:12]
+
+
+class WorkerCrashed(RuntimeError):
+    """The worker process running a task died or was restarted before answering"""
+
+
+class BackendBusy(RuntimeError):
+    """Every shared-memory slot stayed in use for longer than the slot timeout"""
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        # Older versions register the segment with the resource tracker; spawned
+        # workers share the parent's tracker, which already tracks it
+        return shared_memory.SharedMemory(name=name)
+
+
+def _load_models(specs: dict) -> dict:
+    models = {}
+    for name, spec in specs.items():
+        interpreter = interpreter_class(spec.get("runtime", "auto"))(model_path=spec["path"])
+        interpreter.allocate_tensors()
+        runner = interpreter.get_signature_runner() if spec.get("signature") else None
+        models[name] = (interpreter, runner)
+    return models
+
+
+def _invoke(model, img) -> dict:
+    interpreter, runner = model
+    if runner is not None:
+        return runner(image=img)
+    interpreter.set_tensor(interpreter.get_input_details()[0]["index"], img)
+    interpreter.invoke()
+    return {None: interpreter.get_tensor(interpreter.get_output_details()[0]["index"])}
+
+
+def _worker_main(conn, shm_name: str, specs: dict):
+    """
+    Worker process loop: load the interpreters, then answer (task id, slot,
+    model names) messages until told to stop (None) or the pipe closes
+    """
+    shm = _attach(shm_name)
+    models = _load_models(specs)
+    conn.send(("ready", os.getpid()))
+    try:
+        while True:
+            try:
+                task = conn.recv()
+            except EOFError:
+                break
+            if task is None:
+                break
+            task_id, slot, names = task
+            base = slot * SLOT_BYTES
+            try:
+                img = np.ndarray(INPUT_SHAPE, np.float32, buffer=shm.buf, offset=base)
+                layout, seconds = {}, {}
+                offset, end = base + INPUT_BYTES, base + SLOT_BYTES
+                for name in names:
+                    start = time.perf_counter()
+                    outputs = _invoke(models[name], img)
+                    seconds[name] = time.perf_counter() - start
+                    for key, output in outputs.items():
+                        output = np.ascontiguousarray(output, dtype=np.float32)
+                        if offset + output.nbytes > end:
+                            raise ValueError(f"{name} outputs do not fit in a {OUTPUT_BYTES} byte slot")
+                        np.ndarray(output.shape, np.float32, buffer=shm.buf, offset=offset)[...] = output
+                        layout[key if key is not None else name] = (offset, output.shape)
+                        offset += output.nbytes
+                del img
+                conn.send((task_id, layout, seconds, None))
+            except Exception as e:
+                conn.send((task_id, None, None, f"{type(e).__name__}: {e}"))
+    finally:
+        try:
+            shm.close()
+        except BufferError:  # a view from a failed task is still alive; the OS frees it at exit
+            pass
+
+
+class _Task:
+    __slots__ = ("future", "slot", "names", "postprocess", "timings", "submitted_at")
+
+    def __init__(self, future, slot, names, postprocess, timings):
+        self.future = future
+        self.slot = slot
+        self.names = names
+        self.postprocess = postprocess
+        self.timings = timings
+        self.submitted_at = time.monotonic()
+
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.ready = False
+        self.pending: Dict[int, _Task] = {}
+        self.send_lock = threading.Lock()
+        # Set once the process is gone: when to start its replacement
+        self.restart_at: Optional[float] = None
+
+
+class ProcessInferenceBackend:
+    """
+    Pool of inference worker processes fed through shared memory
+
+    submit() copies the (1, 224, 224, 3) input into a free slot of one shared
+    segment and sends the slot number to the least busy worker; the worker
+    writes the outputs back into the same slot. A monitor thread reads the
+    answers, resolves the futures and replaces workers that exit or sit on a
+    task for longer than `task_timeout` (their tasks fail with WorkerCrashed).
+
+    Args:
+        specs (dict): {model name: {"path": model file, "signature": bool,
+            "runtime": TFLite runtime}}; "signature" models run through their
+            signature runner and answer one output per signature key (the
+            merged model)
+        workers (int): Worker processes
+        slots (int): Shared-memory slots, i.e. inputs in flight at once
+        slot_timeout (float): Seconds submit() waits for a free slot
+        task_timeout (float): Seconds after which a silent worker is
+            considered hung and restarted
+        health_interval (float): Seconds between liveness checks
+
+    A worker that dies before it is ready (e.g. a model that fails to load)
+    is restarted with exponential backoff, up to 30 s, instead of in a loop.
+    """
+
+    def __init__(self, specs: dict, workers: int, slots: int, slot_timeout: float = 5.0,
+                 task_timeout: float = 30.0, health_interval: float = 1.0):
+        self.specs = specs
+        self.slot_timeout = slot_timeout
+        self.task_timeout = task_timeout
+        self.health_interval = health_interval
+        self._ctx = multiprocessing.get_context("spawn")
+        self._shm = shared_memory.SharedMemory(create=True, size=slots * SLOT_BYTES)
+        self._free = queue.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._failed_starts = 0
+        self._wakeup_r, self._wakeup_w = self._ctx.Pipe(duplex=False)
+        self._workers = [self._start_worker() for _ in range(workers)]
+        self._monitor = threading.Thread(target=self._run_monitor, name="inference-monitor", daemon=True)
+        self._monitor.start()
+        POOL_THREADS.labels("inference_process", "size").set(workers)
+        POOL_THREADS.set_function(lambda: slots - self._free.qsize(), "inference_slots", "busy")
+
+    def _start_worker(self) -> _Worker:
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=_worker_main, args=(child_conn, self._shm.name, self.specs),
+                                    name="inference-worker", daemon=True)
+        process.start()
+        child_conn.close()
+        return _Worker(process, parent_conn)
+
+    def submit(self, img, names: Iterable[str], postprocess: Optional[Callable[[dict], object]] = None) -> Future:
+        """
+        Run models on one input in a worker process
+
+        Args:
+            img: float32 input of shape (1, 224, 224, 3)
+            names (iterable): Models (keys of specs) to run
+            postprocess (callable): Applied to {output name: array} on the
+                monitor thread; the future resolves to its result
+
+        Returns:
+            Future: Resolves to the (postprocessed) outputs; fails with
+            BackendBusy, WorkerCrashed, RuntimeError (model error) or the
+            error copying `img` into its slot (e.g. a wrong shape)
+        """
+        future = Future()
+        try:
+            slot = self._free.get(timeout=self.slot_timeout)
+        except queue.Empty:
+            future.set_exception(BackendBusy(f"No free inference slot after {self.slot_timeout}s"))
+            return future
+        try:
+            np.ndarray(INPUT_SHAPE, np.float32, buffer=self._shm.buf, offset=slot * SLOT_BYTES)[...] = img
+        except Exception as e:
+            # e.g. a wrong shape or dtype: the slot was never handed to a worker
+            self._free.put(slot)
+            future.set_exception(e)
+            return future
+        task = _Task(future, slot, tuple(names), postprocess, server_timings_var.get())
+        task_id = next(self._ids)
+        with self._lock:
+            running = [w for w in self._workers if w.restart_at is None]
+            worker = min(running, key=lambda w: (not w.ready, len(w.pending))) if running else None
+            if worker is not None:
+                worker.pending[task_id] = task
+        if worker is None:
+            self._free.put(slot)
+            future.set_exception(WorkerCrashed("No inference worker is running"))
+            return future
+        try:
+            with worker.send_lock:
+                worker.conn.send((task_id, slot, task.names))
+        except (OSError, ValueError):
+            # The monitor fails the task when it replaces the dead worker
+            pass
+        except Exception as e:
+            # Not sent (the worker is fine): nothing else will free the slot
+            with self._lock:
+                unsent = worker.pending.pop(task_id, None)
+            if unsent is not None:
+                self._free.put(slot)
+                future.set_exception(e)
+        return future
+
+    def _run_monitor(self):
+        last_check = time.monotonic()
+        while not self._closed:
+            with self._lock:
+                conns = {w.conn: w for w in self._workers if w.restart_at is None}
+            for conn in connection.wait(list(conns) + [self._wakeup_r], timeout=self.health_interval):
+                if conn is self._wakeup_r:
+                    continue
+                worker = conns[conn]
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    self._replace(worker, "crashed")
+                    continue
+                self._handle(worker, message)
+            if time.monotonic() - last_check >= self.health_interval:
+                last_check = time.monotonic()
+                self._check_health()
+
+    def _handle(self, worker: _Worker, message):
+        if message[0] == "ready":
+            worker.ready = True
+            self._failed_starts = 0
+            return
+        task_id, layout, seconds, error = message
+        with self._lock:
+            task = worker.pending.pop(task_id, None)
+        if task is None:
+            return
+        try:
+            if error is None:
+                outputs = {key: np.ndarray(shape, np.float32, buffer=self._shm.buf, offset=offset).copy()
+                           for key, (offset, shape) in layout.items()}
+        finally:
+            self._free.put(task.slot)
+        if task.future.cancelled():
+            return
+        try:
+            if error is not None:
+                task.future.set_exception(RuntimeError(error))
+                return
+            for name, elapsed in seconds.items():
+                observe_stage("inference", elapsed, model=name, timings=task.timings)
+            task.future.set_result(task.postprocess(outputs) if task.postprocess else outputs)
+        except Exception as e:
+            if not task.future.done():
+                task.future.set_exception(e)
+
+    def _check_health(self):
+        now = time.monotonic()
+        for worker in list(self._workers):
+            if worker.restart_at is not None:
+                if now >= worker.restart_at:
+                    self._restart(worker)
+            elif not worker.process.is_alive():
+                self._replace(worker, "crashed")
+            elif worker.pending and now - min(t.submitted_at for t in list(worker.pending.values())) > self.task_timeout:
+                self._replace(worker, "hung")
+
+    def _replace(self, worker: _Worker, reason: str):
+        """Stop a dead or hung worker, fail its tasks and schedule its replacement"""
+        if self._closed or worker.restart_at is not None:
+            return
+        if worker.process.is_alive():
+            worker.process.kill()
+        worker.process.join(timeout=5)
+        worker.conn.close()
+        if worker.ready:
+            delay = 0.0
+        else:
+            delay = min(30.0, 0.5 * 2 ** self._failed_starts)
+            self._failed_starts += 1
+        logger.error("Inference worker %s %s, restarting it in %.1fs", worker.process.pid, reason, delay)
+        INFERENCE_WORKER_RESTARTS.labels(reason).inc()
+        with self._lock:
+            worker.restart_at = time.monotonic() + delay
+            orphans = list(worker.pending.values())
+            worker.pending.clear()
+        for task in orphans:
+            self._free.put(task.slot)
+            if not task.future.done():
+                task.future.set_exception(WorkerCrashed(f"Inference worker {reason}"))
+        if not delay:
+            self._restart(worker)
+
+    def _restart(self, worker: _Worker):
+        replacement = self._start_worker()
+        with self._lock:
+            self._workers[self._workers.index(worker)] = replacement
+
+    def health(self) -> dict:
+        with self._lock:
+            workers = list(self._workers)
+        return {
+            "workers": len(workers),
+            "alive": sum(w.restart_at is None and w.process.is_alive() for w in workers),
+            "ready": sum(w.ready for w in workers),
+            "pending": sum(len(w.pending) for w in workers),
+        }
+
+    def close(self):
+        """Stop the workers (after their queued tasks) and free the shared memory"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup_w.send(None)
+        self._monitor.join(timeout=5)
+        for worker in self._workers:
+            try:
+                with worker.send_lock:
+                    worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        for worker in self._workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.kill()
+            if worker.restart_at is None:
+                worker.conn.close()
+        self._shm.close()
+        self._shm.unlink()
@@ -0,0 +1,114 @@
+"""
+Request Profiling
+Opt-in sampling profiler for a single request, producing folded stacks
+(flamegraph.pl / speedscope / inferno compatible)
+"""
+
+import contextvars
+import os
+import sys
+import threading
+from collections import Counter
+from functools import wraps
+from typing import Optional
+
+profile_session_var = contextvars.ContextVar("profile_session", default=None)
+
+
+def _fold(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class ProfileSession:
+    """
+    Samples the stacks of the threads working on one request
+
+    A background thread reads sys._current_frames() every `interval` seconds,
+    but only records threads registered with the session: the event loop
+    thread handling the request and any pool thread running its blocking work.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = 0
+        self._stacks = Counter()
+        self._thread_ids = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_thread(self, thread_id: int):
+        self._thread_ids.add(thread_id)
+
+    def remove_thread(self, thread_id: int):
+        self._thread_ids.discard(thread_id)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self._thread_ids):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self._stacks[_fold(frame)] += 1
+                    self.samples += 1
+
+    def folded(self) -> str:
+        """Collapsed stacks, one `frame;frame;frame count` line per unique stack"""
+        return "\n".join(f"{stack} {count}" for stack, count in self._stacks.most_common()) + "\n"
+
+
+def start_profile(interval: float = 0.005) -> ProfileSession:
+    """Start profiling the current request (the calling thread is registered)"""
+    session = ProfileSession(interval)
+    session.add_thread(threading.get_ident())
+    profile_session_var.set(session)
+    session.start()
+    return session
+
+
+def profiled_thread(fn):
+    """
+    Register the executing thread with the request's profile session, if any
+
+    Meant for functions handed to the thread pool; when profiling is off this
+    is a single context variable lookup.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        session = profile_session_var.get()
+        if session is None:
+            return fn(*args, **kwargs)
+        thread_id = threading.get_ident()
+        session.add_thread(thread_id)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            session.remove_thread(thread_id)
+    return wrapper
+
+
+def save_profile(session: ProfileSession, directory: str, request_id: str) -> str:
+    """
+    Write a finished session's folded stacks to `directory`
+
+    Returns:
+        str: File name of the stored profile
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = f"{request_id}.folded"
+    with open(os.path.join(directory, name), "w") as f:
+        f.write(session.folded())
+    return name
@@ -0,0 +1,135 @@
+"""
+Image Quality Gate
+Cheap blur / exposure / face-presence checks on the preprocessed model input,
+run before any model so unusable selfies are flagged in the result (or, with
+the opt-in "reject" mode, never reach inference)
+"""
+
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# ITU-R BT.601 luma weights, as used by OpenCV's RGB2GRAY
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+_cascades = threading.local()
+
+
+def _face_cascade():
+    # CascadeClassifier is not thread-safe, so each pool thread loads its own
+    cascade = getattr(_cascades, "face", None)
+    if cascade is None:
+        import cv2
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+        _cascades.face = cascade
+    return cascade
+
+
+def luminance(img) -> np.ndarray:
+    """Grey levels (0-255, float32) of a (1, H, W, 3) or (H, W, 3) input scaled to 0-1"""
+    return (img.reshape(img.shape[-3:]) @ _LUMA) * np.float32(255)
+
+
+def sharpness(gray: np.ndarray) -> float:
+    """Variance of the 4-neighbour Laplacian; low values mean a blurry image"""
+    lap = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+           - 4 * gray[1:-1, 1:-1])
+    return float(lap.var())
+
+
+def has_face(gray: np.ndarray, min_size: int = 48) -> bool:
+    faces = _face_cascade().detectMultiScale(
+        gray.astype(np.uint8), scaleFactor=1.1, minNeighbors=4, minSize=(min_size, min_size))
+    return len(faces) > 0
+
+
+class QualityReport:
+    """Outcome of QualityGate.check(): scores plus the reasons it failed, if any"""
+
+    def __init__(self, scores: Dict[str, float], reasons: List[str]):
+        self.scores = scores
+        self.reasons = reasons
+
+    @property
+    def passed(self) -> bool:
+        return not self.reasons
+
+    def as_dict(self) -> dict:
+        return {"passed": self.passed, "reasons": self.reasons, "scores": self.scores}
+
+
+class QualityGate:
+    """
+    Configurable pre-inference quality checks
+
+    All checks run on the 224x224 model input, so scores are comparable
+    whatever the upload's resolution and the whole gate costs a few
+    milliseconds (most of it in the optional face detector).
+
+    Args:
+        min_sharpness (float): Minimum Laplacian variance (0-255 grey levels)
+        min_brightness (float): Minimum mean grey level
+        max_brightness (float): Maximum mean grey level
+        max_clipped_fraction (float): Largest share of pixels allowed to be
+            crushed to black (< 16) or blown to white (> 239)
+        require_face (bool): Also require a frontal face (OpenCV Haar cascade)
+    """
+
+    def __init__(self, min_sharpness: float = 15.0, min_brightness: float = 40.0,
+                 max_brightness: float = 220.0, max_clipped_fraction: float = 0.5,
+                 require_face: bool = False):
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.max_clipped_fraction = max_clipped_fraction
+        self.require_face = require_face
+        if require_face:
+            import cv2
+            if not hasattr(cv2, "CascadeClassifier"):
+                raise RuntimeError("require_face needs OpenCV's Haar cascades (opencv-python 4.x)")
+
+    def check(self, img) -> QualityReport:
+        """
+        Score a preprocessed image
+
+        Args:
+            img: Model input, float32 in 0-1, shape (1, 224, 224, 3)
+
+        Returns:
+            QualityReport: Scores and failure reasons (blurry, too_dark,
+            too_bright, no_face)
+        """
+        gray = luminance(img)
+        histogram = np.bincount(np.clip(gray, 0, 255).astype(np.uint8).ravel(), minlength=256)
+        total = gray.size
+        scores = {
+            "sharpness": round(sharpness(gray), 1),
+            "brightness": round(float(gray.mean()), 1),
+            "dark_fraction": round(float(histogram[:16].sum()) / total, 3),
+            "bright_fraction": round(float(histogram[240:].sum()) / total, 3),
+        }
+
+        reasons = []
+        if scores["sharpness"] < self.min_sharpness:
+            reasons.append("blurry")
+        if scores["brightness"] < self.min_brightness or scores["dark_fraction"] > self.max_clipped_fraction:
+            reasons.append("too_dark")
+        if scores["brightness"] > self.max_brightness or scores["bright_fraction"] > self.max_clipped_fraction:
+            reasons.append("too_bright")
+        if self.require_face:
+            face = has_face(gray)
+            scores["face"] = face
+            if not face:
+                reasons.append("no_face")
+        return QualityReport(scores, reasons)
+
+
+def create_quality_gate(mode: str, **thresholds) -> Optional[QualityGate]:
+    """QualityGate for mode "reject" or "flag", None when the gate is "off" """
+    mode = (mode or "off").lower()
+    if mode == "off":
+        return None
+    if mode not in ("reject", "flag"):
+        raise ValueError(f"Unknown quality gate mode: {mode}")
+    return QualityGate(**thresholds)
@@ -0,0 +1,197 @@
+"""
+Routine Conflicts
+Finds incompatible products in a routine or a whole shelf in one vectorized
+pass: the knowledge base's conflict graph is compiled over canonical
+ingredient IDs, each product becomes a bitset of the IDs it contains, and
+every product pair is tested at once with bitwise ANDs
+"""
+
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from . import ingredient_knowledge_base as kb
+
+# Routine slots as a bitmask, so two products overlap when their slots AND to non-zero
+AM, PM = 1, 2
+SLOTS = {"am": AM, "morning": AM, "pm": PM, "evening": PM, "night": PM, "both": AM | PM}
+SLOT_NAMES = {AM: "am", PM: "pm", AM | PM: "both"}
+# best_time value -> slot where using the ingredient goes against it
+WRONG_SLOT = {"morning": PM, "evening": AM}
+
+
+class RoutineProduct:
+    """One product on a shelf or in a routine; `when` is None for a shelf (no slot given)"""
+
+    def __init__(self, name: str, ingredients: Sequence[str], when: Optional[str] = None):
+        self.name = name
+        self.ingredients = list(ingredients)
+        self.when = when
+
+
+def parse_products(body, max_products: int) -> List[RoutineProduct]:
+    """
+    Validate a {"products": [{"name", "ingredients", "when"}]} request body
+
+    Raises:
+        ValueError: With a message for the client
+    """
+    products = body.get("products") if isinstance(body, dict) else None
+    if not isinstance(products, list) or not products:
+        raise ValueError('Body must be {"products": [{"name": ..., "ingredients": [...]}, ...]}')
+    if len(products) > max_products:
+        raise ValueError(f"At most {max_products} products per check")
+    parsed = []
+    for i, product in enumerate(products):
+        if not isinstance(product, dict):
+            raise ValueError(f"products[{i}] must be an object")
+        ingredients = product.get("ingredients")
+        if not isinstance(ingredients, list) or not all(isinstance(ing, str) for ing in ingredients):
+            raise ValueError(f"products[{i}].ingredients must be a list of strings")
+        when = product.get("when")
+        if when is not None and str(when).lower() not in SLOTS:
+            raise ValueError(f"products[{i}].when must be one of {', '.join(SLOTS)}")
+        parsed.append(RoutineProduct(str(product.get("name") or f"product {i + 1}"), ingredients,
+                                     str(when).lower() if when is not None else None))
+    return parsed
+
+
+class ConflictGraph:
+    """
+    The ingredient conflict graph as bitsets over canonical IDs
+
+    Args:
+        edges (mapping): Canonical ID -> IDs it conflicts with (symmetric)
+        best_time (mapping): Canonical ID -> "morning", "evening" or "any"
+        ids_of (callable): ids_of(ingredient name) -> canonical IDs it stands for
+    """
+
+    def __init__(self, edges: Mapping[str, Iterable[str]], best_time: Mapping[str, str], ids_of):
+        names = set(edges) | {other for others in edges.values() for other in others} | set(best_time)
+        self.ids = sorted(names)
+        self.index = {name: i for i, name in enumerate(self.ids)}
+        self.words = max(1, (len(self.ids) + 63) // 64)
+        self.ids_of = ids_of
+        # Row i: bitset of the IDs that conflict with ID i
+        self.adjacency = np.zeros((len(self.ids), self.words), dtype=np.uint64)
+        for name, others in edges.items():
+            for other in others:
+                self._set(self.adjacency[self.index[name]], self.index[other])
+        # IDs best used in the morning / evening
+        self.best = {time: np.zeros(self.words, dtype=np.uint64) for time in WRONG_SLOT}
+        for name, time in best_time.items():
+            if time in self.best:
+                self._set(self.best[time], self.index[name])
+
+    @classmethod
+    def from_knowledge_base(cls) -> "ConflictGraph":
+        return cls(kb.CONFLICT_EDGES, kb.BEST_TIME, kb.ingredient_ids)
+
+    @staticmethod
+    def _set(bits: np.ndarray, i: int):
+        bits[i // 64] |= np.uint64(1 << (i % 64))
+
+    def _members(self, bits: np.ndarray) -> List[int]:
+        members = []
+        for word, value in enumerate(bits.tolist()):
+            while value:
+                low = value & -value
+                members.append(word * 64 + low.bit_length() - 1)
+                value ^= low
+        return members
+
+    def encode(self, products: Sequence[RoutineProduct]) -> Tuple[np.ndarray, List[Dict[int, str]]]:
+        """
+        Bitset of each product's canonical IDs
+
+        Returns:
+            tuple: (n, words) uint64 bitsets, and per product {ID index: the
+            ingredient name as the product listed it}. Ingredients that take
+            part in no conflict and have no best time set no bit.
+        """
+        bits = np.zeros((len(products), self.words), dtype=np.uint64)
+        sources = []
+        for row, product in zip(bits, products):
+            source = {}
+            for ingredient in product.ingredients:
+                for name in self.ids_of(ingredient):
+                    i = self.index.get(name)
+                    if i is not None and i not in source:
+                        self._set(row, i)
+                        source[i] = ingredient
+            sources.append(source)
+        return bits, sources
+
+    def _pairs(self, first: np.ndarray, second: np.ndarray, sources: Tuple[Dict[int, str], Dict[int, str]]):
+        """Ingredient pairs behind a flagged product pair (only run on flagged pairs)"""
+        pairs = []
+        for i in self._members(first):
+            for j in self._members(self.adjacency[i] & second):
+                pair = (sources[0][i], sources[1][j])
+                if pair not in pairs and pair[::-1] not in pairs:
+                    pairs.append(pair)
+        return pairs
+
+    def _suggestion(self, pairs) -> str:
+        for first, second in pairs:
+            times = (kb.get_optimal_usage_time(first), kb.get_optimal_usage_time(second))
+            if set(times) == {"morning", "evening"}:
+                morning, evening = (first, second) if times[0] == "morning" else (second, first)
+                return f"Use {morning} in the morning and {evening} in the evening"
+        return "Use them on alternate days, or in separate routines"
+
+    def check(self, products: Sequence[RoutineProduct]) -> dict:
+        """
+        Every conflict in a routine or shelf
+
+        Products without a slot (a shelf) count as used together with
+        everything else. Product pairs whose ingredients conflict are
+        reported under "conflicts" when their slots overlap and under
+        "separated" when the routine already keeps them apart; "timing"
+        lists ingredients used in the slot their best time argues against.
+
+        Args:
+            products (list): RoutineProduct entries
+
+        Returns:
+            dict: conflicts, within_product, separated and timing findings
+        """
+        bits, sources = self.encode(products)
+        slots = np.array([SLOTS[p.when] if p.when else AM | PM for p in products], dtype=np.uint8)
+
+        # Neighbours of each product: OR of the adjacency rows of its IDs
+        members = np.unpackbits(bits.astype("<u8").view(np.uint8), axis=1,
+                                bitorder="little")[:, :len(self.ids)].astype(bool)
+        neighbours = np.bitwise_or.reduce(np.where(members[:, :, None], self.adjacency[None], np.uint64(0)),
+                                          axis=1) if len(self.ids) else np.zeros_like(bits)
+        # All pairs at once: product i conflicts with j when i's neighbours meet j's IDs
+        conflicting = ((neighbours[:, None, :] & bits[None, :, :]) != 0).any(axis=2)
+        together = (slots[:, None] & slots[None, :]) != 0
+
+        report = {"checked": len(products), "conflicts": [], "within_product": [], "separated": [], "timing": []}
+        for i, j in zip(*np.nonzero(np.triu(conflicting))):
+            i, j = int(i), int(j)
+            pairs = self._pairs(bits[i], bits[j], (sources[i], sources[j]))
+            if i == j:
+                report["within_product"].append({"product": products[i].name, "ingredients": pairs})
+                continue
+            finding = {"products": [products[i].name, products[j].name], "ingredients": pairs}
+            if together[i, j]:
+                shared = int(slots[i] & slots[j])
+                if products[i].when or products[j].when:
+                    finding["when"] = SLOT_NAMES[shared]
+                finding["suggestion"] = self._suggestion(pairs)
+                report["conflicts"].append(finding)
+            else:
+                report["separated"].append(finding)
+
+        # Timing: IDs best used in one slot, in products used (explicitly) in the other
+        explicit = np.array([p.when is not None for p in products], dtype=bool)
+        for time, wrong in WRONG_SLOT.items():
+            misplaced = ((bits & self.best[time]) != 0).any(axis=1) & ((slots & wrong) != 0) & explicit
+            for i in np.nonzero(misplaced)[0]:
+                i = int(i)
+                for index in self._members(bits[i] & self.best[time]):
+                    report["timing"].append({"product": products[i].name, "ingredient": sources[i][index],
+                                             "when": SLOT_NAMES[wrong], "best_time": time})
+        return report
@@ -0,0 +1,46 @@
+"""
+Response Serialization
+Single-pass orjson encoding for API responses (numpy, ObjectId and datetime included)
+"""
+
+import numpy as np
+import orjson
+from fastapi.responses import JSONResponse
+
+try:
+    from bson import ObjectId
+except ImportError:  # SQLite-only deployments may not install pymongo
+    ObjectId = None
+
+# numpy scalars/arrays and datetimes are encoded natively by orjson
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    if ObjectId is not None and isinstance(obj, ObjectId):
+        return str(obj)
+    # Arrays orjson can't take natively (non-contiguous, object dtype, ...)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content) -> bytes:
+    """Encode content to JSON bytes in one pass"""
+    return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with orjson
+
+    Return an instance directly from an endpoint so FastAPI skips its own
+    jsonable_encoder pass over the content.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,121 @@
+"""
+Shadow Evaluation
+Runs candidate models on a sample of real requests, off the request path,
+and records how often they agree with the production models
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable
+
+from .metrics import SHADOW_OUTCOMES, SHADOW_PREDICTIONS, SHADOW_SECONDS
+
+logger = logging.getLogger("ml_service")
+
+
+def _lower_priority():
+    # On Linux the nice value is per thread, so this only deprioritises the
+    # shadow worker, never the request or inference threads
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError):
+        pass
+
+
+class ShadowEvaluator:
+    """
+    Samples requests and replays their preprocessed input through candidate models
+
+    submit() only rolls the dice and queues work; the candidates run on a
+    small, lowest-priority thread pool after the production prediction is
+    done, and samples are dropped rather than queued once `max_pending` are
+    waiting. Nothing here can delay, fail or change a response.
+
+    Args:
+        run_candidate (callable): run_candidate(name, img) -> profile value
+            predicted by the candidate for model `name`
+        models (iterable): Model names that have a candidate
+        sample_rate (float): Fraction of requests to shadow (0-1)
+        max_pending (int): Samples allowed to wait for the shadow pool
+        threads (int): Shadow pool size
+    """
+
+    def __init__(self, run_candidate: Callable[[str, object], object], models: Iterable[str],
+                 sample_rate: float, max_pending: int = 16, threads: int = 1):
+        self.run_candidate = run_candidate
+        self.models = tuple(models)
+        self.sample_rate = sample_rate
+        self.max_pending = max_pending
+        self.threads = threads
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(self.threads, thread_name_prefix="shadow",
+                                                    initializer=_lower_priority)
+        return self._pool
+
+    def forget_pool(self):
+        """Drop the pool after a fork (its threads do not exist in the child)"""
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def submit(self, img, production: dict) -> bool:
+        """
+        Maybe shadow one request
+
+        Args:
+            img: The preprocessed input the production models ran on
+            production (dict): {model name: production value} for self.models
+
+        Returns:
+            bool: True if the sample was queued
+        """
+        if random.random() >= self.sample_rate:
+            return False
+        with self._lock:
+            if self._pending >= self.max_pending:
+                for name in self.models:
+                    SHADOW_OUTCOMES.labels(name, "dropped").inc()
+                return False
+            self._pending += 1
+        try:
+            self._executor().submit(self._evaluate, img, production)
+        except RuntimeError:  # pool shut down
+            with self._lock:
+                self._pending -= 1
+            return False
+        return True
+
+    def _evaluate(self, img, production: dict):
+        try:
+            for name in self.models:
+                if name not in production:
+                    continue
+                start = time.perf_counter()
+                try:
+                    candidate = self.run_candidate(name, img)
+                except Exception as e:
+                    SHADOW_OUTCOMES.labels(name, "error").inc()
+                    logger.warning("Shadow model %s failed: %s", name, e)
+                    continue
+                SHADOW_SECONDS.labels(name).observe(time.perf_counter() - start)
+                expected = production[name]
+                SHADOW_OUTCOMES.labels(name, "agree" if candidate == expected else "disagree").inc()
+                SHADOW_PREDICTIONS.labels(name, expected, candidate).inc()
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,309 @@
+"""
+Analysis Storage
+Pluggable persistence for analysis documents: MongoDB, an embedded SQLite file,
+or process memory (load tests and local development)
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+import weakref
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisStore:
+    """Interface shared by every storage backend"""
+
+    def insert_one(self, doc: Dict[str, Any]) -> str:
+        """
+        Store a single analysis document
+
+        Args:
+            doc (dict): Analysis document (must contain user_id and created_at)
+
+        Returns:
+            str: Id of the stored document
+        """
+        return self.insert_many([doc])[0]
+
+    def insert_many(self, docs: Iterable[Dict[str, Any]]) -> List[str]:
+        """
+        Store several analysis documents in one round trip
+
+        Args:
+            docs (iterable): Analysis documents
+
+        Returns:
+            list: Ids of the stored documents, in input order
+        """
+        raise NotImplementedError
+
+    def find_by_user(self, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Get a user's most recent analyses, newest first
+
+        Args:
+            user_id (str): Owner of the analyses
+            limit (int): Maximum number of documents to return
+
+        Returns:
+            list: Analysis documents with a string `_id`
+        """
+        raise NotImplementedError
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get one analysis by id
+
+        Args:
+            doc_id (str): Document id returned by insert_one/insert_many
+
+        Returns:
+            dict: Analysis document, or None if not found
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release connections held by the backend"""
+
+
+class MongoAnalysisStore(AnalysisStore):
+    """MongoDB backend; connects lazily so startup never waits on the database"""
+
+    def __init__(self, url: Optional[str], database: str, collection: str):
+        from pymongo import MongoClient
+
+        # connect=False defers pymongo's monitor threads to first use (fork-safe)
+        self.client = MongoClient(url, connect=False)
+        self.collection = self.client[database][collection]
+        self._indexed = False
+        self._index_lock = threading.Lock()
+
+    def _ensure_indexes(self):
+        if self._indexed:
+            return
+        with self._index_lock:
+            if not self._indexed:
+                self.collection.create_index([("user_id", 1), ("created_at", -1)])
+                self._indexed = True
+
+    def insert_many(self, docs: Iterable[Dict[str, Any]]) -> List[str]:
+        # Copy so pymongo does not add an ObjectId `_id` to the caller's dicts
+        docs = [dict(doc) for doc in docs]
+        if not docs:
+            return []
+        self._ensure_indexes()
+        result = self.collection.insert_many(docs, ordered=True)
+        return [str(i) for i in result.inserted_ids]
+
+    def find_by_user(self, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        self._ensure_indexes()
+        cursor = (self.collection.find({"user_id": user_id})
+                  .sort("created_at", -1)
+                  .limit(limit))
+        return [self._with_str_id(doc) for doc in cursor]
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        from bson import ObjectId
+
+        if not ObjectId.is_valid(doc_id):
+            return None
+        doc = self.collection.find_one({"_id": ObjectId(doc_id)})
+        return self._with_str_id(doc) if doc else None
+
+    @staticmethod
+    def _with_str_id(doc: Dict[str, Any]) -> Dict[str, Any]:
+        doc["_id"] = str(doc["_id"])
+        return doc
+
+    def close(self):
+        self.client.close()
+
+
+def _json_default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    # ObjectId, numpy scalars and anything else with a sensible str()/item()
+    if hasattr(obj, "item"):
+        return obj.item()
+    return str(obj)
+
+
+# Every live SQLite store; one at-fork hook resets them all, and stores that
+# are garbage collected drop out instead of being kept alive by the hook
+_sqlite_stores = weakref.WeakSet()
+
+
+def _forget_sqlite_connections():
+    for store in list(_sqlite_stores):
+        store._forget_connections()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_sqlite_connections)
+
+
+class SQLiteAnalysisStore(AnalysisStore):
+    """
+    Embedded SQLite backend in WAL mode
+
+    Documents are stored as JSON next to indexed user_id/created_at columns.
+    Each thread gets its own connection so WAL readers never block the writer.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+        # Connections must not cross a fork: children start with none
+        _sqlite_stores.add(self)
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS analysis (
+                id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                doc TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS analysis_user_created
+                ON analysis (user_id, created_at DESC);
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _forget_connections(self):
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def insert_many(self, docs: Iterable[Dict[str, Any]]) -> List[str]:
+        rows = []
+        for doc in docs:
+            doc_id = uuid.uuid4().hex
+            created_at = doc.get("created_at") or datetime.utcnow()
+            rows.append((
+                doc_id,
+                str(doc.get("user_id")),
+                created_at.isoformat() if isinstance(created_at, datetime) else str(created_at),
+                json.dumps({k: v for k, v in doc.items() if k != "_id"}, default=_json_default),
+            ))
+        if not rows:
+            return []
+
+        conn = self._conn()
+        with self._write_lock, conn:
+            conn.executemany(
+                "INSERT INTO analysis (id, user_id, created_at, doc) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+        return [row[0] for row in rows]
+
+    def find_by_user(self, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT id, doc FROM analysis WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
+            (str(user_id), limit),
+        ).fetchall()
+        return [self._decode(doc_id, doc) for doc_id, doc in rows]
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT id, doc FROM analysis WHERE id = ?", (doc_id,)
+        ).fetchone()
+        return self._decode(*row) if row else None
+
+    @staticmethod
+    def _decode(doc_id: str, raw: str) -> Dict[str, Any]:
+        doc = json.loads(raw)
+        if isinstance(doc.get("created_at"), str):
+            doc["created_at"] = datetime.fromisoformat(doc["created_at"])
+        return {"_id": doc_id, **doc}
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+class MemoryAnalysisStore(AnalysisStore):
+    """
+    In-process stand-in for MongoDB (nothing survives a restart)
+
+    Documents are kept per user in insertion order, which matches created_at
+    order for analyses stored by the service.
+    """
+
+    def __init__(self):
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._by_user: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+    def insert_many(self, docs: Iterable[Dict[str, Any]]) -> List[str]:
+        ids = []
+        with self._lock:
+            for doc in docs:
+                doc_id = uuid.uuid4().hex
+                self._docs[doc_id] = {k: v for k, v in doc.items() if k != "_id"}
+                self._by_user.setdefault(str(doc.get("user_id")), []).append(doc_id)
+                ids.append(doc_id)
+        return ids
+
+    def find_by_user(self, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            doc_ids = self._by_user.get(str(user_id), [])[-limit:]
+            return [{"_id": doc_id, **self._docs[doc_id]} for doc_id in reversed(doc_ids)]
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            doc = self._docs.get(doc_id)
+            return {"_id": doc_id, **doc} if doc is not None else None
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+
+def create_store(backend: str = "mongo", **options) -> AnalysisStore:
+    """
+    Build the configured storage backend
+
+    Args:
+        backend (str): "mongo", "sqlite" or "memory"
+        **options: mongo_url/mongo_db/mongo_collection or sqlite_path
+
+    Returns:
+        AnalysisStore: Ready-to-use store
+    """
+    backend = (backend or "mongo").lower()
+    if backend == "mongo":
+        return MongoAnalysisStore(
+            options.get("mongo_url"),
+            options.get("mongo_db", "test"),
+            options.get("mongo_collection", "analysis"),
+        )
+    if backend == "sqlite":
+        return SQLiteAnalysisStore(options.get("sqlite_path", "analysis.db"))
+    if backend == "memory":
+        return MemoryAnalysisStore()
+    raise ValueError(f"Unknown storage backend: {backend}")
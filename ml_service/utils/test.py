@@ -239,48 +239,244 @@
 #     "preferences": ["fragrance-free"]
 # }
 import os
+import time
+import atexit
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Optional
 import numpy as np
-import pandas as pd
-import tensorflow.lite as tflite  # TFLITE INSTEAD OF TENSORFLOW
-from tensorflow.keras.utils import load_img, img_to_array
-from huggingface_hub import hf_hub_download
+from PIL import Image
 from functools import lru_cache
 from dotenv import load_dotenv
+from .metrics import stage_timer, POOL_THREADS
+from .model_registry import ModelRegistry, ModelSource, ManifestPoller, ReloadUnsupported, read_manifest, file_sha256
+from .process_inference import ProcessInferenceBackend, WorkerModel, BackendBusy
+from .shadow import ShadowEvaluator
+from .interpreter import interpreter_class, resolve_runtime
+from .profiling import profiled_thread
 
 # Load environment variables
 load_dotenv(dotenv_path="ml_service/.env")
 
 HF_REPO = "ramsha01/skin-analyzer-model"   # your HF repo
 
+# Metric label -> TFLite file for the four skin models
+MODEL_FILES = {
+    "wrinkle": "wrinkle.tflite",
+    "acne": "acne_model.tflite",
+    "pigmentation": "pigmentation.tflite",
+    "skintone": "skintone.tflite",
+}
+
+# Optional single model with all four heads (built by `python -m utils.fix_models
+# merge`); when set, one invoke per image replaces the four above
+MERGED_MODEL_FILE = os.getenv("MERGED_MODEL_FILE", "")
+MERGED = "merged"
+
+# Optional manifest.json (written by `python -m utils.fix_models convert`) naming
+# the file and sha256 of each model: a local path, or a file in HF_REPO
+MODEL_MANIFEST = os.getenv("MODEL_MANIFEST", "")
+
+# Memory budget for resident interpreters (0 = keep every model loaded); the
+# least recently used unpinned models are evicted and reloaded on demand
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))
+MODEL_PINNED = [name.strip() for name in os.getenv("MODEL_PINNED", "").split(",") if name.strip()]
+
+# TFLite interpreter package: "auto" prefers the standalone runtimes
+# (requirements-runtime.txt) and falls back to full TensorFlow
+TFLITE_RUNTIME = os.getenv("TFLITE_RUNTIME", "auto")
+
 
 # --------------------------------------------------------
 # 1. TFLite lazy loader
 # --------------------------------------------------------
-@lru_cache(maxsize=None)
-def load_tflite_model(filename: str):
-    """
-    Downloads the TFLite model from HuggingFace and loads it ONCE.
-    Works on Render Free Tier (low RAM).
-    """
-    model_path = hf_hub_download(
+def download_model_file(filename: str) -> str:
+    """Downloads a model from HuggingFace (or checks the local copy is current) and returns its path."""
+    from huggingface_hub import hf_hub_download
+
+    return hf_hub_download(
         repo_id=HF_REPO,
         filename=filename,
         token=None  # must be public repo
     )
 
-    interpreter = tflite.Interpreter(model_path=model_path)
+
+@lru_cache(maxsize=None)
+def fetch_model_file(filename: str) -> str:
+    """download_model_file(), once per process."""
+    return download_model_file(filename)
+
+
+def tflite_runtime() -> str:
+    """TFLite package the interpreters come from (imports it on first call)"""
+    return resolve_runtime(TFLITE_RUNTIME)
+
+
+def load_interpreter(path: str):
+    """
+    Loads a TFLite model file.
+    Works on Render Free Tier (low RAM).
+    """
+    # model_path makes TFLite mmap the flatbuffer, so weights live in the page
+    # cache and are shared by every worker process serving the same file
+    interpreter = interpreter_class(TFLITE_RUNTIME)(model_path=path)
     interpreter.allocate_tensors()
 
     return interpreter
 
 
+def active_model_files() -> dict:
+    """The model files the service actually runs: the merged model or the four singles"""
+    return {MERGED: MERGED_MODEL_FILE} if MERGED_MODEL_FILE else MODEL_FILES
+
+
+_manifest = None
+
+
+def load_model_manifest(refresh: bool = False) -> Optional[dict]:
+    """MODEL_MANIFEST, read once; refresh=True re-reads (re-downloads) it"""
+    global _manifest
+    if not MODEL_MANIFEST:
+        return None
+    if _manifest is None or refresh:
+        local = os.path.exists(MODEL_MANIFEST)
+        if local:
+            path = MODEL_MANIFEST
+        else:
+            path = download_model_file(MODEL_MANIFEST) if refresh else fetch_model_file(MODEL_MANIFEST)
+        manifest = read_manifest(path)
+        # Files of a local manifest sit next to it; the rest come from HF_REPO
+        manifest["local_dir"] = os.path.dirname(os.path.abspath(path)) if local else None
+        _manifest = manifest
+    return _manifest
+
+
+def resolve_model(name: str, refresh: bool = False) -> ModelSource:
+    """
+    The file to load for model `name`
+
+    With MODEL_MANIFEST set, the manifest entry for the model decides the
+    file and its expected sha256 (entries are keyed by file stem, e.g.
+    "acne_model"); otherwise the file is the one in active_model_files().
+
+    Args:
+        name (str): One of MODEL_FILES (or MERGED)
+        refresh (bool): Re-read the manifest and re-check the hub for a newer file
+    """
+    fetch = download_model_file if refresh else fetch_model_file
+    filename = active_model_files()[name]
+    manifest = load_model_manifest(refresh)
+    entry = manifest["models"].get(os.path.splitext(filename)[0]) if manifest else None
+    if entry is None:
+        return ModelSource(filename, fetch(filename))
+    if manifest["local_dir"]:
+        path = os.path.join(manifest["local_dir"], entry["tflite"])
+    else:
+        path = fetch(entry["tflite"])
+    return ModelSource(entry["tflite"], path, entry.get("tflite_sha256"))
+
+
+def warm_model(model):
+    """One inference on a new version before it serves, so its first request is not cold"""
+    dummy = np.zeros((1, 224, 224, 3), dtype=np.float32)
+    if model.name == MERGED:
+        run_merged(dummy, model)
+    else:
+        with model.lock:
+            run_tflite(model.interpreter, dummy)
+
+
+model_registry = ModelRegistry(resolve_model, load_interpreter, warm_model,
+                               budget_bytes=int(MODEL_MEMORY_BUDGET_MB * 1024 * 1024), pinned=MODEL_PINNED)
+
+
+def get_model(name: str):
+    """Serving ModelVersion of one of MODEL_FILES (or MERGED), loaded on demand"""
+    return model_registry.get(name)
+
+
+def model_snapshot() -> dict:
+    """{name: ModelVersion} of every active model, pinned for one request"""
+    if INFERENCE_BACKEND == "process":
+        return process_backend_models()
+    return {name: get_model(name) for name in active_model_files()}
+
+
+def model_versions(models: dict) -> dict:
+    """{name: version} of a model_snapshot(), as stored with each analysis"""
+    return {name: model.version for name, model in models.items()}
+
+
+def reload_model(name: str, force: bool = False):
+    """
+    Load and warm the newest version of one active model, then swap it in
+
+    Raises:
+        KeyError: If `name` is not an active model
+        ReloadUnsupported: With INFERENCE_BACKEND=process
+    """
+    if name not in active_model_files():
+        raise KeyError(name)
+    if INFERENCE_BACKEND == "process":
+        raise ReloadUnsupported("Hot reload needs INFERENCE_BACKEND=thread; restart to load new models")
+    return model_registry.reload(name, force=force)
+
+
+def start_manifest_poller(interval: float) -> ManifestPoller:
+    """Reload models whose file changed, every `interval` seconds (per worker process)"""
+    poller = ManifestPoller(model_registry, active_model_files, interval)
+    poller.start()
+    return poller
+
+
+def prefetch_models():
+    """Download every model file without creating interpreters (safe before fork)."""
+    return {name: fetch_model_file(filename) for name, filename in active_model_files().items()}
+
+
+def warm_models():
+    """Create each interpreter and run one inference so the first request is not cold."""
+    model_snapshot()
+
+
 # --------------------------------------------------------
 # 2. Preprocess image
 # --------------------------------------------------------
+TARGET_SIZE = (224, 224)
+
+
+def decode_image(img_path):
+    """
+    Decode an image at the smallest size that still covers TARGET_SIZE
+
+    For JPEGs, draft() lets libjpeg scale by 1/2, 1/4 or 1/8 while decoding,
+    picking the largest reduction that keeps both sides >= 224 px, so a
+    12 MP selfie is decoded at ~1/64 of the pixels. Other formats (PNG, WebP)
+    ignore the draft request and are decoded at full size.
+
+    Raises:
+        OSError: If the data is not a readable image
+    """
+    img = Image.open(img_path)
+    img.draft("RGB", TARGET_SIZE)
+    return img.convert("RGB")
+
+
 def preprocess_image(img_path):
-    img = load_img(img_path, target_size=(224, 224))
-    img = img_to_array(img) / 255.0
-    return np.expand_dims(img, axis=0).astype(np.float32)
+    with stage_timer("decode"):
+        img = decode_image(img_path)
+
+    with stage_timer("preprocess"):
+        # Same nearest-neighbour resize as keras load_img(target_size=...), then
+        # uint8 -> float32 scaling in one vectorised pass with no float64 copy
+        img = img.resize(TARGET_SIZE, Image.NEAREST)
+        return np.divide(np.asarray(img), np.float32(255), dtype=np.float32)[np.newaxis]
+
+
+def pixels_to_input(pixels):
+    """Already-resized uint8 RGB pixels (224, 224, 3) to the same input as preprocess_image()"""
+    return (pixels.astype(np.float32) / 255.0)[np.newaxis]
 
 
 # --------------------------------------------------------
@@ -296,34 +492,259 @@ def run_tflite(interpreter, input_data):
     return interpreter.get_tensor(output_details[0]['index'])
 
 
+def run_model(name: str, input_data, model=None):
+    """Run one of MODEL_FILES (the serving version, or `model`) under its lock, timing the inference"""
+    model = model or get_model(name)
+    with model.lock:
+        with stage_timer("inference", model=name):
+            return run_tflite(model.interpreter, input_data)
+
+
+def run_merged(input_data, model=None) -> dict:
+    """One invoke of the merged model; returns {model name: raw output} by signature name"""
+    model = model or get_model(MERGED)
+    with model.lock:
+        runner = model.cache.get("runner")
+        if runner is None:
+            runner = model.cache["runner"] = model.interpreter.get_signature_runner()
+        with stage_timer("inference", model=MERGED):
+            return runner(image=input_data)
+
+
 # --------------------------------------------------------
 # 4. Predict skin attributes
 # --------------------------------------------------------
-def predict_skin_attributes(img_path: str) -> dict:
-    img = preprocess_image(img_path)
+TONE_LABELS = ["fair", "medium", "dark"]
+
+# Profile attribute produced by each model
+MODEL_ATTRIBUTES = {
+    "wrinkle": "wrinkles",
+    "acne": "acne",
+    "pigmentation": "hyperpigmentation",
+    "skintone": "skin_tone",
+}
+
+
+def interpret_output(name: str, output):
+    """Turn a model's raw output into its profile attribute value"""
+    if name == "skintone":
+        return TONE_LABELS[int(np.argmax(output[0]))]
+    return bool(output[0][0] > 0.5)
+
+
+def predict_attribute(name: str, img, model=None):
+    """
+    Run a single model on a preprocessed image
+
+    Returns:
+        tuple: (profile attribute, value), e.g. ("acne", True)
+    """
+    return MODEL_ATTRIBUTES[name], interpret_output(name, run_model(name, img, model))
+
+
+class InferenceTimeout(Exception):
+    """Raised when the models did not all finish before the request's deadline"""
+
+
+# Shared by all requests; TFLite releases the GIL in invoke(), so the four
+# interpreters of one request run on separate cores
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0")) or max(len(MODEL_FILES), os.cpu_count() or 1)
+_inference_pool = None
+_inference_pool_lock = threading.Lock()
+
+
+def inference_pool() -> ThreadPoolExecutor:
+    global _inference_pool
+    if _inference_pool is None:
+        with _inference_pool_lock:
+            if _inference_pool is None:
+                _inference_pool = ThreadPoolExecutor(INFERENCE_THREADS, thread_name_prefix="inference")
+                POOL_THREADS.labels("inference", "size").set(INFERENCE_THREADS)
+    return _inference_pool
+
+
+# "process" runs the models in worker processes with their own interpreters,
+# fed through shared memory, instead of the in-process thread pool
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "thread").lower()
+INFERENCE_PROCESSES = int(os.getenv("INFERENCE_PROCESSES", "0")) or max(1, (os.cpu_count() or 2) // 2)
+INFERENCE_PROCESS_SLOTS = int(os.getenv("INFERENCE_PROCESS_SLOTS", "0")) or 4 * INFERENCE_PROCESSES
+_process_backend = None
+_process_models = None
+
+
+def process_backend() -> ProcessInferenceBackend:
+    """The worker-process pool, started on first use in each (post-fork) process"""
+    global _process_backend, _process_models
+    if _process_backend is None:
+        with _inference_pool_lock:
+            if _process_backend is None:
+                models = {}
+                for name in active_model_files():
+                    source = resolve_model(name)
+                    sha256 = file_sha256(source.path)
+                    if source.sha256 and sha256 != source.sha256:
+                        raise ValueError(f"{name}: {source.filename} does not match its manifest checksum")
+                    models[name] = WorkerModel(name, source.path, sha256)
+                specs = {name: {"path": model.path, "signature": name == MERGED, "runtime": TFLITE_RUNTIME}
+                         for name, model in models.items()}
+                _process_backend = ProcessInferenceBackend(specs, INFERENCE_PROCESSES, INFERENCE_PROCESS_SLOTS)
+                _process_models = models
+                atexit.register(_process_backend.close)
+    return _process_backend
+
+
+def process_backend_models() -> dict:
+    """{name: WorkerModel} the worker processes run"""
+    process_backend()
+    return _process_models
+
+
+def _outputs_to_attributes(outputs: dict) -> dict:
+    return {MODEL_ATTRIBUTES[name]: interpret_output(name, output) for name, output in outputs.items()}
+
+
+# Shadow evaluation: candidate models (e.g. "pigmentation=pigmentation_v2.tflite,
+# skintone=skintone_v2.tflite") run on a sample of requests, never on the response path
+SHADOW_MODELS = dict(
+    item.strip().split("=", 1) for item in os.getenv("SHADOW_MODELS", "").split(",") if "=" in item
+)
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "0.05"))
+SHADOW_MAX_PENDING = int(os.getenv("SHADOW_MAX_PENDING", "16"))
+
+
+def resolve_candidate(name: str, refresh: bool = False) -> ModelSource:
+    fetch = download_model_file if refresh else fetch_model_file
+    return ModelSource(SHADOW_MODELS[name], fetch(SHADOW_MODELS[name]))
+
+
+# Candidates load lazily, on the shadow thread, the first time they are sampled
+candidate_registry = ModelRegistry(resolve_candidate, load_interpreter, cache_name="shadow_model")
+
+
+def run_candidate(name: str, img):
+    """Profile value predicted by the shadow candidate for model `name`"""
+    model = candidate_registry.get(name)
+    with model.lock:
+        return interpret_output(name, run_tflite(model.interpreter, img))
+
+
+shadow_evaluator = (
+    ShadowEvaluator(run_candidate, SHADOW_MODELS, SHADOW_SAMPLE_RATE, max_pending=SHADOW_MAX_PENDING)
+    if SHADOW_MODELS and SHADOW_SAMPLE_RATE > 0 else None
+)
 
-    wrinkle = load_tflite_model("wrinkle.tflite")
-    acne = load_tflite_model("acne_model.tflite")
-    pigmentation = load_tflite_model("pigmentation.tflite")
-    skintone = load_tflite_model("skintone.tflite")
 
-    wrinkle_pred = run_tflite(wrinkle, img)[0][0] > 0.5
-    acne_pred = run_tflite(acne, img)[0][0] > 0.5
-    pigmentation_pred = run_tflite(pigmentation, img)[0][0] > 0.5
+def shadow_predictions(img, attributes: dict):
+    """Queue a sampled request's input for the candidates, with the production values to compare"""
+    if shadow_evaluator is None:
+        return
+    production = {name: attributes[MODEL_ATTRIBUTES[name]] for name in SHADOW_MODELS
+                  if MODEL_ATTRIBUTES.get(name) in attributes}
+    shadow_evaluator.submit(img, production)
 
-    tone_logits = run_tflite(skintone, img)[0]
-    tone_idx = int(np.argmax(tone_logits))
-    tone_labels = ["fair", "medium", "dark"]
-    skin_tone = tone_labels[tone_idx]
 
+def _forget_inference_pool():
+    # Pool threads do not survive a fork; children build their own pool
+    global _inference_pool, _inference_pool_lock
+    _inference_pool = None
+    _inference_pool_lock = threading.Lock()
+    # The workers and their shared memory belong to the parent
+    global _process_backend, _process_models
+    _process_backend = _process_models = None
+    if shadow_evaluator is not None:
+        shadow_evaluator.forget_pool()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_inference_pool)
+
+
+def _predict_merged(img, model=None) -> dict:
+    outputs = run_merged(img, model)
+    return {MODEL_ATTRIBUTES[name]: interpret_output(name, outputs[name]) for name in MODEL_FILES}
+
+
+@profiled_thread
+def _pooled_prediction(name: str, img, model) -> dict:
+    busy = POOL_THREADS.labels("inference", "busy")
+    busy.inc()
+    try:
+        if name == MERGED:
+            return _predict_merged(img, model)
+        return dict([predict_attribute(name, img, model)])
+    finally:
+        busy.dec()
+
+
+def submit_predictions(img, models: Optional[dict] = None) -> dict:
+    """
+    Start every model on the shared inference pool
+
+    Each task runs in a copy of the caller's context, so stage timings and
+    profiling still attach to the request.
+
+    Args:
+        img: Preprocessed input shared by all models
+        models (dict): model_snapshot() to run; defaults to the serving versions
+
+    Returns:
+        dict: {concurrent.futures.Future: model name}; each future resolves
+        to {profile attribute: value}, one entry per model it covers (all four
+        for the merged model, and for the single task of the process backend)
+    """
+    models = models or model_snapshot()
+    if INFERENCE_BACKEND == "process":
+        # One task per request: the input is copied into shared memory once
+        future = process_backend().submit(img, list(models), postprocess=_outputs_to_attributes)
+        return {future: ", ".join(models)}
+    pool = inference_pool()
     return {
-        "wrinkles": bool(wrinkle_pred),
-        "acne": bool(acne_pred),
-        "hyperpigmentation": bool(pigmentation_pred),
-        "skin_tone": skin_tone
+        pool.submit(contextvars.copy_context().run, _pooled_prediction, name, img, model): name
+        for name, model in models.items()
     }
 
 
+def predict_from_input(img, deadline: Optional[float] = None, models: Optional[dict] = None) -> dict:
+    """
+    Run every model on a preprocessed (1, 224, 224, 3) input, concurrently
+
+    Args:
+        img: Preprocessed input shared by all models
+        deadline (float): time.monotonic() value by which all models must be done
+        models (dict): model_snapshot() to run; defaults to the serving versions
+
+    Raises:
+        InferenceTimeout: If the deadline passes first (queued models are cancelled)
+    """
+    futures = submit_predictions(img, models)
+    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+    done, pending = wait(futures, timeout=timeout)
+    if pending:
+        for future in pending:
+            future.cancel()
+        raise InferenceTimeout("Models still running at the deadline: " + ", ".join(sorted(futures[f] for f in pending)))
+    attributes = {}
+    for future in done:
+        try:
+            attributes.update(future.result())
+        except BackendBusy as e:
+            raise InferenceTimeout(str(e))
+    shadow_predictions(img, attributes)
+    return attributes
+
+
+def predict_skin_attributes(img_path: str) -> dict:
+    return predict_from_input(preprocess_image(img_path))
+
+
+def predict_skin_attributes_from_pixels(pixels) -> dict:
+    """predict_skin_attributes() for pixels that were decoded and resized by the caller"""
+    with stage_timer("preprocess"):
+        img = pixels_to_input(pixels)
+
+    return predict_from_input(img)
+
+
 # --------------------------------------------------------
 # 5. Combine quiz + model predictions
 # --------------------------------------------------------
@@ -386,7 +807,7 @@ def get_ingredients(profile, kb):
 # --------------------------------------------------------
 # 8. Product dataset
 # --------------------------------------------------------
-products = pd.DataFrame([
+product_records = [
     {"name":"The Ordinary Retinol 0.5%", "ingredients":["retinol"], "price":750, "rating":4.5, "preferences":["fragrance-free"]},
     {"name":"Minimalist Peptide Serum", "ingredients":["peptides"], "price":1050, "rating":4.2, "preferences":["vegan"]},
     {"name":"Bakuchiol Face Oil", "ingredients":["bakuchiol"], "price":1299, "rating":4.0, "preferences":[]},
@@ -405,7 +826,18 @@ products = pd.DataFrame([
     {"name":"Bakuchiol Anti-Aging Serum", "ingredients":["bakuchiol"], "price":1400, "rating":4.2, "preferences":["vegan"]},
     {"name":"Vitamin C + E Brightening Cream", "ingredients":["vitamin C"], "price":999, "rating":4.4, "preferences":["fragrance-free"]},
     {"name":"Salicylic Acid Spot Treatment", "ingredients":["salicylic acid"], "price":299, "rating":4.3, "preferences":[]},
-])
+]
+
+
+def __getattr__(name):
+    # `products`, the DataFrame view of the same catalog for pandas-based
+    # analysis, is built on first use: the service never needs pandas
+    if name == "products":
+        import pandas as pd
+
+        globals()["products"] = pd.DataFrame(product_records)
+        return globals()["products"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # --------------------------------------------------------
@@ -420,3 +852,22 @@ def recommend_products(profile, ingredients, df):
         df = df[df["preferences"].apply(lambda p: all(x in p for x in prefs) or not p)]
 
     return df.sort_values("rating", ascending=False).head(5)
+
+
+def recommend_product_records(profile, ingredients, records, limit=5):
+    """
+    Same filtering and ranking as recommend_products(), over the prebuilt
+    product_records so results are returned without a DataFrame round trip.
+    """
+    wanted = set(ingredients)
+    budget = profile.get("budget", 5000)
+    prefs = profile.get("preferences", [])
+
+    matches = [
+        p for p in records
+        if any(i in wanted for i in p["ingredients"])
+        and p["price"] <= budget
+        and (not prefs or not p["preferences"] or all(x in p["preferences"] for x in prefs))
+    ]
+    matches.sort(key=lambda p: p["rating"], reverse=True)
+    return matches[:limit]
@@ -0,0 +1,305 @@
+"""
+Upload Handling
+Validates parsed image uploads (size, format signature) chunk by chunk,
+keeping small uploads in memory and spooling large ones to disk. The early
+cut-off of oversized request bodies, before the form is parsed, is done by
+BodySizeLimitMiddleware.
+"""
+
+import hashlib
+import io
+import json
+import os
+import struct
+import tempfile
+import time
+from typing import Optional
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+# Leading bytes of the image formats the models can be fed
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+)
+
+
+class UploadRejected(Exception):
+    """Raised when an upload is refused; carries the HTTP status to answer with"""
+
+    def __init__(self, status_code: int, detail: str, reason: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.reason = reason
+
+
+def sniff_image_format(head: bytes) -> Optional[str]:
+    """
+    Identify an image from its first bytes
+
+    Args:
+        head (bytes): At least the first 12 bytes of the file
+
+    Returns:
+        str: Format name (jpeg, png, webp, gif, bmp) or None if unrecognised
+    """
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for signature, name in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return name
+    return None
+
+
+class ReceivedUpload:
+    """An accepted upload, held either in memory (`data`) or in a temp file (`path`)"""
+
+    def __init__(self, size: int, image_format: str,
+                 data: Optional[bytes] = None, path: Optional[str] = None,
+                 write_seconds: float = 0.0, sha256: Optional[str] = None):
+        self.size = size
+        self.image_format = image_format
+        self.data = data
+        self.path = path
+        # Hex SHA-256 of the upload bytes, hashed while they were received
+        self.sha256 = sha256
+        # Time spent writing the spooled copy to disk (0 for in-memory uploads)
+        self.write_seconds = write_seconds
+
+    @property
+    def in_memory(self) -> bool:
+        return self.data is not None
+
+    def source(self):
+        """Return something image loaders accept: a fresh BytesIO or a file path"""
+        return io.BytesIO(self.data) if self.in_memory else self.path
+
+    def cleanup(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+        self.data = None
+
+
+async def receive_upload(file, max_bytes: int, spool_bytes: int,
+                         chunk_size: int = DEFAULT_CHUNK_SIZE,
+                         spool_dir: Optional[str] = None) -> ReceivedUpload:
+    """
+    Read an UploadFile chunk by chunk, validating it as it goes
+
+    By the time this runs Starlette's form parser has already read the whole
+    multipart body into the UploadFile's own spooled file; the request body
+    limit is enforced before that by BodySizeLimitMiddleware. Here the first
+    chunk is sniffed for an image signature and the running size is checked
+    after every chunk, so a non-image or oversized file stops being copied
+    early. Uploads up to `spool_bytes` are copied into memory; past that the
+    bytes read so far move to a temp file of ours (a second copy on disk)
+    and the rest streams there. The bytes are hashed (SHA-256) on the way in.
+
+    Args:
+        file: Starlette/FastAPI UploadFile
+        max_bytes (int): Largest accepted upload
+        spool_bytes (int): Size above which the upload is spooled to disk
+        chunk_size (int): Bytes read per chunk
+        spool_dir (str): Directory for spooled uploads (system temp dir if None)
+
+    Returns:
+        ReceivedUpload: The accepted upload
+
+    Raises:
+        UploadRejected: 400 if empty, 415 if not a supported image, 413 if too large
+    """
+    head = await file.read(chunk_size)
+    if not head:
+        raise UploadRejected(400, "Empty file", "empty")
+
+    image_format = sniff_image_format(head)
+    if image_format is None:
+        raise UploadRejected(415, "Unsupported image format", "unsupported_format")
+
+    buffer = bytearray(head)
+    size = len(head)
+    digest = hashlib.sha256(head)
+    spool = None
+    spool_path = None
+    write_seconds = 0.0
+    try:
+        while True:
+            if size > max_bytes:
+                raise UploadRejected(413, f"File exceeds the {max_bytes} byte limit", "too_large")
+
+            if spool is None and size > spool_bytes:
+                fd, spool_path = tempfile.mkstemp(prefix="upload_", suffix=f".{image_format}", dir=spool_dir)
+                spool = os.fdopen(fd, "wb")
+                start = time.perf_counter()
+                spool.write(buffer)
+                write_seconds += time.perf_counter() - start
+                buffer = None
+
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            digest.update(chunk)
+            if spool is not None:
+                start = time.perf_counter()
+                spool.write(chunk)
+                write_seconds += time.perf_counter() - start
+            else:
+                buffer += chunk
+    except BaseException:
+        if spool is not None:
+            spool.close()
+            os.remove(spool_path)
+        raise
+
+    if spool is not None:
+        spool.close()
+        return ReceivedUpload(size, image_format, path=spool_path, write_seconds=write_seconds,
+                              sha256=digest.hexdigest())
+    return ReceivedUpload(size, image_format, data=bytes(buffer), sha256=digest.hexdigest())
+
+
+# --------------------------------------------------------
+# Request body limit
+# --------------------------------------------------------
+class _BodyTooLarge(Exception):
+    pass
+
+
+class BodySizeLimitMiddleware:
+    """
+    ASGI middleware answering 413 to request bodies over `max_bytes`
+
+    A declared Content-Length over the limit is refused before any of the
+    body is read. Bodies without one (chunked transfer encoding) are counted
+    as they are received, and the request is cut off with a 413 as soon as
+    the running total passes the limit; whatever the app would have answered
+    instead (e.g. a 400 for the truncated form) is discarded.
+
+    Args:
+        app: The wrapped ASGI app
+        max_bytes (int): Largest accepted body
+        detail (str): Error message of the 413 response
+    """
+
+    def __init__(self, app, max_bytes: int, detail: str = "Request body too large"):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.body = json.dumps({"error": detail}).encode()
+
+    async def _reject(self, send):
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(self.body)).encode())]})
+        await send({"type": "http.response.body", "body": self.body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                if value.isdigit() and int(value) > self.max_bytes:
+                    await self._reject(send)
+                    return
+                break
+
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if exceeded:
+                # Replace the app's answer to the cut-off body with the 413
+                if not started:
+                    started = True
+                    await self._reject(send)
+                return
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            pass
+        if exceeded and not started:
+            await self._reject(send)
+
+
+# --------------------------------------------------------
+# Pre-resized tensor payloads (internal callers)
+# --------------------------------------------------------
+TENSOR_SHAPE = (224, 224, 3)
+TENSOR_BYTES = TENSOR_SHAPE[0] * TENSOR_SHAPE[1] * TENSOR_SHAPE[2]
+MAX_TENSOR_HEADER_BYTES = 4096
+_HEADER_LENGTH = struct.Struct(">I")
+
+
+def encode_tensor_payload(fields: dict, pixels) -> bytes:
+    """
+    Build a tensor payload: 4-byte big-endian header length, JSON header, raw pixels
+
+    Args:
+        fields (dict): Quiz fields (skin_type, sensitivity, budget, ...)
+        pixels: uint8 array of shape (224, 224, 3), RGB, already resized
+
+    Returns:
+        bytes: Request body for /internal/analyze/tensor
+    """
+    header = json.dumps({**fields, "shape": list(TENSOR_SHAPE), "dtype": "uint8"}).encode()
+    return _HEADER_LENGTH.pack(len(header)) + header + bytes(memoryview(pixels).cast("B"))
+
+
+def decode_tensor_payload(body: bytes):
+    """
+    Validate and split a tensor payload built by encode_tensor_payload()
+
+    The pixel array is a zero-copy, read-only view of `body`.
+
+    Returns:
+        tuple: (fields dict, uint8 array of shape (224, 224, 3))
+
+    Raises:
+        UploadRejected: 400 for a malformed header, 422 for a wrong shape/dtype/size
+    """
+    import numpy as np
+
+    if len(body) < _HEADER_LENGTH.size:
+        raise UploadRejected(400, "Missing tensor header", "bad_tensor")
+    (header_length,) = _HEADER_LENGTH.unpack_from(body)
+    if header_length > MAX_TENSOR_HEADER_BYTES or _HEADER_LENGTH.size + header_length > len(body):
+        raise UploadRejected(400, "Invalid tensor header length", "bad_tensor")
+
+    offset = _HEADER_LENGTH.size + header_length
+    try:
+        fields = json.loads(body[_HEADER_LENGTH.size:offset])
+    except ValueError:
+        raise UploadRejected(400, "Tensor header is not valid JSON", "bad_tensor")
+    if not isinstance(fields, dict):
+        raise UploadRejected(400, "Tensor header must be a JSON object", "bad_tensor")
+
+    if tuple(fields.pop("shape", ())) != TENSOR_SHAPE or fields.pop("dtype", None) != "uint8":
+        raise UploadRejected(422, f"Tensor must be uint8 with shape {list(TENSOR_SHAPE)}", "bad_tensor")
+    if len(body) - offset != TENSOR_BYTES:
+        raise UploadRejected(422, f"Expected {TENSOR_BYTES} pixel bytes, got {len(body) - offset}", "bad_tensor")
+
+    pixels = np.frombuffer(body, dtype=np.uint8, offset=offset).reshape(TENSOR_SHAPE)
+    return fields, pixels